@@ -2,17 +2,41 @@ import argparse
 import os.path
 import glob
 from multimodal.dataset.video import VideoDataset
+from multimodal.batch import run_batch
+
+
+def add_subtitles_to_dataset(dataset_path, subtitles, subtitle_name=None, remove_existing=False):
+    with VideoDataset(dataset_path, 'r+') as dataset:
+        if remove_existing:
+            if subtitle_name is None:
+                dataset.remove_modality('subtitles')
+            else:
+                dataset.remove_facet('subtitles', subtitle_name)
+        if len(subtitles) > 1:
+            for i, s in enumerate(subtitles):
+                name = subtitle_name
+                if name is not None:
+                    name += str(i)
+                dataset.add_subtitles(s, name=name)
+        else:
+            [s] = subtitles
+            dataset.add_subtitles(s, name=subtitle_name)
+
 
 def main():
     parser = argparse.ArgumentParser(description="Add subtitles to datasets")
     parser.add_argument('datasets', help="Dataset paths", nargs='+')
-    parser.add_argument('--subtitle-format', help="Glob format to use for matching subtitles", default='*.srt')
+    parser.add_argument('--subtitle-format', help="Glob format to use for matching subtitles, SubRip and TTML "
+                                                          "files are supported", default='*.srt')
     parser.add_argument('--subtitle-name', help="The name to use for identifying the subtitle track in the data set")
     parser.add_argument('--dry-run',
                         help="If set, don't actually do anything just print out what would be done",
                         action='store_true')
     parser.add_argument('--remove-existing', help="Remove existing subtitles in the datasets, essentially doing a subtitle reset", action='store_true')
     parser.add_argument('--minimum-matching-ratio', help="The paths need to overlap with at least this much to even be suggested to the user", type=float, default=0.7)
+    parser.add_argument('--n-processes', help="Number of processes to use", type=int, default=1)
+    parser.add_argument('--manifest', help="If given, record processed datasets in this file and skip the ones "
+                                           "which are already done when rerun")
     args = parser.parse_args()
 
     dataset_paths = set()
@@ -67,6 +91,7 @@ def main():
             collected_pairs = [current_pair]
     all_collections.append(collected_pairs)
 
+    jobs = []
     for collected_pairs in all_collections:
         try:
             [dataset_path] = [path for path, type in collected_pairs if type == 'dataset']
@@ -77,22 +102,12 @@ def main():
         if len(subtitles) > 0:
             dataset_paths.remove(dataset_path)
             print("Extracting subtitles ", dataset_path, subtitles)
-            if not args.dry_run:
-                with VideoDataset(dataset_path, 'r+') as dataset:
-                    if args.remove_existing:
-                        if args.subtitle_name is None:
-                            dataset.remove_modality('subtitles')
-                        else:
-                            dataset.remove_facet('subtitles', args.subtitle_name)
-                    if len(subtitles) > 1:
-                        for i, s in enumerate(subtitles):
-                            subtitle_name = args.subtitle_name
-                            if subtitle_name is not None:
-                                subtitle_name += str(i)
-                            dataset.add_subtitles(s, name=subtitle_name)
-                    else:
-                        [s] = subtitles
-                        dataset.add_subtitles(s, name=args.subtitle_name)
+            jobs.append((dataset_path, subtitles))
+    if not args.dry_run:
+        report = run_batch(add_subtitles_to_dataset, jobs, n_processes=args.n_processes,
+                           kwargs=dict(subtitle_name=args.subtitle_name, remove_existing=args.remove_existing),
+                           manifest_path=args.manifest)
+        report.print_summary()
     print("Datasets without subtitles: ", sorted(dataset_paths))
 
 if __name__ == '__main__':
@@ -1,7 +1,6 @@
 """
 Goes through a dataset and add dataset to audio tracks with Voice Activity Detection data.
 """
-import multiprocessing.dummy as multiprocessing
 import os.path
 import argparse
 import numpy as np
@@ -9,6 +8,7 @@ import scipy.io.wavfile as wavefile
 import glob
 
 from multimodal.dataset.add_vad_signal import add_voiced_segment_facet
+from multimodal.batch import run_batch
 
 def main():
     parser = argparse.ArgumentParser(description="Script for finding speech in the audio "
@@ -19,8 +19,23 @@ def main():
                         type=int,
                         choices=(0,1,2,3),
                         default=3)
+    parser.add_argument('--backend',
+                        help="VAD backend to use, 'webrtc' is the most accurate, 'energy' is a much faster "
+                             "energy/zero-crossing detector",
+                        choices=('webrtc', 'energy'),
+                        default='webrtc')
+    parser.add_argument('--frame-duration-ms', help="Duration of the frames classified by the VAD", type=int,
+                        choices=(10, 20, 30), default=30)
+    parser.add_argument('--energy-threshold-db',
+                        help="Energy backend: frames below this energy (dB relative full scale) are never speech",
+                        type=float, default=-45.)
+    parser.add_argument('--noise-margin-db',
+                        help="Energy backend: frames needs to be this much louder than the estimated noise floor",
+                        type=float, default=10.)
     parser.add_argument('--n-processes', type=int, default=1)
     parser.add_argument('--overwrite', action='store_true')
+    parser.add_argument('--manifest', help="If given, record processed datasets in this file and skip the ones "
+                                           "which are already done when rerun")
     args = parser.parse_args()
 
     dataset_paths = []
@@ -32,15 +47,19 @@ def main():
             dataset_paths.append(dataset_path)
     print("Dataset paths: ", dataset_paths)
 
-    if args.n_processes > 1:
-        with multiprocessing.Pool(args.n_processes) as pool:
-            for dataset_path in dataset_paths:
-                pool.apply_async(add_voiced_segment_facet, (dataset_path, args.mode), kwds={'overwrite': args.overwrite})
-            pool.close()
-            pool.join()
+    if args.backend == 'energy':
+        backend_kwargs = dict(energy_threshold_db=args.energy_threshold_db, noise_margin_db=args.noise_margin_db)
     else:
-        for dataset_path in dataset_paths:
-            add_voiced_segment_facet(dataset_path, args.mode, overwrite=args.overwrite)
+        backend_kwargs = dict()
+    kwargs = dict(vad_mode=args.mode,
+                  frame_duration_ms=args.frame_duration_ms,
+                  overwrite=args.overwrite,
+                  backend=args.backend,
+                  backend_kwargs=backend_kwargs)
+
+    report = run_batch(add_voiced_segment_facet, dataset_paths, n_processes=args.n_processes, kwargs=kwargs,
+                       manifest_path=args.manifest)
+    report.print_summary()
 
 
 
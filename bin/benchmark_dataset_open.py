@@ -0,0 +1,131 @@
+"""
+Benchmark of how long it takes to open datasets and read a short piece of audio from them, one at a time and as a
+VideoDatasets collection which opens them on demand in a pool of limited size. Can generate a directory of synthetic
+datasets with audio and subtitles to run the benchmark on.
+"""
+import argparse
+import glob
+import os.path
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from multimodal.dataset import handles
+from multimodal.dataset.video import VideoDataset, VideoDatasets
+from multimodal.dataset.facet.subtitle_facet import SubtitleFacet
+
+
+def make_subrip_file(path, n_subtitles, rng):
+    with open(path, 'w') as fp:
+        start = 0.
+        for i in range(n_subtitles):
+            start += rng.uniform(0.5, 3)
+            end = start + rng.uniform(0.3, 10)
+            fp.write('{}\n{} --> {}\n<font color="#ffff00">Subtitle number {}</font>\nwith <i>two</i> lines\n\n'.format(
+                i + 1, format_timestamp(start), format_timestamp(end), i))
+            start = end
+
+
+def format_timestamp(seconds):
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return '{:02d}:{:02d}:{:06.3f}'.format(int(hours), int(minutes), seconds).replace('.', ',')
+
+
+def generate_datasets(directory, n_datasets, n_subtitles, n_subtitle_facets, audio_seconds, rng):
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        subrip_paths = []
+        for i in range(n_subtitle_facets):
+            subrip_path = os.path.join(tmp_dir, 'subtitles{}.srt'.format(i))
+            make_subrip_file(subrip_path, n_subtitles, rng)
+            subrip_paths.append(subrip_path)
+        rate = 16000
+        sound = (rng.randn(rate * audio_seconds) * 1000).astype(np.int16)
+        for i in range(n_datasets):
+            dataset_path = os.path.join(directory, 'synthetic_{:06d}.h5'.format(i))
+            with h5py.File(dataset_path, 'w') as store:
+                audio_group = store.require_group('audio').require_group('audio0')
+                audio_group.create_dataset('sound', data=sound, chunks=True, compression='gzip', shuffle=True)
+                audio_group.attrs['rate'] = rate
+                audio_group.attrs['FacetHandler'] = 'AudioFacet'
+                subtitles_group = store.require_group('subtitles')
+                for subrip_path in subrip_paths:
+                    name = os.path.splitext(os.path.basename(subrip_path))[0]
+                    SubtitleFacet.create_facet(name, subtitles_group, subrip_path)
+            if (i + 1) % 1000 == 0:
+                print("Generated {}/{} datasets".format(i + 1, n_datasets))
+
+
+def benchmark_open(dataset_paths, read_subtitles=False):
+    open_times = []
+    for dataset_path in dataset_paths:
+        t0 = time.perf_counter()
+        with VideoDataset(dataset_path) as dataset:
+            audio = dataset.get_facet('audio')
+            audio.get_frames((0, audio.get_samplerate()))
+            if read_subtitles:
+                dataset.get_facet('subtitles').get_times()
+        open_times.append(time.perf_counter() - t0)
+    return np.array(open_times)
+
+
+def benchmark_collection(dataset_paths, n_reads, rng):
+    """
+    Create a collection of all datasets and read one second of audio from randomly chosen datasets
+    :return: The time to create the collection and the time of the reads
+    """
+    t0 = time.perf_counter()
+    with VideoDatasets(dataset_paths) as datasets:
+        create_time = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for i in rng.randint(len(dataset_paths), size=n_reads):
+            audio = datasets.datasets[i].get_facet('audio')
+            audio.get_frames((0, audio.get_samplerate()))
+        read_time = time.perf_counter() - t0
+    return create_time, read_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark opening datasets and reading one second of audio")
+    parser.add_argument('directory', help="Directory with datasets")
+    parser.add_argument('--generate', help="Generate this many synthetic datasets in the directory first", type=int)
+    parser.add_argument('--n-subtitles', help="Number of subtitles per generated subtitle facet", type=int,
+                        default=1000)
+    parser.add_argument('--n-subtitle-facets', help="Number of subtitle facets per generated dataset", type=int,
+                        default=2)
+    parser.add_argument('--audio-seconds', help="Length of the generated audio", type=int, default=10)
+    parser.add_argument('--read-subtitles', help="Also read the subtitle times of the default subtitle facet",
+                        action='store_true')
+    parser.add_argument('--max-open', help="Sizes of the handle pool to try for the collection", type=int, nargs='+',
+                        default=[16, 256])
+    parser.add_argument('--n-reads', help="Number of random reads from the collection", type=int, default=10000)
+    args = parser.parse_args()
+
+    if args.generate is not None:
+        rng = np.random.RandomState(1729)
+        generate_datasets(args.directory, args.generate, args.n_subtitles, args.n_subtitle_facets,
+                          args.audio_seconds, rng)
+
+    dataset_paths = sorted(glob.glob(os.path.join(args.directory, '**', '*.h5'), recursive=True))
+    t0 = time.perf_counter()
+    open_times = benchmark_open(dataset_paths, read_subtitles=args.read_subtitles)
+    total_time = time.perf_counter() - t0
+    print("Opened {} datasets in {:.2f}s".format(len(dataset_paths), total_time))
+    if len(open_times) > 0:
+        print("Per dataset: mean {:.2f}ms, median {:.2f}ms, 95th percentile {:.2f}ms".format(
+            1000 * np.mean(open_times), 1000 * np.median(open_times), 1000 * np.percentile(open_times, 95)))
+
+        for max_open in args.max_open:
+            handles.close_files()
+            handles.pool = handles.HandlePool()
+            handles.set_max_open(max_open)
+            create_time, read_time = benchmark_collection(dataset_paths, args.n_reads, np.random.RandomState(1729))
+            print("Pool of {}: collection created in {:.3f}s, {} random reads in {:.2f}s, {}".format(
+                max_open, create_time, args.n_reads, read_time, handles.get_stats().format_summary()))
+
+
+if __name__ == '__main__':
+    main()
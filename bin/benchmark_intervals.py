@@ -0,0 +1,72 @@
+"""
+Benchmark of the interval functions used when preprocessing audio for transcription, comparing the per-interval loops
+they used to be with the vectorized implementations in multimodal.intervals. The intervals are in samples, like the
+voiced segments and subtitle times of a long file.
+"""
+import argparse
+import time
+
+import numpy as np
+
+import multimodal.intervals as intervals
+from multimodal.tests.test_intervals import (loop_filter_overlapping_intervals, loop_merge_intervals,
+                                             loop_merge_annotated_intervals, loop_limit_length)
+
+
+def make_segmentation(n_intervals, mean_length, rng):
+    boundaries = np.cumsum(rng.randint(1, 2 * mean_length, size=2 * n_intervals))
+    return boundaries.reshape(n_intervals, 2)
+
+
+def best_time(function, repeats):
+    timings = []
+    for i in range(repeats):
+        t0 = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - t0)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the interval functions")
+    parser.add_argument('--n-intervals', help="Number of voiced intervals", type=int, default=300000)
+    parser.add_argument('--repeats', help="Number of times to repeat each measurement", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(1729)
+    sample_rate = 16000
+    voiced = make_segmentation(args.n_intervals, sample_rate // 2, rng)
+    subtitles = make_segmentation(args.n_intervals // 4, 2 * sample_rate, rng).astype(np.uint64)
+    words = [[start / sample_rate, end / sample_rate, 'word'] for start, end in voiced.tolist()]
+    merged_subtitles = intervals.merge_intervals(subtitles, sample_rate // 3)
+
+    benchmarks = [
+        ('filter_overlapping_intervals',
+         lambda: loop_filter_overlapping_intervals(voiced, merged_subtitles, 0.7),
+         lambda: intervals.filter_overlapping_intervals(voiced, merged_subtitles, 0.7)),
+        ('merge_intervals',
+         lambda: loop_merge_intervals(subtitles, sample_rate // 3),
+         lambda: intervals.merge_intervals(subtitles, sample_rate // 3)),
+        ('merge_annotated_intervals',
+         lambda: loop_merge_annotated_intervals(words, 0.5),
+         lambda: intervals.merge_annotated_intervals(words, 0.5)),
+        ('limit_length',
+         lambda: list(loop_limit_length(voiced, sample_rate // 2)),
+         lambda: list(intervals.limit_length(voiced, sample_rate // 2))),
+    ]
+    print("{} voiced intervals, {} subtitles".format(len(voiced), len(subtitles)))
+    for name, loop_function, vectorized_function in benchmarks:
+        loop_result = loop_function()
+        vectorized_result = vectorized_function()
+        if isinstance(loop_result, np.ndarray):
+            assert np.array_equal(loop_result.reshape(-1, 2), vectorized_result)
+        else:
+            assert loop_result == vectorized_result
+        loop_time = best_time(loop_function, args.repeats)
+        vectorized_time = best_time(vectorized_function, args.repeats)
+        print("{:<30} loop {:.3f}s, vectorized {:.3f}s ({:.1f}x)".format(name, loop_time, vectorized_time,
+                                                                         loop_time / vectorized_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark of iterating over subtitled audio and video with a simulated training step, reading the items synchronously
+or prefetching them in the background. A synthetic dataset is generated unless one is given.
+"""
+import argparse
+import os.path
+import tempfile
+import time
+
+import h5py
+import imageio
+import numpy as np
+
+from multimodal.dataset.facet.subtitle_facet import SubtitleFacet
+from multimodal.dataset.prefetch import PrefetchIterator
+from multimodal.dataset.video import VideoDataset
+
+
+def format_timestamp(seconds):
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return '{:02d}:{:02d}:{:06.3f}'.format(int(hours), int(minutes), seconds).replace('.', ',')
+
+
+def generate_dataset(dataset_path, seconds, fps, frame_size, rng):
+    subrip_path = dataset_path + '.srt'
+    with open(subrip_path, 'w') as fp:
+        start, i = 0., 0
+        while True:
+            start += rng.uniform(0.2, 1)
+            end = start + rng.uniform(0.5, 3)
+            if end > seconds:
+                break
+            i += 1
+            fp.write('{}\n{} --> {}\nSubtitle number {}\n\n'.format(i, format_timestamp(start), format_timestamp(end),
+                                                                   i))
+            start = end
+    n_frames = int(seconds * fps)
+    frame = rng.randint(0, 255, size=(frame_size, frame_size, 3)).astype(np.uint8)
+    encoded = [np.frombuffer(imageio.imwrite('<bytes>', np.roll(frame, i, axis=1), format='jpeg'), dtype=np.uint8)
+               for i in range(n_frames)]
+    with h5py.File(dataset_path, 'w') as store:
+        audio_group = store.require_group('audio').create_group('audio0')
+        audio_group.attrs['FacetHandler'] = 'AudioFacet'
+        audio_group.attrs['rate'] = 16000
+        audio_group.create_dataset('sound', data=rng.randint(-2000, 2000, size=seconds * 16000).astype(np.int16),
+                                   chunks=True, compression='gzip', shuffle=True)
+        video_group = store.require_group('video').create_group('video0')
+        video_group.attrs['FacetHandler'] = 'VideoFacet'
+        video_group.attrs['rate'] = fps
+        video_group.create_dataset('frame_sizes', data=np.cumsum([len(data) for data in encoded]).astype(np.uint64))
+        video_group.create_dataset('frames', data=np.concatenate(encoded))
+        SubtitleFacet.create_facet('subtitles', store.require_group('subtitles'), subrip_path)
+    os.remove(subrip_path)
+
+
+def run(items, step_time):
+    t0 = time.perf_counter()
+    for item in items:
+        time.sleep(step_time)
+    return time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prefetching of subtitled streams")
+    parser.add_argument('--dataset', help="Dataset to read, a synthetic one is generated if not given")
+    parser.add_argument('--seconds', help="Length of the synthetic dataset", type=int, default=120)
+    parser.add_argument('--step-time', help="Simulated time per item spent by the consumer", type=float, default=0.01)
+    parser.add_argument('--depth', help="Number of items loaded ahead", type=int, default=8)
+    parser.add_argument('--workers', help="Numbers of worker threads to try", type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dataset_path = args.dataset
+        if dataset_path is None:
+            dataset_path = os.path.join(tmp_dir, 'dataset.h5')
+            generate_dataset(dataset_path, args.seconds, 25, 128, np.random.RandomState(1729))
+        with VideoDataset(dataset_path) as dataset:
+            wrapper = dataset.get_subtitled_streams(['audio', 'video'])
+            print("{} items, {:.1f}ms simulated step".format(len(wrapper), 1000 * args.step_time))
+            elapsed = run((wrapper[i] for i in range(len(wrapper))), args.step_time)
+            print("{:<20} {:.2f}s".format('synchronous', elapsed))
+            for n_workers in args.workers:
+                with PrefetchIterator(wrapper, depth=args.depth, n_workers=n_workers) as iterator:
+                    elapsed = run(iterator, args.step_time)
+                print("{:<20} {:.2f}s, {}".format('{} workers'.format(n_workers), elapsed,
+                                                  iterator.stats.format_summary()))
+
+
+if __name__ == '__main__':
+    main()
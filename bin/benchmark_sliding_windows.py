@@ -0,0 +1,52 @@
+"""
+Benchmark of reading overlapping windows over the audio and video of a dataset, reading every window separately or
+with SlidingWindows which reads each frame once. A synthetic dataset is generated unless one is given.
+"""
+import argparse
+import os.path
+import tempfile
+import time
+
+import numpy as np
+
+from benchmark_prefetch import generate_dataset
+from multimodal.dataset.video import VideoDataset, get_aligned_frame_ranges
+
+
+def read_separately(streams, times):
+    frame_ranges = [get_aligned_frame_ranges(times, stream.get_samplerate()) for stream in streams]
+    for i in range(len(times)):
+        frames = [stream.get_frames(tuple(ranges[i])) for stream, ranges in zip(streams, frame_ranges)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sliding windows over audio and video")
+    parser.add_argument('--dataset', help="Dataset to read, a synthetic one is generated if not given")
+    parser.add_argument('--seconds', help="Length of the synthetic dataset", type=int, default=60)
+    parser.add_argument('--window', help="Window length in seconds", type=float, default=2.)
+    parser.add_argument('--hops', help="Hops in seconds to try", type=float, nargs='+', default=[0.5, 0.1])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dataset_path = args.dataset
+        if dataset_path is None:
+            dataset_path = os.path.join(tmp_dir, 'dataset.h5')
+            generate_dataset(dataset_path, args.seconds, 25, 128, np.random.RandomState(1729))
+        with VideoDataset(dataset_path) as dataset:
+            for hop in args.hops:
+                windows = dataset.get_sliding_windows(['audio', 'video'], args.window, hop)
+                streams = windows.streams
+                t0 = time.perf_counter()
+                read_separately(streams, windows.times)
+                separate_time = time.perf_counter() - t0
+                t0 = time.perf_counter()
+                for times, frames in windows:
+                    pass
+                sliding_time = time.perf_counter() - t0
+                print("hop {:.2f}s, {} windows: separately {:.2f}s, sliding {:.2f}s ({:.1f}x), frames read {}".format(
+                    hop, len(windows), separate_time, sliding_time, separate_time / sliding_time,
+                    windows.get_n_read()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark of the SubRip parsers, comparing parse (Subtitle objects with timedeltas) with parse_arrays (numpy arrays
+and packed content).
+"""
+import argparse
+import io
+import time
+
+import numpy as np
+
+import multimodal.srt as srt
+
+
+def make_subrip_text(n_subtitles, rng):
+    starts = np.cumsum(rng.uniform(0.5, 3, size=n_subtitles) + rng.uniform(0.3, 10, size=n_subtitles))
+    ends = starts + rng.uniform(0.3, 10, size=n_subtitles)
+    blocks = []
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        blocks.append('{}\n{} --> {}\n<font color="#ffff00">Subtitle number {}</font>\nwith <i>two</i> lines\n\n'.format(
+            i + 1, format_timestamp(start), format_timestamp(end), i))
+    return ''.join(blocks)
+
+
+def format_timestamp(seconds):
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return '{:02d}:{:02d}:{:06.3f}'.format(int(hours), int(minutes), seconds).replace('.', ',')
+
+
+def parse_to_seconds(text):
+    """
+    What SubtitleFacet.create_facet used to do: parse into Subtitle objects and convert the times to seconds
+    """
+    subtitles = list(srt.parse(text))
+    times = np.array([(subtitle.start.total_seconds(), subtitle.end.total_seconds()) for subtitle in subtitles])
+    contents = [subtitle.content for subtitle in subtitles]
+    return times, contents
+
+
+def best_time(function, repeats):
+    timings = []
+    for i in range(repeats):
+        t0 = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - t0)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SubRip parsing")
+    parser.add_argument('--n-subtitles', help="Number of subtitles in the generated file", type=int, default=100000)
+    parser.add_argument('--repeats', help="Number of times to repeat each measurement", type=int, default=3)
+    args = parser.parse_args()
+
+    text = make_subrip_text(args.n_subtitles, np.random.RandomState(1729))
+    times, contents = parse_to_seconds(text)
+    arrays = srt.parse_arrays(text)
+    assert np.array_equal(times, arrays.times) and contents == arrays.get_contents()
+
+    parse_time = best_time(lambda: parse_to_seconds(text), args.repeats)
+    arrays_time = best_time(lambda: srt.parse_arrays(text), args.repeats)
+    stream_time = best_time(lambda: srt.concatenate_arrays(srt.iter_parse_arrays(io.StringIO(text))), args.repeats)
+    print("{} subtitles, {:.1f} MB".format(args.n_subtitles, len(text) / 2**20))
+    print("parse:             {:.3f}s".format(parse_time))
+    print("parse_arrays:      {:.3f}s ({:.1f}x)".format(arrays_time, parse_time / arrays_time))
+    print("iter_parse_arrays: {:.3f}s ({:.1f}x)".format(stream_time, parse_time / stream_time))
+
+
+if __name__ == '__main__':
+    main()
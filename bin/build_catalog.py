@@ -0,0 +1,31 @@
+"""
+Build or update the catalog of the datasets in a directory tree, with their modalities and facets. Only datasets which
+are new or have changed since the last run are read.
+"""
+import argparse
+import glob
+import os.path
+
+from multimodal.dataset.catalog import CorpusCatalog, get_catalog_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a catalog of the datasets of a corpus")
+    parser.add_argument('directory', help="Directory with datasets")
+    parser.add_argument('--catalog', help="Path of the catalog database, by default in the directory")
+    parser.add_argument('--n-processes', help="Number of processes to use", type=int, default=1)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        raise ValueError("Not a directory: {}".format(args.directory))
+    dataset_paths = glob.glob(os.path.join(args.directory, '**', '*.h5'), recursive=True)
+    catalog_path = args.catalog if args.catalog is not None else get_catalog_path(args.directory)
+
+    with CorpusCatalog(catalog_path) as catalog:
+        report = catalog.update(dataset_paths, n_processes=args.n_processes)
+        report.print_summary()
+        print("The catalog contains {} datasets".format(len(catalog.get_catalogued_datasets())))
+
+
+if __name__ == '__main__':
+    main()
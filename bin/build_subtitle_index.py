@@ -0,0 +1,34 @@
+"""
+Build or update an inverted index from the words of the subtitles of all datasets in a directory tree to the time
+segments where they are shown. Only datasets which are new or have changed since the last run are processed.
+"""
+import argparse
+import glob
+import os.path
+
+from multimodal.dataset.subtitle_index import SubtitleIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an index of the words in the subtitles of datasets")
+    parser.add_argument('directories', help="Directories with datasets", nargs='+')
+    parser.add_argument('--index', help="Path of the index database", required=True)
+    parser.add_argument('--modality', help="The modality with the subtitle facets", default='subtitles')
+    parser.add_argument('--n-processes', help="Number of processes to use", type=int, default=1)
+    args = parser.parse_args()
+
+    dataset_paths = []
+    for directory in args.directories:
+        if os.path.isdir(directory):
+            dataset_paths.extend(glob.glob(os.path.join(directory, '**', '*.h5'), recursive=True))
+        else:
+            raise ValueError("Not a directory: {}".format(directory))
+
+    with SubtitleIndex(args.index) as index:
+        report = index.update(dataset_paths, n_processes=args.n_processes, modality=args.modality)
+        report.print_summary()
+        print("The index contains {} datasets".format(len(index.get_indexed_datasets())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+Export the subtitled streams of all datasets in a directory tree to shard files which can be read sequentially, see
+multimodal.dataset.shards. Datasets which were exported by an earlier run into the same output directory are skipped.
+"""
+import argparse
+import glob
+import os
+import os.path
+
+from multimodal.batch import run_batch
+from multimodal.dataset.shards import export_dataset, write_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the subtitled streams of datasets to shards")
+    parser.add_argument('directories', help="Directories with datasets", nargs='+')
+    parser.add_argument('--output', help="Directory to write the shards to", required=True)
+    parser.add_argument('--streams', help="The stream modalities to export", nargs='+', default=['audio'])
+    parser.add_argument('--wrapper', help="The items to export", choices=['subtitled', 'complement', 'randomized'],
+                        default='subtitled')
+    parser.add_argument('--subtitle-id', help="The subtitle facet to use, the default facet if not given")
+    parser.add_argument('--max-duration', help="Randomly crop longer items to this many seconds", type=float)
+    parser.add_argument('--seed', help="Seed of the random cropping", type=int, default=1729)
+    parser.add_argument('--shard-size', help="Size of the shards in MB", type=float, default=256)
+    parser.add_argument('--n-processes', help="Number of processes to use", type=int, default=1)
+    args = parser.parse_args()
+
+    dataset_paths = []
+    for directory in args.directories:
+        if os.path.isdir(directory):
+            dataset_paths.extend(glob.glob(os.path.join(directory, '**', '*.h5'), recursive=True))
+        else:
+            raise ValueError("Not a directory: {}".format(directory))
+    dataset_paths.sort()
+
+    os.makedirs(args.output, exist_ok=True)
+    report = run_batch(export_dataset, dataset_paths, n_processes=args.n_processes,
+                       kwargs=dict(output_directory=args.output, stream_facets=args.streams,
+                                   wrapper_type=args.wrapper, subtitle_id=args.subtitle_id,
+                                   max_duration=args.max_duration, seed=args.seed,
+                                   shard_bytes=int(args.shard_size * 2**20)),
+                       manifest_path=os.path.join(args.output, 'manifest.jsonl'))
+    report.print_summary()
+    index = write_index(args.output, dataset_paths)
+    print("The export has {} items in {} shards from {} datasets".format(index['n_items'], len(index['shards']),
+                                                                         len(index['datasets'])))
+
+
+if __name__ == '__main__':
+    main()
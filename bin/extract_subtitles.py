@@ -16,7 +16,7 @@ def main():
             with VideoDataset(dataset_path) as dataset:
                 subtitles_facet = dataset.get_facet('subtitles', args.facet)
                 if args.subrip:
-                    output_fp.write(subtitles_facet.get_subrip_texts())
+                    subtitles_facet.write_subrip(output_fp)
                 else:
                     output_fp.write('\n'.join(subtitles_facet.get_texts()))
 
@@ -2,17 +2,25 @@
 
 import argparse
 import csv
-import multiprocessing
+import os.path
 from collections import defaultdict
 
 from multimodal.dataset.make_video_dataset import make_dataset
+from multimodal.dataset.facet.subtitle_facet import TTML_EXTENSIONS
+from multimodal.batch import run_batch
+
+SUBTITLE_EXTENSIONS = ('.srt',) + TTML_EXTENSIONS
+# The columns of the index made by make_video_index.py with the subtitles of a video, in order of preference
+SUBTITLE_COLUMNS = ('srt', 'ttml')
 
 
 def main():
     parser = argparse.ArgumentParser(description="Script for making a multimodal dataset from video")
     parser.add_argument('input', help="Either a CSV containing an index of video files to process, "
                                       "or a single video file followed by zero or more corresponding subtitles. "
-                                      "The first subtitle will be flagged as default.", nargs='+')
+                                      "The first subtitle will be flagged as default. From a CSV index only one "
+                                      "subtitle file is used per video, the srt file if there is one and otherwise "
+                                      "the ttml file, as they hold the same subtitles.", nargs='+')
     parser.add_argument('--nprocesses', help="Number of processes to use for creating datasets", type=int, default=1)
     parser.add_argument('--skip-video', help="Don't extract the video stream", action='store_true')
     parser.add_argument('--skip-audio', help="Don't extract the audio stream", action='store_true')
@@ -24,37 +32,37 @@ def main():
     parser.add_argument('--target-height',
                         help="Scale video to have this height at most. Width will be rescaled to keep the aspect ratio",
                         type=int)
+    parser.add_argument('--manifest', help="If given, record processed videos in this file and skip the ones "
+                                           "which are already done when rerun")
     args = parser.parse_args()
 
     if '.csv' in args.input[0]:
         with open(args.input[0]) as fp:
             csv_reader = csv.DictReader(fp)
-            videos = list(csv_reader)
+            # The index made by make_video_index.py has one column per subtitle format, the formats are different
+            # encodings of the same subtitles so only one is added
+            jobs = []
+            for video in csv_reader:
+                subtitles = [video[column] for column in SUBTITLE_COLUMNS if video.get(column)][:1]
+                jobs.append((video['mp4'], subtitles if subtitles else None))
     else:
         video_files = []
         subtitles = defaultdict(list)
         current_video = None
         for file in args.input:
-            if '.srt' in file:
+            if os.path.splitext(file)[1].lower() in SUBTITLE_EXTENSIONS:
                 subtitles[current_video].append(file)
             else:
                 video_files.append(file)
                 current_video = file
-        videos = [dict(mp4=video, srt=subtitles.get(video, None)) for video in video_files]
-
-    if args.nprocesses > 1:
-        pool = multiprocessing.Pool(args.nprocesses)
-        for video in videos:
-            video_file = video['mp4']
-            subtitles_files = video['srt']
-            pool.apply_async(make_dataset, (video_file, subtitles_files), dict(skip_video=args.skip_video, skip_audio=args.skip_audio, video_size=(args.target_width, args.target_height)))
-        pool.close()
-        pool.join()
-    else:
-        for video in videos:
-            video_file = video['mp4']
-            subtitles_files = video['srt']
-            make_dataset(video_file, subtitles_files, skip_video=args.skip_video, skip_audio=args.skip_audio, video_size=(args.target_width, args.target_height))
+        jobs = [(video, subtitles.get(video, None)) for video in video_files]
+
+    report = run_batch(make_dataset, jobs, n_processes=args.nprocesses,
+                       kwargs=dict(skip_video=args.skip_video,
+                                   skip_audio=args.skip_audio,
+                                   video_size=(args.target_width, args.target_height)),
+                       manifest_path=args.manifest)
+    report.print_summary()
 
 
 if __name__ == '__main__':
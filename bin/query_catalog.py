@@ -0,0 +1,38 @@
+"""
+List the datasets in a catalog made by build_catalog.py which have a facet matching the given criteria, e.g. the
+datasets with an audiodescription subtitle facet which are longer than 20 minutes:
+
+    query_catalog.py corpus/catalog.sqlite --modality subtitles --facet audiodescription --min-length 1200
+"""
+import argparse
+import time
+
+from multimodal.dataset.catalog import CorpusCatalog
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find datasets in a catalog")
+    parser.add_argument('catalog', help="Path of the catalog database")
+    parser.add_argument('--modality', help="Modality of the facet")
+    parser.add_argument('--facet', help="Name of the facet")
+    parser.add_argument('--handler', help="Facet handler, e.g. SubtitleFacet")
+    parser.add_argument('--min-length', help="Minimum length of the dataset in seconds", type=float)
+    parser.add_argument('--max-length', help="Maximum length of the dataset in seconds", type=float)
+    parser.add_argument('--min-cues', help="Minimum number of cues of the facet", type=int)
+    args = parser.parse_args()
+
+    with CorpusCatalog(args.catalog) as catalog:
+        t0 = time.perf_counter()
+        dataset_paths = catalog.find_datasets(modality=args.modality, facet=args.facet, handler=args.handler,
+                                              min_length=args.min_length, max_length=args.max_length,
+                                              min_cues=args.min_cues)
+        lengths = catalog.get_lengths(dataset_paths)
+        query_time = time.perf_counter() - t0
+        for dataset_path in dataset_paths:
+            print("{}\t{:.1f}".format(dataset_path, lengths[dataset_path] or 0.))
+        print("Found {} datasets ({:.1f} hours) in {:.1f}ms".format(
+            len(dataset_paths), sum(length or 0. for length in lengths.values()) / 3600, 1000 * query_time))
+
+
+if __name__ == '__main__':
+    main()
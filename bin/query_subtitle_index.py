@@ -0,0 +1,27 @@
+"""
+Look up the subtitle cues containing all of the given words in an index made by build_subtitle_index.py
+"""
+import argparse
+import time
+
+from multimodal.dataset.subtitle_index import SubtitleIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the subtitles containing words")
+    parser.add_argument('index', help="Path of the index database")
+    parser.add_argument('words', help="The words to look for", nargs='+')
+    args = parser.parse_args()
+
+    with SubtitleIndex(args.index) as index:
+        t0 = time.perf_counter()
+        segments = index.query_all(args.words)
+        query_time = time.perf_counter() - t0
+        for segment in segments:
+            print("{}\t{}\t{}\t{:.3f}\t{:.3f}".format(segment.dataset_path, segment.facet, segment.cue, segment.start,
+                                                     segment.end))
+        print("Found {} cues in {:.1f}ms".format(len(segments), 1000 * query_time))
+
+
+if __name__ == '__main__':
+    main()
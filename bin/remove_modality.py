@@ -2,11 +2,15 @@ import argparse
 import os.path
 import glob
 from multimodal.dataset.multimodal import remove_modality
+from multimodal.batch import run_batch
 
 def main():
     parser = argparse.ArgumentParser(description="Remove modalities from datasets")
     parser.add_argument('datasets', help="Dataset paths", nargs='+')
     parser.add_argument('modality', help="The modality to remove")
+    parser.add_argument('--n-processes', help="Number of processes to use", type=int, default=1)
+    parser.add_argument('--manifest', help="If given, record processed datasets in this file and skip the ones "
+                                           "which are already done when rerun")
     args = parser.parse_args()
 
     dataset_paths = []
@@ -16,8 +20,9 @@ def main():
             dataset_paths.extend(datasets)
         else:
             raise ValueError("Not a directory: {}".format(dataset_path))
-    for dataset_path in dataset_paths:
-        remove_modality(dataset_path, args.modality)
+    report = run_batch(remove_modality, dataset_paths, n_processes=args.n_processes,
+                       kwargs=dict(modality=args.modality), manifest_path=args.manifest)
+    report.print_summary()
 
 
 if __name__ == '__main__':
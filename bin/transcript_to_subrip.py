@@ -2,7 +2,6 @@ import argparse
 import os.path
 import glob
 import json
-from datetime import timedelta
 from multimodal.intervals import merge_annotated_intervals
 import multimodal.srt as srt
 
@@ -28,33 +27,23 @@ def main():
 
         with open(transcript_path) as fp:
             transcript = json.load(fp)
-            subtitle_entries = []
-            i = 1
+            times = []
+            contents = []
             for transcription in transcript:
                 if 'words' in transcription:
                     # We have words, let's merge the ones which are less than merge_time_ms milliseconds apart
                     merged_intervals = merge_annotated_intervals(transcription['words'], args.min_overlap)
 
                     for start, end, words in merged_intervals:
-                        entry = srt.Subtitle(i, start=timedelta(seconds=float(start)),
-                                             end=timedelta(seconds=float(end)),
-                                             content=' '.join(words))
-                        subtitle_entries.append(entry)
-                        i += 1
+                        times.append((float(start), float(end)))
+                        contents.append(' '.join(words))
                 else:
-                    start = transcription['start']
-                    end = transcription['end']
-                    content = transcription['transcript']
-                    entry = srt.Subtitle(i, start=timedelta(seconds=float(start)),
-                                         end=timedelta(seconds=float(end)),
-                                         content=content)
-                    subtitle_entries.append(entry)
-                    i += 1
-            subrip_file = srt.compose(subtitle_entries)
+                    times.append((float(transcription['start']), float(transcription['end'])))
+                    contents.append(transcription['transcript'])
             basename = os.path.splitext(transcript_path)[0]
             output_file = basename + '_transcript.srt'
             with open(output_file, 'w') as fp:
-                fp.write(subrip_file)
+                srt.compose_arrays(times, contents, fp=fp)
 
 
 
@@ -0,0 +1,166 @@
+"""
+Batch execution of per-file jobs, used by the maintenance scripts in bin/ to process whole directories of datasets.
+
+Jobs are run in a pool of worker processes. Any exception raised by a job is captured together with its traceback,
+so one broken file doesn't stop the batch. If a manifest path is given, the outcome of every job is appended to it
+as a line of JSON, and jobs which already succeeded according to the manifest are skipped when the batch is rerun.
+"""
+import json
+import multiprocessing
+import os.path
+import time
+import traceback
+
+
+class BatchReport(object):
+    """
+    Summary of a batch run
+    """
+    def __init__(self, n_jobs, n_skipped):
+        self.n_jobs = n_jobs
+        self.n_skipped = n_skipped
+        self.n_succeeded = 0
+        self.failures = []
+        self.start_time = time.time()
+        self.end_time = None
+
+    @property
+    def n_failed(self):
+        return len(self.failures)
+
+    @property
+    def n_processed(self):
+        return self.n_succeeded + self.n_failed
+
+    def get_elapsed(self):
+        end_time = self.end_time if self.end_time is not None else time.time()
+        return end_time - self.start_time
+
+    def get_throughput(self):
+        elapsed = self.get_elapsed()
+        if elapsed == 0:
+            return 0.
+        return self.n_processed / elapsed
+
+    def format_progress(self):
+        n_remaining = self.n_jobs - self.n_skipped - self.n_processed
+        throughput = self.get_throughput()
+        if throughput > 0:
+            eta = '{:.0f}s'.format(n_remaining / throughput)
+        else:
+            eta = 'unknown'
+        return "Processed {}/{} ({} failed, {} skipped), {:.2f} files/s, ETA {}".format(
+            self.n_processed + self.n_skipped, self.n_jobs, self.n_failed, self.n_skipped, throughput, eta)
+
+    def print_summary(self):
+        print("Done in {:.1f}s. {}".format(self.get_elapsed(), self.format_progress()))
+        for key, error in self.failures:
+            print("Failed: {}\n{}".format(key, error))
+
+
+def get_job_key(job):
+    """
+    The key of a job is its first argument, which for all jobs in this package is the path of the file it processes
+    """
+    if isinstance(job, (tuple, list)):
+        return job[0]
+    return job
+
+
+def read_manifest(manifest_path):
+    """
+    Read a batch manifest.
+    :return: A dictionary mapping job keys to the last recorded entry for that job
+    """
+    entries = dict()
+    if manifest_path is None or not os.path.exists(manifest_path):
+        return entries
+    with open(manifest_path) as fp:
+        for line in fp:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A partially written line from an interrupted run
+                continue
+            entries[entry['key']] = entry
+    return entries
+
+
+def _run_job(function_job_kwargs):
+    function, job, kwargs = function_job_kwargs
+    args = tuple(job) if isinstance(job, (tuple, list)) else (job,)
+    t0 = time.time()
+    try:
+        result = function(*args, **kwargs)
+        error = None
+    except Exception:
+        result = None
+        error = traceback.format_exc()
+    return get_job_key(job), result, error, time.time() - t0
+
+
+def run_batch(function, jobs, n_processes=1, kwargs=None, manifest_path=None, callback=None, report_interval=10,
+              maxtasksperchild=None):
+    """
+    Run function over all jobs.
+    :param function: The function to run. It must be picklable (defined at the top level of a module) if
+                     n_processes > 1.
+    :param jobs: A sequence of jobs. A job is either a single argument, or a tuple of positional arguments for
+                 *function*. The first argument identifies the job in the manifest and in the error report and should be
+                 the path of the file processed.
+    :param n_processes: Number of worker processes to use. If 1, the jobs are run in this process.
+    :param kwargs: Keyword arguments passed to every call of *function*.
+    :param manifest_path: If not None, the outcome of every job is appended to this file and jobs which have already
+                          succeeded according to it are skipped.
+    :param callback: If not None, called in this process as callback(key, result) for every successful job.
+    :param report_interval: Minimum number of seconds between progress reports.
+    :param maxtasksperchild: Passed to the process pool, restarting workers regularly bounds the memory held by
+                             HDF5 caches in long runs.
+    :return: A BatchReport summarizing the run
+    """
+    if kwargs is None:
+        kwargs = dict()
+    jobs = list(jobs)
+    finished = {key for key, entry in read_manifest(manifest_path).items() if entry['status'] == 'ok'}
+    pending_jobs = [job for job in jobs if get_job_key(job) not in finished]
+    report = BatchReport(len(jobs), len(jobs) - len(pending_jobs))
+
+    manifest_fp = open(manifest_path, 'a') if manifest_path is not None else None
+    pool = None
+    try:
+        tasks = ((function, job, kwargs) for job in pending_jobs)
+        if n_processes > 1:
+            pool = multiprocessing.Pool(n_processes, maxtasksperchild=maxtasksperchild)
+            results = pool.imap_unordered(_run_job, tasks)
+        else:
+            results = map(_run_job, tasks)
+
+        last_report = time.time()
+        for key, result, error, duration in results:
+            if error is None:
+                report.n_succeeded += 1
+                if callback is not None:
+                    callback(key, result)
+            else:
+                report.failures.append((key, error))
+                print("Job {} failed: {}".format(key, error.strip().splitlines()[-1]))
+            if manifest_fp is not None:
+                entry = dict(key=key, status='ok' if error is None else 'failed', error=error, duration=duration)
+                manifest_fp.write(json.dumps(entry) + '\n')
+                manifest_fp.flush()
+            if time.time() - last_report > report_interval:
+                print(report.format_progress())
+                last_report = time.time()
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if manifest_fp is not None:
+            manifest_fp.close()
+        report.end_time = time.time()
+    return report
@@ -1,57 +1,72 @@
 import collections
-import webrtcvad
 import numpy as np
 
 from multimodal.dataset.video import VideoDataset
+from multimodal.dataset.vad import VadBackend, make_vad_backend
 
 
-def add_voiced_segment_facet(dataset_path, vad_mode=3, frame_duration_ms=30, overwrite=False):
-    vad = webrtcvad.Vad()
-    vad.set_mode(vad_mode)
+def add_voiced_segment_facet(dataset_path, vad_mode=3, frame_duration_ms=30, overwrite=False, backend='webrtc',
+                             backend_kwargs=None):
+    """
+    Add a 'voiced_segments' time interval dataset to all audio facets of the dataset.
+    :param dataset_path: Path to the dataset to process
+    :param vad_mode: The WebRTC VAD mode, only used by the 'webrtc' backend
+    :param frame_duration_ms: The duration of the frames the VAD classifies
+    :param overwrite: If True, replace existing voiced segments
+    :param backend: Either the name of a VAD backend ('webrtc' or 'energy') or a VadBackend instance
+    :param backend_kwargs: Extra keyword arguments for the backend, if it's given by name
+    """
+    if not isinstance(backend, VadBackend):
+        backend_kwargs = dict(backend_kwargs) if backend_kwargs is not None else dict()
+        if backend == 'webrtc':
+            backend_kwargs.setdefault('mode', vad_mode)
+        vad = make_vad_backend(backend, frame_duration_ms=frame_duration_ms, **backend_kwargs)
+    else:
+        vad = backend
 
     with VideoDataset(dataset_path, mode='r+') as dataset:
         audio_facets, = dataset.get_all_facets(['audio'])
         for audio_facet in audio_facets:
             if overwrite or not audio_facet.has_time_intervals('voiced_segments'):
                 sample_rate = audio_facet.get_samplerate()
-                voiced_frames = list(vad_slice_audio_signal(audio_facet.get_all_frames(), sample_rate, vad, frame_duration_ms))
+                voiced_frames = list(vad_slice_audio_signal(audio_facet.get_all_frames(), sample_rate, vad))
                 voiced_frame_intervals = np.array([[start, end] for start, end, segment in voiced_frames])
-                audio_facet.add_time_intervals('voiced_segments', voiced_frame_intervals, overwrite=overwrite)
+                audio_facet.add_time_intervals('voiced_segments', voiced_frame_intervals, overwrite=overwrite,
+                                               attrs=vad.get_attrs())
             else:
                 print("Audio facet {} already has voiced segment times".format(audio_facet.group_name()))
 
 
-def vad_slice_audio_signal(audio_frames, sample_rate, vad, frame_duration_ms=30, padding_duration_ms = 100):
+def vad_slice_audio_signal(audio_frames, sample_rate, vad, padding_duration_ms=100):
     """
     Apply the VAD classifier to all audio frames and return a list of start, end tuples for each active region detected.
     :param audio_frames: A numpy array of PCM audio samples
     :param sample_rate: The sample rate of the audio sampels
+    :param vad: A VadBackend used to classify the frames
     :return:
     """
 
-    frame_length = frame_duration_ms * sample_rate//1000
+    frame_length = vad.get_frame_length(sample_rate)
+    # The whole signal is classified up front, the backend decides how to do this efficiently. We will throw away the
+    # last samples less than one frame, this should not be an issue
+    is_speech_frames = vad.classify_frames(audio_frames, sample_rate)
 
-    num_padding_frames = int(padding_duration_ms / frame_duration_ms)
+    num_padding_frames = int(padding_duration_ms / vad.frame_duration_ms)
     # We use a deque for our sliding window/ring buffer.
     ring_buffer = collections.deque(maxlen=num_padding_frames)
     # We have two states: TRIGGERED and NOTTRIGGERED. We start in the
     # NOTTRIGGERED state.
     triggered = False
 
-    num_windows = len(audio_frames) // frame_length  # We will throw away the last samples less than 30 ms, this should not be an issue
-
-    voiced_frames = []
+    num_voiced_frames = 0
     voiced_start_frame = None
 
-    for i in range(num_windows):
+    for i, is_speech in enumerate(is_speech_frames.tolist()):
         start = i*frame_length
-        end = start+frame_length
-        audio = audio_frames[start:end]
-        is_speech = vad.is_speech(audio.tobytes(), sample_rate)
+        ring_buffer.append(is_speech)
+        num_voiced = sum(ring_buffer)
 
         if not triggered:
-            ring_buffer.append((audio, is_speech))
-            num_voiced = len([f for f, speech in ring_buffer if speech])
             # If we're NOTTRIGGERED and more than 90% of the frames in
             # the ring buffer are voiced frames, then enter the
             # TRIGGERED state.
@@ -61,8 +76,7 @@ def vad_slice_audio_signal(audio_frames, sample_rate, vad, frame_duration_ms=30,
                 # We want to yield all the audio we see from now until
                 # we are NOTTRIGGERED, but we have to start with the
                 # audio that's already in the ring buffer.
-                for f, s in ring_buffer:
-                    voiced_frames.append(f)
+                num_voiced_frames = len(ring_buffer)
 
                 # We calculate where these voiced frames start so we can calculate language offsets correctly
                 buffer_length_frames = (len(ring_buffer)-1)*frame_length
@@ -71,22 +85,19 @@ def vad_slice_audio_signal(audio_frames, sample_rate, vad, frame_duration_ms=30,
         else:
             # We're in the TRIGGERED state, so collect the audio data
             # and add it to the ring buffer.
-            voiced_frames.append(audio)
-            ring_buffer.append((audio, is_speech))
-            num_unvoiced = len([f for f, speech in ring_buffer if not speech])
+            num_voiced_frames += 1
+            num_unvoiced = len(ring_buffer) - num_voiced
             # If more than 90% of the frames in the ring buffer are
             # unvoiced, then enter NOTTRIGGERED and yield whatever
             # audio we've collected.
             if num_unvoiced > 0.9 * ring_buffer.maxlen:
                 triggered = False
-                concatenated = np.concatenate(voiced_frames)
-                voiced_end_frame = voiced_start_frame + len(concatenated)
-                yield (voiced_start_frame, voiced_end_frame, concatenated)
+                voiced_end_frame = voiced_start_frame + num_voiced_frames*frame_length
+                yield (voiced_start_frame, voiced_end_frame, audio_frames[voiced_start_frame:voiced_end_frame])
                 ring_buffer.clear()
-                voiced_frames = []
+                num_voiced_frames = 0
     # If we have any leftover voiced audio when we run out of input,
     # yield it.
-    if voiced_frames:
-        concatenated = np.concatenate(voiced_frames)
-        voiced_end_frame = voiced_start_frame + len(concatenated)
-        yield (voiced_start_frame, voiced_end_frame, concatenated)
+    if num_voiced_frames:
+        voiced_end_frame = voiced_start_frame + num_voiced_frames*frame_length
+        yield (voiced_start_frame, voiced_end_frame, audio_frames[voiced_start_frame:voiced_end_frame])
@@ -0,0 +1,273 @@
+"""
+Annotation tracks are named sets of time intervals, optionally labeled, which can be attached to any facet or to the
+root of a dataset, e.g. the voiced segments of an audio stream or the scenes of a video.
+
+A track is a group in the 'annotations' group of its parent, with the intervals as an (n, 2) dataset 'times' sorted by
+start time. Tracks attached to a facet with a rate store the intervals in frames of the facet, other tracks store them
+in seconds. Labels are stored as small integer codes in the dataset 'labels', with the label strings in the dataset
+'label_names'. Older datasets have the time intervals of audio facets as plain datasets directly in the facet group,
+these are read as tracks without labels.
+"""
+import h5py
+import numpy as np
+
+from multimodal.dataset.facet.facet_handler import LazyAttribute
+from multimodal.intervals import IntervalIndex, as_intervals, normalize
+
+ANNOTATIONS_GROUP = 'annotations'
+
+
+def get_track_node(parent_group, name):
+    """
+    Find the HDF5 node of the track *name* in *parent_group*
+    :return: The track group, the dataset of an old style track, or None if there is no such track
+    """
+    if ANNOTATIONS_GROUP in parent_group and name in parent_group[ANNOTATIONS_GROUP]:
+        return parent_group[ANNOTATIONS_GROUP][name]
+    node = parent_group.get(name)
+    if isinstance(node, h5py.Dataset) and node.ndim == 2 and node.shape[1] == 2:
+        return node
+    return None
+
+
+def get_track_names(parent_group):
+    if ANNOTATIONS_GROUP not in parent_group:
+        return []
+    return list(parent_group[ANNOTATIONS_GROUP].keys())
+
+
+def iter_frame_ranges(facet, frame_ranges, max_gap=0, batch_size=256):
+    """
+    Read the frames of many frame ranges of a facet. The ranges are handled in batches, within a batch ranges which
+    overlap or are at most *max_gap* frames apart are read with a single call to facet.get_frames, so overlapping
+    ranges are only read (and for video decoded) once.
+    :param facet: A facet with a get_frames method accepting a (start, end) pair of frame indices
+    :param frame_ranges: An integer array of shape (n, 2)
+    :param max_gap: Ranges separated by at most this many frames are read together
+    :param batch_size: Number of ranges to read at a time, this limits how much is kept in memory
+    :return: A generator of the frames of each range, in the order of *frame_ranges*
+    """
+    frame_ranges = as_intervals(frame_ranges).astype(np.int64)
+    for batch_start in range(0, len(frame_ranges), batch_size):
+        batch = frame_ranges[batch_start:batch_start + batch_size]
+        spans = normalize(batch)
+        if len(spans) > 1:
+            # Join spans whose gap is small enough that reading through it is cheaper than another read
+            join = np.ones(len(spans), dtype=bool)
+            join[1:] = spans[1:, 0] - spans[:-1, 1] > max_gap
+            first = np.flatnonzero(join)
+            last = np.append(first[1:], len(spans)) - 1
+            spans = np.stack([spans[first, 0], spans[last, 1]], axis=1)
+        span_frames = [facet.get_frames((start, end)) for start, end in spans.tolist()]
+        span_indices = np.maximum(np.searchsorted(spans[:, 0], batch[:, 0], side='right') - 1, 0)
+        for (start, end), span_index in zip(batch.tolist(), span_indices.tolist()):
+            if end <= start:
+                if span_frames:
+                    yield span_frames[span_index][:0]
+                else:
+                    yield facet.get_frames((start, start))
+                continue
+            span_start = spans[span_index, 0]
+            yield span_frames[span_index][start - span_start:end - span_start]
+
+
+class AnnotationTrack(object):
+    """
+    A set of time intervals with optional labels. Queries take and return times in seconds, interval indices refer to
+    the intervals sorted by start time.
+    """
+    def __init__(self, node, rate=None):
+        """
+        :param node: The track group, or the times dataset of an old style track
+        :param rate: The rate of the frame indices in an old style track
+        """
+        if isinstance(node, h5py.Dataset):
+            self.group = None
+            self.times_dataset = node
+            self.rate = rate
+        else:
+            self.group = node
+            self.times_dataset = node['times']
+            self.rate = node.attrs.get('rate')
+
+    @property
+    def name(self):
+        return self.times_dataset.name.split('/')[-2 if self.group is not None else -1]
+
+    def __len__(self):
+        return len(self.times_dataset)
+
+    @LazyAttribute
+    def times(self):
+        times = self.times_dataset[:]
+        if self.group is None and np.any(times[1:, 0] < times[:-1, 0]):
+            # Old style tracks were written in whatever order they were found, create sorts new tracks
+            times = times[np.lexsort((times[:, 1], times[:, 0]))]
+        return times
+
+    @LazyAttribute
+    def label_codes(self):
+        if self.group is None or 'labels' not in self.group:
+            return None
+        return self.group['labels'][:]
+
+    @LazyAttribute
+    def label_names(self):
+        if self.group is None or 'label_names' not in self.group:
+            return []
+        return [name.decode('utf-8') if isinstance(name, bytes) else name for name in self.group['label_names'][:]]
+
+    @LazyAttribute
+    def index(self):
+        return IntervalIndex(self.get_times_seconds())
+
+    def get_attrs(self):
+        return dict(self.times_dataset.attrs)
+
+    def get_times_seconds(self):
+        """
+        :return: A float array of shape (n, 2) with the intervals in seconds
+        """
+        if self.rate is None:
+            return self.times.astype(np.float64)
+        return self.times / self.rate
+
+    def get_labels(self):
+        """
+        :return: An object array with the label of each interval, or None if the track has no labels
+        """
+        if self.label_codes is None:
+            return None
+        return np.array(self.label_names, dtype=object)[self.label_codes]
+
+    def get_label_mask(self, label):
+        """
+        :return: A boolean array which is True for the intervals with the given label
+        """
+        if label not in self.label_names:
+            return np.zeros(len(self), dtype=bool)
+        return self.label_codes == self.label_names.index(label)
+
+    def _filter_label(self, indices, label):
+        if label is None:
+            return indices
+        return indices[self.get_label_mask(label)[indices]]
+
+    def overlapping(self, start, end, label=None):
+        """
+        Return the indices of the intervals which overlap [start, end), optionally only those with the given label
+        """
+        return self._filter_label(self.index.overlapping(start, end), label)
+
+    def overlapping_batch(self, starts, ends, label=None):
+        """
+        Find the intervals overlapping each of the query intervals [starts[i], ends[i]), optionally only those with the
+        given label.
+        :return: A tuple (offsets, indices), the intervals overlapping query i are indices[offsets[i]:offsets[i+1]]
+        """
+        offsets, indices = self.index.overlapping_batch(starts, ends)
+        if label is None:
+            return offsets, indices
+        keep = self.get_label_mask(label)[indices]
+        kept_before = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(keep, out=kept_before[1:])
+        return kept_before[offsets], indices[keep]
+
+    def within(self, start, end, label=None):
+        """
+        Return the indices of the intervals which lie completely inside [start, end], optionally only those with the
+        given label. The intervals are searched by start time, they are sorted (see times).
+        """
+        times = self.get_times_seconds()
+        lo = np.searchsorted(times[:, 0], start, side='left')
+        hi = np.searchsorted(times[:, 0], end, side='right')
+        candidates = np.arange(lo, max(lo, hi))
+        return self._filter_label(candidates[times[candidates, 1] <= end], label)
+
+    def containing(self, timestamps):
+        """
+        Find the interval containing each of the timestamps. If several intervals contain a timestamp, the one starting
+        last is chosen.
+        :return: An integer array with the same shape as *timestamps*, -1 where no interval contains the timestamp
+        """
+        return self.index.active_at(timestamps)
+
+    def get_frame_ranges(self, facet, indices=None):
+        """
+        Convert intervals to frame ranges of a facet
+        :param facet: A facet with a rate, e.g. an audio or video facet
+        :param indices: The intervals to convert, all intervals if None
+        :return: An integer array of shape (n, 2)
+        """
+        times = self.times if indices is None else self.times[indices]
+        rate = facet.get_samplerate()
+        if self.rate is not None and self.rate == rate:
+            return times.astype(np.int64)
+        seconds = times if self.rate is None else times / self.rate
+        return (seconds * rate).astype(np.int64)
+
+    def iter_frames(self, facet, indices=None, max_gap=0, batch_size=256):
+        """
+        Read the frames of a facet for the intervals of the track, see iter_frame_ranges.
+        :return: A generator of ((start, end), frames) with the interval times in seconds
+        """
+        times = self.get_times_seconds()
+        if indices is not None:
+            times = times[indices]
+        frame_ranges = self.get_frame_ranges(facet, indices)
+        for (start, end), frames in zip(times.tolist(),
+                                        iter_frame_ranges(facet, frame_ranges, max_gap=max_gap,
+                                                          batch_size=batch_size)):
+            yield (start, end), frames
+
+    def get_frames(self, facet, indices=None, max_gap=0):
+        """
+        Read the frames of a facet for the intervals of the track
+        :return: A list with the frames of each interval
+        """
+        frame_ranges = self.get_frame_ranges(facet, indices)
+        return list(iter_frame_ranges(facet, frame_ranges, max_gap=max_gap, batch_size=max(len(frame_ranges), 1)))
+
+    @classmethod
+    def create(cls, parent_group, name, times, labels=None, rate=None, attrs=None, overwrite=False):
+        """
+        Write an annotation track
+        :param parent_group: The facet group or the root group of the dataset the track belongs to
+        :param name: Name of the track
+        :param times: An array of shape (n, 2) with the intervals, in frames if *rate* is given, otherwise in seconds
+        :param labels: Optional sequence of n label strings
+        :param rate: The frame rate of the times, None if the times are in seconds
+        :param attrs: Optional dictionary of attributes to store with the track, e.g. how the intervals were produced
+        :param overwrite: If True, replace an existing track with the same name
+        :return: The new AnnotationTrack
+        """
+        times = as_intervals(times)
+        order = np.argsort(times[:, 0], kind='stable')
+        if overwrite:
+            node = get_track_node(parent_group, name)
+            if node is not None:
+                del parent_group[node.name]
+        track_group = parent_group.require_group(ANNOTATIONS_GROUP).create_group(name)
+        if rate is not None:
+            track_group.attrs['rate'] = rate
+        times_dataset = track_group.create_dataset('times', data=times[order], chunks=True if len(times) else None,
+                                                   compression='gzip' if len(times) else None, shuffle=len(times) > 0)
+        if attrs is not None:
+            times_dataset.attrs.update(attrs)
+        if labels is not None:
+            label_names, label_codes = np.unique(np.asarray(labels, dtype=str), return_inverse=True)
+            track_group.create_dataset('labels', data=label_codes[order].astype(np.min_scalar_type(len(label_names))))
+            track_group.create_dataset('label_names', data=label_names.tolist(), dtype=h5py.string_dtype())
+        return cls(track_group)
+
+
+def get_annotation_track(parent_group, name, rate=None):
+    """
+    Return the track *name* of a facet group or dataset root group
+    :param rate: The rate of the frame indices, only used for old style tracks
+    :raises KeyError: If there is no such track
+    """
+    node = get_track_node(parent_group, name)
+    if node is None:
+        raise KeyError("No annotation track {} in {}".format(name, parent_group.name))
+    return AnnotationTrack(node, rate=rate)
@@ -0,0 +1,144 @@
+"""
+Batching of the items of the stream wrappers in multimodal.dataset.video.
+
+The items of a batch have streams of different lengths. They are collated either padded, into a zero-filled array of
+shape (batch_size, max_length, ...) with the length of each sequence, or packed, concatenated into an array of shape
+(total_length, ...) with the offsets of each sequence. The time segments of all items are resolved before anything is
+read, so the array for each stream can be allocated once and the facets read or decode the frames straight into it.
+"""
+import collections
+
+import numpy as np
+
+
+class PaddedSequences(collections.namedtuple('PaddedSequences', ['data', 'lengths'])):
+    """
+    Zero-padded sequences, data has shape (batch_size, max_length, ...) and lengths the length of each sequence
+    """
+    def get_sequence(self, i):
+        return self.data[i, :self.lengths[i]]
+
+
+class PackedSequences(collections.namedtuple('PackedSequences', ['data', 'offsets'])):
+    """
+    Concatenated sequences, sequence i is data[offsets[i]:offsets[i+1]]
+    """
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def get_sequence(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]]
+
+
+class Batch(collections.namedtuple('Batch', ['indices', 'texts', 'streams'])):
+    """
+    A batch of wrapper items. texts has the text of each item (None for wrappers without text) and streams has a
+    PaddedSequences or PackedSequences for each stream of the wrapper.
+    """
+
+
+def allocate_sequences(lengths, frame_shape, dtype, packed=False):
+    """
+    Allocate the array for a batch of sequences
+    :param lengths: The length of each sequence
+    :param frame_shape: The shape of a single frame, e.g. () for audio samples and (height, width, channels) for video
+    :param dtype: The data type of the frames
+    :param packed: If True, allocate for packed sequences, otherwise for padded
+    :return: A PackedSequences or PaddedSequences with the unfilled array
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if packed:
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return PackedSequences(np.empty((offsets[-1],) + tuple(frame_shape), dtype=dtype), offsets)
+    max_length = lengths.max() if len(lengths) > 0 else 0
+    return PaddedSequences(np.zeros((len(lengths), max_length) + tuple(frame_shape), dtype=dtype), lengths)
+
+
+def get_sequence_slots(sequences):
+    """
+    Return the views of the array of a PaddedSequences or PackedSequences where each sequence should be written
+    """
+    if isinstance(sequences, PackedSequences):
+        return [sequences.data[start:end] for start, end in zip(sequences.offsets[:-1], sequences.offsets[1:])]
+    return [sequences.data[i, :length] for i, length in enumerate(sequences.lengths)]
+
+
+def collate(sequences, packed=False):
+    """
+    Collate arrays which have already been read into a single padded or packed array
+    :param sequences: A non-empty list of arrays which only differ in their first dimension
+    :return: A PaddedSequences or PackedSequences
+    """
+    collated = allocate_sequences([len(sequence) for sequence in sequences], sequences[0].shape[1:],
+                                  np.result_type(*sequences), packed=packed)
+    for slot, sequence in zip(get_sequence_slots(collated), sequences):
+        slot[...] = sequence
+    return collated
+
+
+def get_frame_ranges(times, rates, n_frames):
+    """
+    Convert time segments in seconds to frame ranges the same way as get_frames_by_seconds, limited to the frames
+    which exist in the streams
+    :param times: An array of shape (n, 2) with start and end times
+    :param rates: The rate of the stream of each segment, or a single rate for all of them
+    :param n_frames: The number of frames in the stream of each segment, or a single number for all of them
+    :return: An integer array of shape (n, 2)
+    """
+    times = np.asarray(times, dtype=np.float64).reshape(-1, 2)
+    frame_ranges = (times * np.reshape(rates, (-1, 1))).astype(np.int64)
+    frame_ranges = np.clip(frame_ranges, 0, np.reshape(n_frames, (-1, 1)))
+    frame_ranges[:, 1] = np.maximum(frame_ranges[:, 0], frame_ranges[:, 1])
+    return frame_ranges
+
+
+def get_batch(wrapper, indices, packed=False, crop_positions=None):
+    """
+    Read a batch of items from a stream wrapper
+    :param wrapper: A wrapper with a get_stream_segments_batch method, e.g. the wrappers returned by VideoDataset
+    :param indices: The items to put in the batch
+    :param packed: If True, the streams are packed, otherwise they are zero-padded
+    :param crop_positions: Where to crop the items longer than the max_duration of the wrapper, see
+                           multimodal.dataset.video.crop_times. Drawn from the rng of the wrapper if None.
+    :return: A Batch
+    """
+    indices = list(indices)
+    items = wrapper.get_stream_segments_batch(indices, crop_positions) if indices else []
+    texts = [text for text, segments in items]
+    streams = []
+    n_streams = len(items[0][1]) if items else 0
+    for s in range(n_streams):
+        # The items of a wrapper collection come from different datasets, so each item has its own stream facet
+        stream_segments = [segments[s] for text, segments in items]
+        frame_ranges = get_frame_ranges([times for facet, times in stream_segments],
+                                        [facet.get_samplerate() for facet, times in stream_segments],
+                                        [facet.get_n_frames() for facet, times in stream_segments])
+        first_facet = stream_segments[0][0]
+        sequences = allocate_sequences(frame_ranges[:, 1] - frame_ranges[:, 0], first_facet.get_frame_shape(),
+                                       first_facet.get_frame_dtype(), packed=packed)
+        for (facet, times), (start, end), slot in zip(stream_segments, frame_ranges.tolist(),
+                                                      get_sequence_slots(sequences)):
+            facet.read_frames_into(start, end, slot)
+        streams.append(sequences)
+    return Batch(indices, texts, streams)
+
+
+def iter_batches(wrapper, batch_size, indices=None, packed=False, drop_last=False):
+    """
+    Iterate over the items of a wrapper in batches
+    :param wrapper: A wrapper with a get_stream_segments method
+    :param batch_size: Number of items per batch
+    :param indices: The order of the items, all items in order if None
+    :param packed: If True, the streams are packed, otherwise they are zero-padded
+    :param drop_last: If True, skip the last batch if it's smaller than batch_size
+    :return: A generator of Batch
+    """
+    if indices is None:
+        indices = range(len(wrapper))
+    for batch_start in range(0, len(indices), batch_size):
+        batch_indices = indices[batch_start:batch_start + batch_size]
+        if drop_last and len(batch_indices) < batch_size:
+            break
+        yield get_batch(wrapper, batch_indices, packed=packed)
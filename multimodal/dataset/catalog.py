@@ -0,0 +1,231 @@
+"""
+Catalog of the datasets of a corpus, so tools and samplers can find datasets and their facets without opening every
+HDF5 file.
+
+The catalog is an SQLite database, by default catalog.sqlite in the directory of the corpus. It has a row for every
+dataset with its length, and a row for every facet with its modality, handler, rate, number of frames and length, and
+for subtitle facets the number of cues. Every dataset is recorded with its modification time and size, and updating
+the catalog only reads the datasets which are new or have changed since they were catalogued.
+"""
+import collections
+import os.path
+import sqlite3
+
+import h5py
+
+from multimodal.batch import run_batch
+from multimodal.dataset.annotation import ANNOTATIONS_GROUP
+from multimodal.dataset.subtitle_index import get_file_signature
+
+CATALOG_NAME = 'catalog.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    length_s REAL
+);
+CREATE TABLE IF NOT EXISTS facets (
+    id INTEGER PRIMARY KEY,
+    dataset_id INTEGER NOT NULL REFERENCES datasets(id),
+    modality TEXT NOT NULL,
+    name TEXT NOT NULL,
+    handler TEXT NOT NULL,
+    is_default INTEGER NOT NULL,
+    rate REAL,
+    n_frames INTEGER,
+    length_s REAL,
+    n_cues INTEGER
+);
+CREATE INDEX IF NOT EXISTS facets_dataset ON facets(dataset_id);
+CREATE INDEX IF NOT EXISTS facets_name ON facets(modality, name);
+"""
+
+FACET_COLUMNS = ['modality', 'name', 'handler', 'is_default', 'rate', 'n_frames', 'length_s', 'n_cues']
+
+
+class FacetInfo(collections.namedtuple('FacetInfo', ['dataset_path'] + FACET_COLUMNS)):
+    """
+    The catalogued metadata of a facet. Stream facets have a rate, a number of frames and a length in seconds, subtitle
+    facets have a number of cues and the end time of the last cue as length.
+    """
+
+
+def get_catalog_path(corpus_directory):
+    """
+    The default path of the catalog of a corpus
+    """
+    return os.path.join(corpus_directory, CATALOG_NAME)
+
+
+def extract_metadata(dataset_path):
+    """
+    Read the modalities and facets of a dataset. This is run in the worker processes when building the catalog.
+    :return: A tuple (mtime_ns, size, facets) where facets is a list of tuples with the values of FACET_COLUMNS
+    """
+    from multimodal.dataset.facet import is_facet, make_facet
+    mtime_ns, size = get_file_signature(dataset_path)
+    facets = []
+    with h5py.File(dataset_path, 'r') as store:
+        for modality, modality_group in store.items():
+            if modality == ANNOTATIONS_GROUP or not isinstance(modality_group, h5py.Group):
+                continue
+            default_facet = modality_group.attrs.get('DefaultFacet')
+            for name, facet_group in modality_group.items():
+                if not isinstance(facet_group, h5py.Group) or not is_facet(facet_group):
+                    continue
+                handler = facet_group.attrs['FacetHandler']
+                is_default = name == default_facet or (default_facet is None and not any(
+                    facet[0] == modality for facet in facets))
+                try:
+                    facet = make_facet(facet_group)
+                except NotImplementedError:
+                    facets.append((modality, name, handler, is_default, None, None, None, None))
+                    continue
+                if handler == 'SubtitleFacet':
+                    times = facet.times
+                    length_s = float(times.max()) if len(times) else 0.
+                    facets.append((modality, name, handler, is_default, None, None, length_s, len(times)))
+                else:
+                    rate = float(facet.get_samplerate())
+                    n_frames = int(facet.get_n_frames())
+                    facets.append((modality, name, handler, is_default, rate, n_frames, n_frames / rate, None))
+    return mtime_ns, size, facets
+
+
+class CorpusCatalog(object):
+    def __init__(self, catalog_path):
+        self.catalog_path = catalog_path
+        self.connection = sqlite3.connect(catalog_path)
+        # Every dataset is added in its own transaction, with a write-ahead log these don't have to wait for the disk
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def get_catalogued_datasets(self):
+        """
+        :return: A dictionary mapping the paths of the catalogued datasets to their (mtime_ns, size) when catalogued
+        """
+        rows = self.connection.execute("SELECT path, mtime_ns, size FROM datasets")
+        return {path: (mtime_ns, size) for path, mtime_ns, size in rows}
+
+    def get_stale_datasets(self, dataset_paths):
+        """
+        Find which of the datasets need to be (re)catalogued, and which catalogued datasets are no longer in
+        dataset_paths
+        :return: A tuple (stale_paths, removed_paths)
+        """
+        catalogued = self.get_catalogued_datasets()
+        dataset_paths = [os.path.abspath(path) for path in dataset_paths]
+        stale_paths = [path for path in dataset_paths
+                       if path not in catalogued or catalogued[path] != get_file_signature(path)]
+        removed_paths = sorted(set(catalogued) - set(dataset_paths))
+        return stale_paths, removed_paths
+
+    def remove_dataset(self, dataset_path):
+        row = self.connection.execute("SELECT id FROM datasets WHERE path = ?", (dataset_path,)).fetchone()
+        if row is None:
+            return
+        dataset_id, = row
+        self.connection.execute("DELETE FROM facets WHERE dataset_id = ?", (dataset_id,))
+        self.connection.execute("DELETE FROM datasets WHERE id = ?", (dataset_id,))
+
+    def add_dataset(self, dataset_path, metadata):
+        """
+        Add the metadata of a dataset, as returned by extract_metadata, replacing any earlier metadata for it. The
+        length of the dataset is the length of its longest stream facet.
+        """
+        mtime_ns, size, facets = metadata
+        lengths = [facet[6] for facet in facets if facet[4] is not None]
+        with self.connection:
+            self.remove_dataset(dataset_path)
+            dataset_id = self.connection.execute(
+                "INSERT INTO datasets (path, mtime_ns, size, length_s) VALUES (?, ?, ?, ?)",
+                (dataset_path, mtime_ns, size, max(lengths) if lengths else None)).lastrowid
+            self.connection.executemany(
+                "INSERT INTO facets (dataset_id, {}) VALUES (?, {})".format(', '.join(FACET_COLUMNS),
+                                                                            ', '.join('?' * len(FACET_COLUMNS))),
+                [(dataset_id,) + tuple(facet) for facet in facets])
+
+    def update(self, dataset_paths, n_processes=1):
+        """
+        Bring the catalog up to date with the given datasets. Datasets which are new or modified since they were
+        catalogued are read in parallel, and datasets which are no longer among dataset_paths are removed.
+        :param dataset_paths: The paths of all datasets which should be in the catalog
+        :param n_processes: Number of worker processes used for reading the datasets
+        :return: A BatchReport for the datasets which were (re)catalogued
+        """
+        stale_paths, removed_paths = self.get_stale_datasets(dataset_paths)
+        with self.connection:
+            for dataset_path in removed_paths:
+                self.remove_dataset(dataset_path)
+        return run_batch(extract_metadata, stale_paths, n_processes=n_processes, callback=self.add_dataset)
+
+    def find_datasets(self, modality=None, facet=None, handler=None, min_length=None, max_length=None,
+                      min_cues=None):
+        """
+        Find the datasets which have a facet matching all of the given facet criteria, and whose length is within the
+        given limits. E.g. the datasets with an audiodescription subtitle facet which are longer than 20 minutes are
+        find_datasets(modality='subtitles', facet='audiodescription', min_length=20 * 60).
+        :param modality: The modality of the facet
+        :param facet: The name of the facet
+        :param handler: The facet handler, e.g. 'SubtitleFacet'
+        :param min_length: Minimum length of the dataset in seconds, the length of its longest stream
+        :param max_length: Maximum length of the dataset in seconds
+        :param min_cues: Minimum number of cues of the facet
+        :return: A sorted list of dataset paths
+        """
+        conditions, parameters = [], []
+        for column, operator, value in [('facets.modality', '=', modality), ('facets.name', '=', facet),
+                                        ('facets.handler', '=', handler), ('datasets.length_s', '>=', min_length),
+                                        ('datasets.length_s', '<=', max_length), ('facets.n_cues', '>=', min_cues)]:
+            if value is not None:
+                conditions.append('{} {} ?'.format(column, operator))
+                parameters.append(value)
+        rows = self.connection.execute(
+            "SELECT DISTINCT datasets.path FROM datasets LEFT JOIN facets ON facets.dataset_id = datasets.id{} "
+            "ORDER BY datasets.path".format(' WHERE ' + ' AND '.join(conditions) if conditions else ''), parameters)
+        return [path for path, in rows]
+
+    def get_facets(self, dataset_path=None):
+        """
+        :param dataset_path: Only return the facets of this dataset if given
+        :return: A list of FacetInfo ordered by dataset, modality and facet name
+        """
+        query = "SELECT datasets.path, {} FROM facets JOIN datasets ON facets.dataset_id = datasets.id".format(
+            ', '.join('facets.' + column for column in FACET_COLUMNS))
+        parameters = []
+        if dataset_path is not None:
+            query += " WHERE datasets.path = ?"
+            parameters.append(os.path.abspath(dataset_path))
+        rows = self.connection.execute(query + " ORDER BY datasets.path, facets.modality, facets.name", parameters)
+        return [FacetInfo(path, modality, name, handler, bool(is_default), *values)
+                for path, modality, name, handler, is_default, *values in rows]
+
+    def get_lengths(self, dataset_paths=None):
+        """
+        :return: A dictionary mapping dataset paths to their lengths in seconds
+        """
+        rows = self.connection.execute("SELECT path, length_s FROM datasets")
+        lengths = dict(rows)
+        if dataset_paths is None:
+            return lengths
+        return {path: lengths[os.path.abspath(path)] for path in dataset_paths}
+
+    def get_video_datasets(self, **criteria):
+        """
+        Open the datasets matching the criteria of find_datasets as a VideoDatasets collection
+        """
+        from multimodal.dataset.video import VideoDatasets
+        return VideoDatasets(self.find_datasets(**criteria))
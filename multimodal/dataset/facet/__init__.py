@@ -6,14 +6,14 @@ def is_facet(h5_group):
     return 'FacetHandler' in h5_group.attrs
 
 
-def make_facet(facet_group):
+def make_facet(facet_group, generation=None):
     handler_key = facet_group.attrs['FacetHandler']
     if handler_key == 'VideoFacet':
-        return VideoFacet(facet_group)
+        return VideoFacet(facet_group, generation=generation)
     elif handler_key == 'AudioFacet':
-        return AudioFacet(facet_group)
+        return AudioFacet(facet_group, generation=generation)
     elif handler_key == 'SubtitleFacet':
-        return SubtitleFacet(facet_group)
+        return SubtitleFacet(facet_group, generation=generation)
     else:
         raise NotImplementedError("Could not find facet handler {}".format(handler_key))
 
@@ -1,10 +1,12 @@
 import numpy as np
-from multimodal.dataset.facet.facet_handler import FacetHandler
+from h5py import h5s, h5t
+from multimodal.dataset.facet.facet_handler import FacetHandler, HDF5Node
 
 class AudioFacet(FacetHandler):
+    frames = HDF5Node('sound')
+
     def __init__(self, *args, **kwargs):
         super(AudioFacet, self).__init__(*args, **kwargs)
-        self.frames = self.facetgroup['sound']
         self.rate = self.facetgroup.attrs['rate']
 
     @classmethod
@@ -28,34 +30,6 @@ class AudioFacet(FacetHandler):
         group.attrs['FacetHandler'] = 'AudioFacet'
         return AudioFacet(group)
 
-    def has_time_intervals(self, name):
-        return name in self.facetgroup
-
-    def add_time_intervals(self, name, times, overwrite=False):
-        """
-        Adds a dataset with times, useful for annotating an audio stream with e.g. voiced parts
-        :param name: The name of the times dataset
-        :param times: A numpy array of shape (n_pairs, 2)
-        """
-        if overwrite and name in self.facetgroup:
-            del self.facetgroup[name]
-        self.facetgroup.create_dataset(name, data=times, chunks=True, compression='gzip', shuffle=True)
-
-    def get_time_intervals(self, name):
-        return self.facetgroup[name][:]
-
-    def get_time_interval_frames(self, name):
-        """
-        Returns an iterator over the time intervals denoted by *name* and the frames corresponding to that interval
-        :param name:
-        :return:
-        """
-        times = self.facetgroup[name][:]
-        sample_rate = self.rate
-        for start, end in times:
-            frames = self.frames[start:end]
-            yield (start/sample_rate, end/sample_rate), frames
-
     def get_samplerate(self):
         return self.rate
 
@@ -64,7 +38,7 @@ class AudioFacet(FacetHandler):
         Return the length in seconds
         :return:
         """
-        return self.rate*len(self.frames)
+        return len(self.frames) / self.rate
 
 
     def get_frames_by_seconds(self, times):
@@ -93,6 +67,33 @@ class AudioFacet(FacetHandler):
     def get_all_frames(self):
         return self.frames[:]
 
+    def get_n_frames(self):
+        return len(self.frames)
+
+    def get_frame_shape(self):
+        return self.frames.shape[1:]
+
+    def get_frame_dtype(self):
+        return self.frames.dtype
+
+    def read_frames_into(self, start, end, out):
+        """
+        Read the frames from start (inclusive) to end (non-inclusive) directly from the file into out, which should be
+        a C-contiguous array with the dtype of the frames
+        """
+        if end <= start:
+            return
+        frames = self.frames
+        handles = self.get_handles()
+        try:
+            frame_shape, memory_type = handles['read_parameters']
+        except KeyError:
+            frame_shape, memory_type = handles['read_parameters'] = (frames.shape[1:], h5t.py_create(frames.dtype))
+        # The low level interface skips the selection parsing of Dataset.read_direct, which dominates for short reads
+        file_space = frames.id.get_space()
+        file_space.select_hyperslab((start,) + (0,) * len(frame_shape), (end - start,) + frame_shape)
+        frames.id.read(h5s.create_simple(out.shape), file_space, out, memory_type)
+
 
 class MuLawFacet(AudioFacet):
     """
@@ -117,6 +118,13 @@ class MuLawFacet(AudioFacet):
         u_lawed = np.sign(frames) * np.log(1 + frames * np.abs(frames)) / self.logu
         return ((u_lawed + 1) / 2 * self.u).astype(np.uint8)
 
+    def get_frame_dtype(self):
+        return np.dtype(np.uint8)
+
+    def read_frames_into(self, start, end, out):
+        # The encoding depends on the whole segment, so this can't read directly into out
+        FacetHandler.read_frames_into(self, start, end, out)
+
 
 
 
@@ -1,7 +1,70 @@
 
+import os
+
+import h5py
+
+from multimodal.dataset.handles import add_user, get_file, get_generation, keep_inherited
+
+
 class FacetHandler(object):
-    def __init__(self, facetgroup):
-        self.facetgroup = facetgroup
+    """
+    Base class of the facet handlers. A facet remembers which file and group it belongs to, so it can be pickled and
+    used in other processes: the first time it's used in a process other than the one it was created in, the group is
+    looked up again in a file opened by that process (see multimodal.dataset.handles). The same happens when the facet
+    group is in a file of the handle pool which has been closed since.
+    """
+    def __init__(self, facetgroup, generation=None):
+        """
+        :param facetgroup: The h5py group of the facet
+        :param generation: The handle pool generation of the file of the group, None if the file isn't from the pool
+        """
+        self.file_path = facetgroup.file.filename
+        self.group_path = facetgroup.name
+        self._facetgroup = facetgroup
+        self._handles = dict()
+        self._pid = os.getpid()
+        self._generation = generation
+        if generation is not None:
+            add_user(self.file_path, self)
+
+    def _is_stale(self):
+        return self._pid != os.getpid() or (self._generation is not None
+                                            and self._generation != get_generation(self.file_path))
+
+    @property
+    def facetgroup(self):
+        if self._is_stale():
+            self._reopen()
+        return self._facetgroup
+
+    def get_handles(self):
+        """
+        Return a dictionary for caching h5py objects of the facet, it's emptied when the facet is used in a new process
+        or its file has been reopened
+        """
+        if self._is_stale():
+            self._reopen()
+        return self._handles
+
+    def _reopen(self):
+        if self._facetgroup is not None and self._pid != os.getpid():
+            keep_inherited(self._facetgroup, *self._handles.values())
+        self._facetgroup = get_file(self.file_path, user=self)[self.group_path]
+        self._handles = dict()
+        self._pid = os.getpid()
+        self._generation = get_generation(self.file_path)
+
+    def release_handles(self):
+        """
+        Drop the h5py objects of the facet when the handle pool closes its file, they're looked up again when needed
+        """
+        self._facetgroup = None
+        self._handles = dict()
+
+    def __getstate__(self):
+        state = {key: value for key, value in self.__dict__.items() if not isinstance(value, h5py.HLObject)}
+        state.update(_facetgroup=None, _handles=dict(), _pid=None, _generation=None)
+        return state
 
     def is_default(self):
         if 'DefaultFacet' in self.facetgroup:
@@ -12,5 +75,108 @@ class FacetHandler(object):
     def get_samplerate(self):
         raise NotImplementedError()
 
+    def read_frames_into(self, start, end, out):
+        """
+        Read the frames from start (inclusive) to end (non-inclusive) into out, an array of length end - start.
+        Facets override this to avoid the temporary array returned by get_frames.
+        """
+        if end > start:
+            out[...] = self.get_frames((start, end))
+
     def group_name(self):
         return self.facetgroup.name
+
+    def get_annotation_names(self):
+        from multimodal.dataset.annotation import get_track_names
+        return get_track_names(self.facetgroup)
+
+    def get_annotation_track(self, name):
+        """
+        Return the annotation track *name* of this facet
+        :raises KeyError: If the facet has no such track
+        """
+        from multimodal.dataset.annotation import get_annotation_track
+        return get_annotation_track(self.facetgroup, name, rate=self.facetgroup.attrs.get('rate'))
+
+    def has_time_intervals(self, name):
+        from multimodal.dataset.annotation import get_track_node
+        return get_track_node(self.facetgroup, name) is not None
+
+    def add_time_intervals(self, name, times, overwrite=False, attrs=None, labels=None):
+        """
+        Adds an annotation track with times, useful for annotating a stream with e.g. voiced parts
+        :param name: The name of the track
+        :param times: A numpy array of shape (n_pairs, 2), in frames if the facet has a rate and in seconds otherwise
+        :param attrs: Optional dictionary of attributes to store with the track, e.g. how the times were produced
+        :param labels: Optional sequence with a label string for each pair of times
+        """
+        from multimodal.dataset.annotation import AnnotationTrack
+        return AnnotationTrack.create(self.facetgroup, name, times, labels=labels,
+                                      rate=self.facetgroup.attrs.get('rate'), attrs=attrs, overwrite=overwrite)
+
+    def get_time_intervals_attrs(self, name):
+        return self.get_annotation_track(name).get_attrs()
+
+    def get_time_intervals(self, name):
+        return self.get_annotation_track(name).times
+
+    def get_time_interval_frames(self, name):
+        """
+        Returns an iterator over the time intervals denoted by *name* and the frames corresponding to that interval
+        :return: A generator of ((start, end), frames) with the times in seconds
+        """
+        return self.get_annotation_track(name).iter_frames(self)
+
+
+class LazyAttribute(object):
+    """
+    Decorator for facet attributes which are expensive to load. The decorated method is called the first time the
+    attribute is accessed and the value is then cached on the facet, so facets can be created without reading any data.
+    """
+    def __init__(self, load):
+        self.load = load
+        self.attribute_name = load.__name__
+
+    def __set_name__(self, owner, name):
+        self.attribute_name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = self.load(instance)
+        # This is a non-data descriptor, so the cached value in the instance dictionary takes precedence from now on
+        instance.__dict__[self.attribute_name] = value
+        return value
+
+
+class HDF5Node(object):
+    """
+    Facet attribute for a dataset in the facet group which is read from as needed, the h5py object is looked up once
+    per process
+    """
+    def __init__(self, node_name):
+        self.node_name = node_name
+        self.attribute_name = node_name
+
+    def __set_name__(self, owner, name):
+        self.attribute_name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        handles = instance.get_handles()
+        try:
+            return handles[self.attribute_name]
+        except KeyError:
+            node = handles[self.attribute_name] = instance.facetgroup[self.node_name]
+            return node
+
+
+class LazyDataset(LazyAttribute):
+    """
+    Lazy facet attribute backed by a dataset in the facet group, the whole dataset is read into memory on first access.
+    """
+    def __init__(self, dataset_name):
+        super(LazyDataset, self).__init__(lambda facet: facet.facetgroup[dataset_name][:])
+        self.dataset_name = dataset_name
+        self.attribute_name = dataset_name
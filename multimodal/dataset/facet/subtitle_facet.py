@@ -1,17 +1,252 @@
+import html
+import html.parser
+import itertools
+import re
+
 import numpy as np
-from multimodal.dataset.facet.facet_handler import FacetHandler
+from multimodal.dataset.facet.facet_handler import FacetHandler, LazyAttribute, LazyDataset
 from numbers import Integral
 
 NULL_COLOR = (-1, -1, -1)
+# Subtitle files with these extensions are parsed as Timed Text Markup Language
+TTML_EXTENSIONS = ('.ttml', '.dfxp', '.xml')
+
+
+class PackedStrings(object):
+    """
+    A sequence of strings stored as a single array of UTF-8 encoded bytes and an array of offsets, string i is
+    data[offsets[i]:offsets[i+1]]. Strings are only decoded when they are accessed, directly from a view of the
+    byte array.
+    """
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+        self._view = memoryview(data)
+
+    def __reduce__(self):
+        return PackedStrings, (self.data, self.offsets)
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+        np.cumsum([len(string) for string in encoded], out=offsets[1:])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(data, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get_bytes(self, i):
+        """
+        Return the encoded bytes of string i as a memoryview of the packed data, without copying
+        """
+        return self._view[int(self.offsets[i]):int(self.offsets[i+1])]
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        elif isinstance(item, Integral):
+            if item < 0:
+                item += len(self)
+            if not 0 <= item < len(self):
+                raise IndexError()
+            return str(self.get_bytes(item), 'utf-8')
+        else:
+            return [self[i] for i in np.asarray(item).ravel()]
+
+    def __iter__(self):
+        data = self.data.tobytes()
+        offsets = self.offsets.tolist()
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield data[start:end].decode('utf-8')
+
+
+class SubtitleParser(html.parser.HTMLParser):
+    """
+    Splits the content of subtitles into strings with their font color and styles. This is the reference
+    implementation of the markup handling, parse_subtitle_markup uses it for content outside the common tag set.
+    """
+    def __init__(self):
+        super(SubtitleParser, self).__init__()
+        self.colors = []
+        self.strings = []
+        self.attributes = []
+        self.color = NULL_COLOR
+        self.underline = False
+        self.bold = False
+        self.italic = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'font':
+            for (attr, value) in attrs:
+                if attr == 'color':
+                    color = value.strip('#')
+                    self.color = (int(color[:2], 16), int(color[2:4], 16), int(color[4:], 16))
+        elif tag == 'u':
+            self.underline = True
+        elif tag == 'b':
+            self.bold = True
+        elif tag == 'i':
+            self.italic = True
+
+    def handle_data(self, data):
+        self.strings.append(data)
+        self.colors.append(self.color)
+        self.attributes.append(dict(b=self.bold, u=self.underline, i=self.italic))
+
+    def handle_endtag(self, tag):
+        if tag == 'font':
+            self.color = NULL_COLOR
+        elif tag == 'u':
+            self.underline = False
+        elif tag == 'b':
+            self.bold = False
+        elif tag == 'i':
+            self.italic = False
+
+    def wipe(self):
+        self.colors.clear()
+        self.strings.clear()
+        self.attributes.clear()
+        self.color = NULL_COLOR
+        self.underline = False
+        self.bold = False
+        self.italic = False
+
+    def has_pending_input(self):
+        """
+        True if the parser holds back input which will be parsed together with the next content, e.g. an unfinished
+        tag or character reference
+        """
+        return bool(self.rawdata) or self.cdata_elem is not None
+
+
+# The tags handled directly by parse_subtitle_markup and the separator between subtitles. Any other '<' is matched on
+# its own and makes the content of that subtitle go through SubtitleParser.
+MARKUP_SEPARATOR = '\x00'
+MARKUP_TOKEN_REGEX = re.compile(r'(<(?:[biu]|/(?:[biu]|font)|font color=(?:"#[0-9a-f]{6}"|\'#[0-9a-f]{6}\'))>|<|\x00)',
+                                re.IGNORECASE)
+# Style bits set or cleared by each tag, None for </font>, in all combinations of upper and lower case
+MARKUP_TAG_STYLES = {''.join(characters): style
+                     for tag, style in [('<b>', (1, True)), ('<i>', (2, True)), ('<u>', (4, True)),
+                                        ('</b>', (1, False)), ('</i>', (2, False)), ('</u>', (4, False)),
+                                        ('</font>', None)]
+                     for characters in itertools.product(*[{c, c.upper()} for c in tag])}
+# Bold, italic and underline flags for each combination of style bits
+MARKUP_STYLE_FLAGS = np.array([(code & 1, code & 2, code & 4) for code in range(8)], dtype=bool)
+# SubtitleParser holds back text ending with an ampersand which could be the start of a character reference
+MARKUP_UNFINISHED_REFERENCE_LENGTH = 34
+MARKUP_REFERENCE_END_REGEX = re.compile(r'[\s;]')
+
+
+def parse_subtitle_markup(content, content_offsets):
+    """
+    Split the contents of all subtitles of a file into strings with font color and styles in a single pass. The
+    result is the same as feeding the content of each subtitle to SubtitleParser in turn, which is done for the
+    subtitles with markup other than <b>, <i>, <u> and <font color="#rrggbb"> and their end tags.
+    :param content: The contents of all subtitles concatenated into a single string
+    :param content_offsets: Integer array of length n + 1, the content of subtitle i is
+                            content[content_offsets[i]:content_offsets[i+1]]
+    :return: A tuple (strings, colors, styles, string_index) where strings is a list of strings, colors an int16 array
+             of shape (len(strings), 3), styles a bool array of shape (len(strings), 3) with the bold, italic and
+             underline flags and string_index an uint32 array of shape (n, 2) with the start and end indices of the
+             strings of each subtitle
+    """
+    content_offsets = np.asarray(content_offsets).tolist()
+    n_subtitles = len(content_offsets) - 1
+    contents = [content[start:end] for start, end in zip(content_offsets[:-1], content_offsets[1:])]
+
+    strings = []
+    colors = []
+    style_codes = []
+    string_index = []
+    fallback_parser = SubtitleParser()
+
+    if MARKUP_SEPARATOR in content:
+        # The separator can't be told apart from the content, parse all subtitles with SubtitleParser
+        texts, tokens = [''] * n_subtitles, []
+        token_offsets = [0] * (n_subtitles + 1)
+        simple = [False] * n_subtitles
+    else:
+        # Splitting gives alternating texts and tokens, texts[k] comes right before tokens[k]
+        parts = MARKUP_TOKEN_REGEX.split(MARKUP_SEPARATOR.join(contents))
+        texts, tokens = parts[0::2], parts[1::2]
+        separators = [k for k, token in enumerate(tokens) if token == MARKUP_SEPARATOR]
+        # The tokens of subtitle i are tokens[token_offsets[i]:token_offsets[i+1]-1], followed by its last text
+        token_offsets = [0] + [k + 1 for k in separators] + [len(tokens) + 1]
+        simple = [True] * n_subtitles
+        n_separators = 0
+        for token in tokens:
+            if token == MARKUP_SEPARATOR:
+                n_separators += 1
+            elif token == '<':
+                simple[n_separators] = False
+
+    for i in range(n_subtitles):
+        string_start = len(strings)
+        first_token, end_token = token_offsets[i], token_offsets[i + 1] - 1
+        last_text = texts[end_token]
+        if simple[i] and '&' in last_text:
+            ampersand = last_text.rfind('&', max(0, len(last_text) - MARKUP_UNFINISHED_REFERENCE_LENGTH))
+            if ampersand >= 0 and not MARKUP_REFERENCE_END_REGEX.search(last_text, ampersand):
+                simple[i] = False
+        if not simple[i] or fallback_parser.has_pending_input():
+            fallback_parser.wipe()
+            fallback_parser.feed(contents[i])
+            strings.extend(fallback_parser.strings)
+            colors.extend(fallback_parser.colors)
+            style_codes.extend(style['b'] + 2 * style['i'] + 4 * style['u'] for style in fallback_parser.attributes)
+            string_index.append((string_start, len(strings)))
+            continue
+
+        color = NULL_COLOR
+        style_code = 0
+        for k in range(first_token, end_token):
+            text = texts[k]
+            if text:
+                strings.append(html.unescape(text) if '&' in text else text)
+                colors.append(color)
+                style_codes.append(style_code)
+            token = tokens[k]
+            tag_style = MARKUP_TAG_STYLES.get(token, False)
+            if tag_style is None:
+                color = NULL_COLOR
+            elif tag_style is False:
+                # <font color="#rrggbb">
+                hex_color = token[14:20]
+                color = (int(hex_color[:2], 16), int(hex_color[2:4], 16), int(hex_color[4:], 16))
+            else:
+                bit, value = tag_style
+                style_code = style_code | bit if value else style_code & ~bit
+        if last_text:
+            strings.append(html.unescape(last_text) if '&' in last_text else last_text)
+            colors.append(color)
+            style_codes.append(style_code)
+        string_index.append((string_start, len(strings)))
+
+    return (strings,
+            np.array(colors, dtype=np.int16).reshape(-1, 3),
+            MARKUP_STYLE_FLAGS[np.array(style_codes, dtype=np.int64)],
+            np.array(string_index, dtype=np.uint32).reshape(-1, 2))
+
 
 class SubtitleFacet(FacetHandler):
-    def __init__(self, *args, **kwargs):
-        super(SubtitleFacet, self).__init__(*args, **kwargs)
-        self.strings = self.facetgroup['strings'][:]
-        self.string_index = self.facetgroup['string_index'][:]
-        self.times = self.facetgroup['times'][:]
-        self.string_styles = self.facetgroup['string_styles'][:]
-        self.string_colors = self.facetgroup['string_colors'][:]
+    # The subtitle arrays are read from the HDF5 file on first use, so opening a dataset doesn't decode all subtitles
+    string_index = LazyDataset('string_index')
+    times = LazyDataset('times')
+    string_styles = LazyDataset('string_styles')
+    string_colors = LazyDataset('string_colors')
+
+    @LazyAttribute
+    def strings(self):
+        if 'strings_utf8' in self.facetgroup:
+            return PackedStrings(self.facetgroup['strings_utf8'][:], self.facetgroup['strings_offsets'][:])
+        # Facets created before the packed layout store the strings as a variable length string dataset
+        strings = self.facetgroup['strings']
+        if hasattr(strings, 'asstr'):
+            return strings.asstr()[:]
+        return strings[:]
 
     @classmethod
     def create_facets(cls, subtitles_modality, subtitles_paths):
@@ -21,64 +256,28 @@ class SubtitleFacet(FacetHandler):
             cls.create_facet(subtitle_name, subtitles_modality, subtitles_path)
 
     @classmethod
-    def create_facet(cls, name, modality_group, subtitles_file):
+    def create_facet(cls, name, modality_group, subtitles_file, packed_strings=True):
+        """
+        Create a subtitle facet from a SubRip or TTML file, TTML files are recognized by their extension (see
+        TTML_EXTENSIONS)
+        :param name: Name of the facet
+        :param modality_group: The HDF5 group of the subtitles modality
+        :param subtitles_file: Path to the subtitles file
+        :param packed_strings: If True, the strings are stored as one UTF-8 byte array with offsets, otherwise as a
+                               variable length string dataset (the layout used by older versions)
+        """
+        import os.path
         import multimodal.srt as srt
-        import html.parser
-        import h5py
 
-        class SubtitleParser(html.parser.HTMLParser):
-
-            def __init__(self):
-                super(SubtitleParser, self).__init__()
-                self.colors = []
-                self.strings = []
-                self.attributes = []
-                self.color = NULL_COLOR
-                self.underline = False
-                self.bold = False
-                self.italic = False
-
-
-            def handle_starttag(self, tag, attrs):
-                if tag == 'font':
-                    for (attr, value) in attrs:
-                        if attr == 'color':
-                            color = value.strip('#')
-                            self.color = (int(color[:2], 16), int(color[2:4], 16), int(color[4:], 16))
-                elif tag == 'u':
-                    self.underline = True
-                elif tag == 'b':
-                    self.bold = True
-                elif tag == 'i':
-                    self.italic = True
-
-            def handle_data(self, data):
-                self.strings.append(data)
-                self.colors.append(self.color)
-                self.attributes.append(dict(b=self.bold, u=self.underline, i=self.italic))
-
-            def handle_endtag(self, tag):
-                if tag == 'font':
-                    self.color = NULL_COLOR
-                elif tag == 'u':
-                    self.underline = False
-                elif tag == 'b':
-                    self.bold = False
-                elif tag == 'i':
-                    self.italic = False
-
-            def wipe(self):
-                self.colors.clear()
-                self.strings.clear()
-                self.attributes.clear()
-                self.color = NULL_COLOR
-                self.underline = False
-                self.bold = False
-                self.italic = False
+        if os.path.splitext(subtitles_file)[1].lower() in TTML_EXTENSIONS:
+            import multimodal.ttml as ttml
+            (subtitle_times, subtitle_strings, subtitle_strings_colors, subtitle_strings_styles,
+             subtitle_string_index) = ttml.parse_styled(subtitles_file)
+            return cls.write_facet(name, modality_group, subtitle_times, subtitle_strings, subtitle_strings_colors,
+                                   subtitle_strings_styles, subtitle_string_index, packed_strings)
 
         with open(subtitles_file) as fp:
-            subtitles = list(srt.parse(fp.read()))
-        subtitle_parser = SubtitleParser()
+            subtitles = srt.parse_arrays(fp.read())
 
         ## Each subtitle can contain multiple font-tagged elements. Since we want to preserve the font-information, we
         ## need to save the potentially multiple subtitles as independent strings. We solve this by using two layers of
@@ -86,42 +285,41 @@ class SubtitleFacet(FacetHandler):
         ## equal or more rows than the intervals. We use a separate index to mark which strings belong to each subtitle
         ## interval using start and end indices into the strings dataset.
 
-        subtitle_times = []  # These are the subtitle times as start and end intervals
-        subtitle_string_index = []  # These are start and end indices into the subtitle_strings dataset.
-        # Its shape is (len(subtitle_times), 2)
-        subtitle_strings = []
-        subtitle_strings_colors = []  # These are the font colors for each of the strings
-        subtitle_strings_styles = []  # These are other attributes (underline, italic or bold)
-        start_subtitle = 0
-        for subtitle in subtitles:
-            subtitle_parser.wipe()
-            start = subtitle.start.total_seconds()
-            end = subtitle.end.total_seconds()
-            subtitle_times.append((start, end))
-
-            subtitle_parser.feed(subtitle.content)
-
-            subtitle_strings.extend(subtitle_parser.strings)
-            subtitle_strings_colors.extend(subtitle_parser.colors)
-            subtitle_strings_styles.extend(subtitle_parser.attributes)
-            subtitle_string_index.append((start_subtitle, start_subtitle+len(subtitle_parser.strings)))
-            start_subtitle += len(subtitle_parser.strings)
+        subtitle_times = subtitles.times  # These are the subtitle times as start and end intervals
+        # subtitle_string_index holds start and end indices into the strings, its shape is (len(subtitle_times), 2).
+        # The colors are the font colors for each of the strings and the styles are the other attributes (bold,
+        # italic or underline)
+        subtitle_strings, subtitle_strings_colors, subtitle_strings_styles, subtitle_string_index = \
+            parse_subtitle_markup(subtitles.content, subtitles.content_offsets)
+        return cls.write_facet(name, modality_group, subtitle_times, subtitle_strings, subtitle_strings_colors,
+                               subtitle_strings_styles, subtitle_string_index, packed_strings)
 
+    @classmethod
+    def write_facet(cls, name, modality_group, subtitle_times, subtitle_strings, subtitle_strings_colors,
+                    subtitle_strings_styles, subtitle_string_index, packed_strings=True):
+        """
+        Write the arrays of parsed subtitles to a new facet group, see create_facet
+        """
+        import h5py
         subtitles_facet = modality_group.require_group(name)
 
-        subtitles_facet.create_dataset('times', data=np.array(subtitle_times, dtype=np.float32))
-        subtitles_facet.create_dataset('string_index', data=np.array(subtitle_string_index, dtype=np.uint32))
-
-        subtitle_texts = subtitles_facet.create_dataset('strings',
-                                                        shape=(len(subtitle_strings),),
-                                                        dtype=h5py.special_dtype(vlen=str))
-        subtitle_texts[:] = subtitle_strings
+        subtitles_facet.create_dataset('times', data=subtitle_times.astype(np.float32))
+        subtitles_facet.create_dataset('string_index', data=subtitle_string_index)
 
-        arr_subtitle_strings_colors = np.array(subtitle_strings_colors, dtype=np.int16)
-        subtitles_facet.create_dataset('string_colors', data=arr_subtitle_strings_colors)
+        if packed_strings:
+            packed = PackedStrings.from_strings(subtitle_strings)
+            subtitles_facet.create_dataset('strings_utf8', data=packed.data)
+            subtitles_facet.create_dataset('strings_offsets', data=packed.offsets)
+            subtitles_facet.attrs['StringStorage'] = 'packed'
+        else:
+            subtitle_texts = subtitles_facet.create_dataset('strings',
+                                                            shape=(len(subtitle_strings),),
+                                                            dtype=h5py.special_dtype(vlen=str))
+            subtitle_texts[:] = subtitle_strings
+            subtitles_facet.attrs['StringStorage'] = 'vlen'
 
-        arr_subtitle_string_styles = np.array([(style['b'], style['i'], style['u']) for style in subtitle_strings_styles], dtype=np.bool)
-        styles_dataset = subtitles_facet.create_dataset('string_styles', data=arr_subtitle_string_styles)
+        subtitles_facet.create_dataset('string_colors', data=subtitle_strings_colors)
+        subtitles_facet.create_dataset('string_styles', data=subtitle_strings_styles)
 
         subtitles_facet.attrs['FacetHandler'] = 'SubtitleFacet'
         return SubtitleFacet(subtitles_facet)
@@ -142,21 +340,52 @@ class SubtitleFacet(FacetHandler):
         if isinstance(item, slice):
             times = self.times[item]
             string_indices = self.string_index[item]
-            strings = self.strings[string_indices]
-            return zip(times, strings)
+            texts = ['\n'.join(self.strings[start:end]) for start, end in string_indices]
+            return zip(times, texts)
         elif isinstance(item, Integral):
             if item >= len(self.times):
                 raise IndexError()
             time = self.times[item]
-            string_indices = self.string_index[item]
-            strings = self.strings[string_indices]
-            return time, '\n'.join(strings)
+            start, end = self.string_index[item]
+            return time, '\n'.join(self.strings[start:end])
         else:
             raise TypeError("Invalid argument type.")
 
     def get_times(self):
         return self.times[:]
 
+    def get_time_index(self):
+        """
+        Return an IntervalIndex over the subtitle times, it's built on first use and then cached
+        """
+        try:
+            return self._time_index
+        except AttributeError:
+            from multimodal.intervals import IntervalIndex
+            self._time_index = IntervalIndex(self.times)
+            return self._time_index
+
+    def get_overlapping(self, start, end):
+        """
+        Return the indices of the subtitles which overlaps the time interval [start, end), ordered by start time
+        """
+        return self.get_time_index().overlapping(start, end)
+
+    def get_overlapping_batch(self, starts, ends):
+        """
+        Find the subtitles overlapping each of the time intervals [starts[i], ends[i]).
+        :return: A tuple (offsets, indices), where the subtitles overlapping interval i are indices[offsets[i]:offsets[i+1]]
+        """
+        return self.get_time_index().overlapping_batch(starts, ends)
+
+    def get_active(self, timestamps):
+        """
+        Find the subtitle shown at each of the timestamps
+        :param timestamps: An array of times in seconds
+        :return: An integer array with the index of the active subtitle for each timestamp, -1 where no subtitle is shown
+        """
+        return self.get_time_index().active_at(timestamps)
+
     def get_times_filtered(self, filter):
         """
         Only return times for which the filter returns true
@@ -175,40 +404,48 @@ class SubtitleFacet(FacetHandler):
     def get_texts(self):
         return self.strings[:]
 
+    def get_formatted_strings(self):
+        """
+        Returns the strings with their colors and styles as SubRip markup
+        :return: a list of strings
+        """
+        string_colors = self.string_colors.reshape(-1, 3)
+        colored = np.all(string_colors != NULL_COLOR, axis=1)
+        styles = self.string_styles.reshape(-1, 3).astype(np.int64)
+        style_codes = styles[:, 0] + 2 * styles[:, 1] + 4 * styles[:, 2]
+        # The opening and closing tags for each combination of bold, italic and underlined
+        style_tags = []
+        for code in range(8):
+            tags = [tag for bit, tag in enumerate(('b', 'i', 'u')) if code & (1 << bit)]
+            style_tags.append((''.join('<{}>'.format(tag) for tag in tags),
+                               ''.join('</{}>'.format(tag) for tag in reversed(tags))))
+        font_tags = [''] * len(colored)
+        for j in np.flatnonzero(colored):
+            font_tags[j] = '<font color="#{:02x}{:02x}{:02x}">'.format(*string_colors[j])
+        formatted_strings = []
+        for string, font_tag, code in zip(self.strings, font_tags, style_codes.tolist()):
+            opening_tags, closing_tags = style_tags[code]
+            if font_tag:
+                formatted_strings.append(font_tag + opening_tags + string + closing_tags + '</font>')
+            else:
+                formatted_strings.append(opening_tags + string + closing_tags)
+        return formatted_strings
+
+    def write_subrip(self, fp):
+        """
+        Write the subtitles in SubRip format to a file object opened in text mode
+        """
+        import multimodal.srt as srt
+        formatted_strings = self.get_formatted_strings()
+        contents = ['\n'.join(formatted_strings[start:end]) for start, end in self.string_index.tolist()]
+        srt.compose_arrays(self.times, contents, fp=fp)
+
     def get_subrip_texts(self):
         """
         Returns the subtitles in SubRip format
         :return: a string with the SubRip formatted subtitles
         """
-        import multimodal.srt as srt
-        from datetime import timedelta
-        subtitle_entries = []
-        for i in range(len(self.times)):
-            start, end = self.times[i]
-            start_string, end_string = self.string_index[i]
-            strings = []
-            for j in range(start_string, end_string):
-                opening_tags = []
-                closing_tags = []
-                string = self.strings[j]
-                string_color = self.string_colors[j]
-                (bold, italic, underlined) = self.string_styles[j]
-                if np.all(string_color != NULL_COLOR):
-                    hex_color_string = ''.join(['{:02x}'.format(c) for c in string_color])
-                    opening_tags.append('<font color="#{}">'.format(hex_color_string))
-                    closing_tags.append('</font>')
-                if bold:
-                    opening_tags.append('<b>')
-                    closing_tags.append('</b>')
-                if italic:
-                    opening_tags.append('<i>')
-                    closing_tags.append('</i>')
-                if underlined:
-                    opening_tags.append('<u>')
-                    closing_tags.append('</u>')
-                formatted_string = ''.join(opening_tags) + string + ''.join(reversed(closing_tags))
-                strings.append(formatted_string)
-            text = '\n'.join(strings)
-            entry = srt.Subtitle(i+1, start=timedelta(seconds=float(start)), end=timedelta(seconds=float(end)), content=text)
-            subtitle_entries.append(entry)
-        return srt.compose(subtitle_entries)
+        import io
+        fp = io.StringIO()
+        self.write_subrip(fp)
+        return fp.getvalue()
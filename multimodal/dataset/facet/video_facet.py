@@ -3,13 +3,14 @@ import tempfile
 import numpy as np
 import imageio
 import itertools
-from multimodal.dataset.facet.facet_handler import FacetHandler
+from multimodal.dataset.facet.facet_handler import FacetHandler, HDF5Node
 
 class VideoFacet(FacetHandler):
+    frames = HDF5Node('frames')
+    frame_sizes = HDF5Node('frame_sizes')
+
     def __init__(self, *args, **kwargs):
         super(VideoFacet, self).__init__(*args, **kwargs)
-        self.frames = self.facetgroup['frames']
-        self.frame_sizes = self.facetgroup['frame_sizes']
         self.fps = self.facetgroup.attrs['rate']
 
     def get_samplerate(self):
@@ -20,7 +21,7 @@ class VideoFacet(FacetHandler):
         Return the length in seconds
         :return:
         """
-        return self.fps*len(self.frame_sizes)
+        return len(self.frame_sizes) / self.fps
 
     def get_frames_by_seconds(self, times):
         """
@@ -44,11 +45,37 @@ class VideoFacet(FacetHandler):
                 frames.append(self.uncompress_frames(start_frame, end_frame))
             return frames
 
-    def uncompress_frames(self, start_frame, end_frame):
+    def get_n_frames(self):
+        return len(self.frame_sizes)
+
+    def get_frame_shape(self):
+        """
+        Return the shape (height, width, channels) of the decoded frames, the first frame is decoded to find out
+        """
+        try:
+            return self._frame_shape
+        except AttributeError:
+            first_frame = self.uncompress_frames(0, 1)[0]
+            self._frame_shape, self._frame_dtype = first_frame.shape, first_frame.dtype
+            return self._frame_shape
+
+    def get_frame_dtype(self):
+        self.get_frame_shape()
+        return self._frame_dtype
+
+    def read_frames_into(self, start, end, out):
+        """
+        Decode the frames from start (inclusive) to end (non-inclusive) directly into out
+        """
+        if end > start:
+            self.uncompress_frames(start, end, out=out)
+
+    def uncompress_frames(self, start_frame, end_frame, out=None):
         """
         Returns the uncompressed frames from a start_frame (inclusive) to end_frame (non-inclusive)
         :param start_frame: First frame to decompress.
         :param end_frame: end of range, this frame is not included in the decompressed volume
+        :param out: Optional array of shape (end-start, height, width, channels) to decode the frames into
         :return: A numpy nd-array with shape (end-start, height, width, channels)
         """
         sizes = self.frame_sizes[start_frame:end_frame]
@@ -63,10 +90,15 @@ class VideoFacet(FacetHandler):
         sizes -= start_byte
         frame_start = 0
         frames = []
-        for frame_end in sizes:
-            frame = frame_data[frame_start: frame_end]
-            frames.append(imageio.imread(frame.tobytes(), 'jpeg'))
+        for i, frame_end in enumerate(sizes):
+            frame = imageio.imread(frame_data[frame_start: frame_end].tobytes(), 'jpeg')
+            if out is not None:
+                out[i] = frame
+            else:
+                frames.append(frame)
             frame_start = frame_end
+        if out is not None:
+            return out
         return np.array(frames)
 
     @classmethod
@@ -0,0 +1,241 @@
+"""
+HDF5 files opened read only on behalf of datasets and facets, in a pool of at most max_open files per process. Files
+are opened when they're first read from, and when the pool is full the least recently used file is closed. Every open
+of a file gets a new generation number, datasets and facets which looked up their groups in a file which has since
+been closed notice that the generation has changed and look them up again in a newly opened file. When a file is
+closed its users are told to release their h5py objects, as every live HDF5 object adds to the memory and the time it
+takes to close a file.
+
+This is used by datasets opened with pooled=True, e.g. those of VideoDatasets, and by datasets and facets which are
+used in another process than the one which created them, e.g. after being pickled to a spawned worker or inherited
+by a forked one.
+
+h5py objects inherited through fork refer to the file handles of the parent process and must not be used or closed in
+the child, they are kept referenced here so that they are never closed by the garbage collector.
+
+Files are only evicted when another file is opened, so max_open should be larger than the number of files used at
+the same time, e.g. by the worker threads of a PrefetchIterator.
+
+The pool is shared by all datasets of a process, so its size is a setting of the process rather than of a dataset or
+a collection. It's DEFAULT_MAX_OPEN unless changed with set_max_open, e.g. at the start of a training script:
+
+    handles.set_max_open(64)
+    with VideoDatasets(dataset_paths) as datasets:
+        ...
+
+Every process has its own pool. Spawned worker processes start with DEFAULT_MAX_OPEN and have to call set_max_open
+themselves, forked ones keep the size of the parent.
+"""
+import collections
+import os
+import threading
+import time
+import weakref
+
+import h5py
+
+DEFAULT_MAX_OPEN = 256
+
+_inherited = []
+
+
+class HandlePoolStats(object):
+    """
+    Counts of a HandlePool. A reopen is an open of a file which has been closed by the pool before, if there are many
+    the pool is too small for the access pattern.
+    """
+    def __init__(self):
+        self.n_hits = 0
+        self.n_opens = 0
+        self.n_reopens = 0
+        self.n_evictions = 0
+        self.open_time = 0.
+        self.reopen_time = 0.
+        self.max_reopen_time = 0.
+
+    def get_mean_reopen_time(self):
+        if self.n_reopens == 0:
+            return 0.
+        return self.reopen_time / self.n_reopens
+
+    def format_summary(self):
+        return ("{} opens ({:.2f}s), {} reopens ({:.2f}s, {:.1f}ms/reopen, longest {:.1f}ms), {} evictions, "
+                "{} hits".format(self.n_opens, self.open_time, self.n_reopens, self.reopen_time,
+                                 1000 * self.get_mean_reopen_time(), 1000 * self.max_reopen_time, self.n_evictions,
+                                 self.n_hits))
+
+
+class HandlePool(object):
+    """
+    The read only files of a process, in least recently used order
+    """
+    def __init__(self, max_open=DEFAULT_MAX_OPEN):
+        """
+        :param max_open: Maximum number of open files, None for no limit
+        """
+        self.max_open = max_open
+        self.files = collections.OrderedDict()
+        self.generations = dict()
+        self.users = dict()
+        self.opened = set()
+        self.next_generation = 0
+        self.stats = HandlePoolStats()
+        self.lock = threading.RLock()
+        self.pid = os.getpid()
+
+    def check_pid(self):
+        """
+        Forget the files of the parent process after a fork
+        """
+        if self.pid != os.getpid():
+            keep_inherited(*self.files.values())
+            self.files.clear()
+            self.generations.clear()
+            self.users.clear()
+            self.opened.clear()
+            self.stats = HandlePoolStats()
+            self.lock = threading.RLock()
+            self.pid = os.getpid()
+
+    def get_file(self, path, user=None):
+        """
+        Return the h5py.File for path, opening it if needed
+        :param user: An object with a release_handles method which is called when the file is closed
+        """
+        self.check_pid()
+        with self.lock:
+            if user is not None:
+                self.add_user(path, user)
+            try:
+                store = self.files[path]
+            except KeyError:
+                pass
+            else:
+                self.files.move_to_end(path)
+                self.stats.n_hits += 1
+                return store
+            while self.max_open is not None and self.files and len(self.files) >= self.max_open:
+                self.close_file(next(iter(self.files)))
+                self.stats.n_evictions += 1
+            t0 = time.perf_counter()
+            store = h5py.File(path, 'r')
+            elapsed = time.perf_counter() - t0
+            self.stats.n_opens += 1
+            self.stats.open_time += elapsed
+            if path in self.opened:
+                self.stats.n_reopens += 1
+                self.stats.reopen_time += elapsed
+                self.stats.max_reopen_time = max(self.stats.max_reopen_time, elapsed)
+            self.opened.add(path)
+            self.files[path] = store
+            self.generations[path] = self.next_generation
+            self.next_generation += 1
+            return store
+
+    def add_user(self, path, user):
+        """
+        Call user.release_handles() when the file for path is closed, the user is only weakly referenced
+        """
+        self.check_pid()
+        with self.lock:
+            self.users.setdefault(path, weakref.WeakSet()).add(user)
+
+    def get_generation(self, path):
+        """
+        Return the generation of the open file for path, or None if it's not open
+        """
+        self.check_pid()
+        return self.generations.get(path)
+
+    def close_file(self, path):
+        """
+        Close the file for path if it's open, users of the file will open it again when needed
+        """
+        self.check_pid()
+        with self.lock:
+            store = self.files.pop(path, None)
+            self.generations.pop(path, None)
+            for user in list(self.users.pop(path, ())):
+                user.release_handles()
+            if store is not None:
+                store.close()
+
+    def close(self):
+        """
+        Close all files of the pool
+        """
+        self.check_pid()
+        with self.lock:
+            for path in list(self.files):
+                self.close_file(path)
+
+    def __len__(self):
+        return len(self.files)
+
+
+pool = HandlePool()
+
+
+def get_file(path, user=None):
+    """
+    Return the h5py.File for path opened read only in this process
+    :param user: An object with a release_handles method which is called when the file is closed
+    """
+    return pool.get_file(path, user=user)
+
+
+def add_user(path, user):
+    pool.add_user(path, user)
+
+
+def get_generation(path):
+    """
+    Return the generation of the file for path in the pool of this process, None if it's not open
+    """
+    return pool.get_generation(path)
+
+
+def set_max_open(max_open):
+    """
+    Set the maximum number of files open at the same time in this process, closing the least recently used files if
+    there are more. This applies to all datasets of the process, not only those created afterwards.
+    :param max_open: Maximum number of open files, None for no limit
+    :return: The previous maximum, so that it can be restored
+    """
+    pool.check_pid()
+    with pool.lock:
+        previous = pool.max_open
+        pool.max_open = max_open
+        while max_open is not None and len(pool.files) > max_open:
+            pool.close_file(next(iter(pool.files)))
+            pool.stats.n_evictions += 1
+    return previous
+
+
+def get_stats():
+    """
+    Return the HandlePoolStats of this process
+    """
+    pool.check_pid()
+    return pool.stats
+
+
+def keep_inherited(*objects):
+    """
+    Keep h5py objects which belong to a parent process referenced, so they're not closed in this process
+    """
+    _inherited.extend(objects)
+
+
+def close_files():
+    """
+    Close the files opened by get_file in this process
+    """
+    pool.close()
+
+
+def close_file(path):
+    """
+    Close the file for path if it's open in the pool of this process
+    """
+    pool.close_file(path)
@@ -1,45 +1,74 @@
+import os
+
 import h5py
 from multimodal.dataset.facet import make_facet, is_facet
+from multimodal.dataset.annotation import ANNOTATIONS_GROUP, AnnotationTrack, get_annotation_track, get_track_names
+from multimodal.dataset.handles import close_file, get_file, get_generation, keep_inherited
 
 
 class MultiModalDatasets(object):
     """
     Base class for dealing with multi-modal datasets. The datasets are contained in HDF5 files with a particular structure.
+    The files are opened when they're first used, in the handle pool of the process (see multimodal.dataset.handles).
+    The size of the pool is set for the whole process with multimodal.dataset.handles.set_max_open.
     """
     def __init__(self, hdf5_paths):
         self.hdf5_paths = hdf5_paths
-        self.datasets = [MultiModalDataset(hdf5_path) for hdf5_path in hdf5_paths]
+        self.datasets = [MultiModalDataset(hdf5_path, pooled=True) for hdf5_path in hdf5_paths]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for dataset in self.datasets:
+            dataset.close()
 
 
 class Modality(object):
-    def __init__(self, name, group):
+    def __init__(self, name, group, generation=None):
         self.name = name
         self.group = group
+        self.generation = generation
+        self.facet_groups = dict()
         self.facets = dict()
-        self.default_facet = None
+        self.default_facet_name = None
         self.setup_facets()
 
     def setup_facets(self):
+        """
+        Find the facets of this modality. The facet handlers are only created when the facet is first requested.
+        """
         try:
             default_facet_key = self.group.attrs['DefaultFacet']
         except KeyError:
-            self.default_facet = None
             default_facet_key = None
         for name, group in self.group.items():
             if is_facet(group):
-                facet = make_facet(group)
-                if name == default_facet_key or self.default_facet is None:
-                    self.default_facet = facet
-                self.facets[name] = facet
+                if name == default_facet_key or self.default_facet_name is None:
+                    self.default_facet_name = name
+                self.facet_groups[name] = group
+
+    @property
+    def default_facet(self):
+        if self.default_facet_name is None:
+            return None
+        return self.get_facet(self.default_facet_name)
+
+    def get_facet_names(self):
+        return list(self.facet_groups.keys())
 
     def get_facets(self):
-        return self.facets.values()
+        return [self.get_facet(name) for name in self.facet_groups]
 
     def get_facet(self, id=None):
         if id is None:
             return self.default_facet
-        else:
+        try:
             return self.facets[id]
+        except KeyError:
+            facet = make_facet(self.facet_groups[id], generation=self.generation)
+            self.facets[id] = facet
+            return facet
 
     def get_samplerate(self, id=None):
         facet = self.get_facet(id)
@@ -47,26 +76,102 @@ class Modality(object):
 
 
 class MultiModalDataset(object):
-    def __init__(self, hdf5_path, mode='r'):
+    """
+    A dataset in an HDF5 file. Datasets can be pickled, and can be used in forked processes: the first time a dataset
+    is used in a process other than the one which opened it, the file is opened again in that process. Read only
+    datasets share the file with the facets used in that process (see multimodal.dataset.handles), other datasets are
+    reopened in mode 'r+' so the file is never truncated.
+
+    Pooled datasets don't open the file until it's needed, and then open it in the handle pool. If the pool closes the
+    file to make room for others, the dataset and its facets open it again when they're next used.
+    """
+    def __init__(self, hdf5_path, mode='r', pooled=False):
+        """
+        :param hdf5_path: Path of the HDF5 file
+        :param mode: The h5py file mode, pooled datasets are read only
+        :param pooled: If True, open the file on demand in the handle pool of the process
+        """
+        if pooled and mode != 'r':
+            raise ValueError("Pooled datasets are read only, got mode {}".format(mode))
         self.hdf5_path = hdf5_path
         self.mode = mode
-        self.store = h5py.File(hdf5_path, mode=mode)
-        self.modalities = dict()
+        self.pooled = pooled
+        self._generation = None
+        if pooled:
+            self._store = None
+            self._owns_store = False
+            self._pid = None
+            self._modalities = None
+        else:
+            self._store = h5py.File(hdf5_path, mode=mode)
+            self._owns_store = True
+            self._pid = os.getpid()
+            self._modalities = dict()
+            self.setup_modalities()
+
+    def _is_stale(self):
+        return self._pid != os.getpid() or (self._generation is not None
+                                            and self._generation != get_generation(self.hdf5_path))
+
+    @property
+    def store(self):
+        if self._is_stale():
+            self._reopen()
+        return self._store
+
+    @property
+    def modalities(self):
+        if self._is_stale():
+            self._reopen()
+        return self._modalities
+
+    def _reopen(self):
+        if self._store is not None and self._pid != os.getpid():
+            keep_inherited(self._store)
+        self._pid = os.getpid()
+        if self.mode == 'r':
+            self._store = get_file(self.hdf5_path, user=self)
+            self._owns_store = False
+            self._generation = get_generation(self.hdf5_path)
+        else:
+            self._store = h5py.File(self.hdf5_path, mode='r+')
+            self._owns_store = True
+        self._modalities = dict()
         self.setup_modalities()
 
+    def release_handles(self):
+        """
+        Drop the file and the modalities when the handle pool closes the file, they're opened again when needed
+        """
+        self._store = None
+        self._modalities = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.update(_store=None, _owns_store=False, _pid=None, _modalities=None, _generation=None)
+        return state
+
     def setup_modalities(self):
         for name, group in self.store.items():
-            modality = Modality(name, group)
-            self.modalities[name] = modality
+            if name == ANNOTATIONS_GROUP:
+                continue
+            modality = Modality(name, group, generation=self._generation)
+            self._modalities[name] = modality
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.store.close()
+        self.close()
 
     def close(self):
-        self.store.close()
+        """
+        Close the file if this dataset opened it in this process, pooled datasets close the file in the pool
+        """
+        if self._pid == os.getpid() and self._owns_store:
+            self._store.close()
+        elif self.pooled:
+            close_file(self.hdf5_path)
 
     def remove_modality(self, modality):
         """
@@ -76,9 +181,43 @@ class MultiModalDataset(object):
         del self.store[modality]
         del self.modalities[modality]
 
+    def remove_facet(self, modality, facet):
+        """
+        Removes a facet from a modality of the dataset
+        :param modality: The name of the modality the facet belongs to
+        :param facet: The name of the facet to remove
+        """
+        modality_group = self.store[modality]
+        del modality_group[facet]
+        self.modalities[modality] = Modality(modality, modality_group, generation=self._generation)
+
     def get_facet(self, modality, facet_id=None):
         return self.modalities[modality].get_facet(facet_id)
 
+    def get_annotation_names(self):
+        """
+        Return the names of the annotation tracks of the dataset itself
+        """
+        return get_track_names(self.store)
+
+    def get_annotation_track(self, name, modality=None, facet_id=None):
+        """
+        Return an annotation track of a facet, or of the dataset itself if no modality is given
+        :raises KeyError: If there is no such track
+        """
+        if modality is None:
+            return get_annotation_track(self.store, name)
+        return self.get_facet(modality, facet_id).get_annotation_track(name)
+
+    def add_annotation_track(self, name, times, labels=None, attrs=None, overwrite=False):
+        """
+        Add an annotation track to the dataset itself, e.g. for annotations which apply to all modalities
+        :param times: A numpy array of shape (n, 2) with the intervals in seconds
+        :param labels: Optional sequence with a label string for each interval
+        :param attrs: Optional dictionary of attributes to store with the track
+        """
+        return AnnotationTrack.create(self.store, name, times, labels=labels, attrs=attrs, overwrite=overwrite)
+
     def get_all_facets(self, modalities):
         """
         Return all facets for the given modalities
@@ -0,0 +1,195 @@
+"""
+Prefetching of wrapper items in the background, so that reading from HDF5 and decoding video overlaps with whatever
+the consumer does with the items, e.g. a training step.
+
+Up to *depth* items are being loaded at any time, by a pool of worker threads or processes. The items are handed over
+in the order of the indices, however the workers finish them. Threads are cheap to start and share the open dataset,
+but h5py serializes all HDF5 calls, so only the decoding (which releases the GIL) runs in parallel. Worker processes
+read in parallel, the wrapper is inherited by forked workers or pickled to spawned ones and its datasets and facets
+open their files again in each worker.
+"""
+import collections
+import multiprocessing
+import multiprocessing.pool
+import time
+
+
+def get_item(wrapper, index):
+    """
+    The default load function, returns wrapper[index]
+    """
+    return wrapper[index]
+
+
+def _timed_load(function, wrapper, index):
+    t0 = time.perf_counter()
+    item = function(wrapper, index)
+    return item, time.perf_counter() - t0
+
+
+_worker_wrapper = None
+
+
+def _set_worker_wrapper(wrapper):
+    global _worker_wrapper
+    _worker_wrapper = wrapper
+
+
+def _load_in_worker(function, index):
+    return _timed_load(function, _worker_wrapper, index)
+
+
+class PrefetchStats(object):
+    """
+    Timing of a prefetching iterator. A stall is a request for the next item which had to wait for it to be loaded;
+    if the stall time is a large part of the elapsed time, the iterator needs more workers or a larger depth.
+    """
+    def __init__(self):
+        self.n_items = 0
+        self.n_stalls = 0
+        self.stall_time = 0.
+        self.max_stall = 0.
+        self.load_time = 0.
+        self.consumer_time = 0.
+        self.start_time = time.perf_counter()
+        self.end_time = None
+
+    def get_elapsed(self):
+        end_time = self.end_time if self.end_time is not None else time.perf_counter()
+        return end_time - self.start_time
+
+    def get_stall_ratio(self):
+        """
+        The fraction of the elapsed time the consumer spent waiting for items
+        """
+        elapsed = self.get_elapsed()
+        if elapsed == 0:
+            return 0.
+        return self.stall_time / elapsed
+
+    def get_mean_load_time(self):
+        if self.n_items == 0:
+            return 0.
+        return self.load_time / self.n_items
+
+    def get_mean_consumer_time(self):
+        if self.n_items == 0:
+            return 0.
+        return self.consumer_time / self.n_items
+
+    def get_suggested_workers(self):
+        """
+        The number of workers needed to load items as fast as the consumer uses them, assuming the loads run fully
+        in parallel
+        """
+        consumer_time = self.get_mean_consumer_time()
+        if consumer_time == 0:
+            return None
+        return max(1, int(-(-self.get_mean_load_time() // consumer_time)))
+
+    def format_summary(self):
+        return ("{} items in {:.2f}s, {} stalls ({:.2f}s, {:.1%} of the time, longest {:.3f}s), "
+                "load {:.1f}ms/item, consumer {:.1f}ms/item".format(
+                    self.n_items, self.get_elapsed(), self.n_stalls, self.stall_time, self.get_stall_ratio(),
+                    self.max_stall, 1000 * self.get_mean_load_time(), 1000 * self.get_mean_consumer_time()))
+
+
+class PrefetchIterator(object):
+    """
+    Iterator over the items of a wrapper which loads the next items in the background. Use it as a context manager,
+    or call close() if the iteration is abandoned before the end, to stop the workers.
+    """
+    def __init__(self, wrapper, indices=None, depth=8, n_workers=2, processes=False, function=get_item):
+        """
+        :param wrapper: The wrapper to read from, e.g. a SubtitlesAndStreamsWrapper or WrapperCollection
+        :param indices: The items to read in order, all items of the wrapper if None. An index can be anything the
+                        load function accepts, e.g. the lists of indices of a batch sampler.
+        :param depth: Maximum number of items loaded ahead of the consumer
+        :param n_workers: Number of worker threads or processes
+        :param processes: If True, load in worker processes instead of threads. The wrapper and the load function
+                          must then be picklable.
+        :param function: The load function, called as function(wrapper, index). The default returns wrapper[index],
+                         multimodal.dataset.batching.get_batch loads batches instead.
+        """
+        if indices is None:
+            indices = range(len(wrapper))
+        self.wrapper = wrapper
+        self.indices = iter(indices)
+        self.depth = max(1, depth)
+        self.function = function
+        self.processes = processes
+        if processes:
+            self.pool = multiprocessing.Pool(n_workers, initializer=_set_worker_wrapper, initargs=(wrapper,))
+        else:
+            self.pool = multiprocessing.pool.ThreadPool(n_workers)
+        self.pending = collections.deque()
+        self.stats = PrefetchStats()
+        self.last_handover = None
+        self.fill()
+
+    def fill(self):
+        """
+        Start loading items until depth items are pending
+        """
+        while self.pool is not None and len(self.pending) < self.depth:
+            try:
+                index = next(self.indices)
+            except StopIteration:
+                break
+            if self.processes:
+                self.pending.append(self.pool.apply_async(_load_in_worker, (self.function, index)))
+            else:
+                self.pending.append(self.pool.apply_async(_timed_load, (self.function, self.wrapper, index)))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        request_time = time.perf_counter()
+        if self.last_handover is not None:
+            self.stats.consumer_time += request_time - self.last_handover
+        if not self.pending:
+            self.close()
+            raise StopIteration
+        result = self.pending.popleft()
+        if not result.ready():
+            result.wait()
+            stall = time.perf_counter() - request_time
+            self.stats.n_stalls += 1
+            self.stats.stall_time += stall
+            self.stats.max_stall = max(self.stats.max_stall, stall)
+        try:
+            item, load_time = result.get()
+        except Exception:
+            self.close()
+            raise
+        self.stats.n_items += 1
+        self.stats.load_time += load_time
+        self.fill()
+        self.last_handover = time.perf_counter()
+        return item
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+            self.pending.clear()
+            self.stats.end_time = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def prefetch(wrapper, indices=None, depth=8, n_workers=2, processes=False, function=get_item):
+    """
+    Iterate over the items of a wrapper while the next items are loaded in the background, see PrefetchIterator
+    :return: A generator of the items
+    """
+    with PrefetchIterator(wrapper, indices, depth=depth, n_workers=n_workers, processes=processes,
+                          function=function) as iterator:
+        for item in iterator:
+            yield item
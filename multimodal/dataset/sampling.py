@@ -0,0 +1,438 @@
+"""
+Samplers deciding which wrapper items go in which batch. They only use the times of the items, so no streams are read
+while sampling.
+"""
+import collections
+
+import numpy as np
+
+from multimodal.dataset.annotation import iter_frame_ranges
+from multimodal.dataset.batching import get_batch
+
+
+def get_padding_efficiency(durations, batches):
+    """
+    The ratio of the padded batches which is actual data, assuming the streams are padded to the longest item in the
+    batch
+    :param durations: The duration of each item
+    :param batches: A list of lists of item indices
+    :return: The total duration of the items divided by the sum over the batches of batch size times longest duration
+    """
+    batches = [batch for batch in batches if len(batch) > 0]
+    if not batches:
+        return 1.
+    durations = np.asarray(durations, dtype=np.float64)
+    batch_sizes = np.array([len(batch) for batch in batches])
+    batch_durations = durations[np.concatenate(batches)]
+    batch_starts = np.cumsum(batch_sizes) - batch_sizes
+    padded = np.sum(np.maximum.reduceat(batch_durations, batch_starts) * batch_sizes)
+    if padded == 0:
+        return 1.
+    return float(np.sum(batch_durations) / padded)
+
+
+def block_shuffle(group_lengths, buffer_size, rng=None):
+    """
+    Shuffle the items of consecutive groups, e.g. the items of the datasets of a WrapperCollection, while keeping reads
+    local. The order of the groups is shuffled, and the items are then shuffled within consecutive windows of
+    *buffer_size* items in that order, like a shuffle buffer filled by reading the groups one by one. Any window only
+    spans the few groups it overlaps, so an epoch reads each group once and mostly in order.
+    :param group_lengths: The number of items in each group, the items of group g are numbered from
+                          sum(group_lengths[:g])
+    :param buffer_size: Number of items shuffled together
+    :param rng: The RandomState used for shuffling
+    :return: An array with a permutation of the item indices
+    """
+    if rng is None:
+        rng = np.random.RandomState()
+    group_lengths = np.asarray(group_lengths, dtype=np.int64)
+    group_starts = np.cumsum(group_lengths) - group_lengths
+    group_order = rng.permutation(len(group_lengths))
+    lengths = group_lengths[group_order]
+    new_starts = np.cumsum(lengths) - lengths
+    n_items = int(np.sum(lengths))
+    indices = np.arange(n_items) + np.repeat(group_starts[group_order] - new_starts, lengths)
+    windows = np.arange(n_items) // max(1, buffer_size)
+    return indices[np.lexsort((rng.random_sample(n_items), windows))]
+
+
+class BucketBatchSampler(object):
+    """
+    Batch sampler which groups items of similar duration, so that padded batches are mostly data. The items are sorted
+    by duration and split into buckets with the same number of items, and batches are only formed within a bucket.
+    Iterating over the sampler gives the batches of one epoch as lists of item indices.
+    """
+    def __init__(self, durations, batch_size, n_buckets=10, shuffle=True, drop_last=False, rng=None):
+        """
+        :param durations: The duration of each item, e.g. from the get_durations method of the stream wrappers
+        :param batch_size: Number of items per batch
+        :param n_buckets: Number of duration buckets
+        :param shuffle: If True, the items are shuffled within their bucket and the batches of all buckets are
+                        shuffled together every epoch. Otherwise the batches are in order of duration.
+        :param drop_last: If True, the last smaller batch of each bucket is dropped
+        :param rng: The RandomState used for shuffling
+        """
+        if rng is None:
+            rng = np.random.RandomState()
+        self.durations = np.asarray(durations, dtype=np.float64)
+        self.batch_size = batch_size
+        self.n_buckets = max(1, min(n_buckets, len(self.durations)))
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.rng = rng
+        order = np.argsort(self.durations, kind='stable')
+        self.buckets = np.array_split(order, self.n_buckets)
+        self.last_batches = None
+
+    @classmethod
+    def from_wrapper(cls, wrapper, batch_size, **kwargs):
+        """
+        Create a sampler for a stream wrapper or wrapper collection, using the times of its items
+        """
+        return cls(wrapper.get_durations(), batch_size, **kwargs)
+
+    def get_bucket_limits(self):
+        """
+        :return: An array of shape (n_buckets, 2) with the shortest and longest duration in each bucket
+        """
+        return np.array([(self.durations[bucket].min(), self.durations[bucket].max()) for bucket in self.buckets
+                         if len(bucket) > 0]).reshape(-1, 2)
+
+    def __len__(self):
+        bucket_sizes = np.array([len(bucket) for bucket in self.buckets])
+        if self.drop_last:
+            return int(np.sum(bucket_sizes // self.batch_size))
+        return int(np.sum(-(-bucket_sizes // self.batch_size)))
+
+    def get_batches(self):
+        """
+        Make the batches for an epoch
+        :return: A list of lists of item indices
+        """
+        batches = []
+        for bucket in self.buckets:
+            if self.shuffle:
+                bucket = self.rng.permutation(bucket)
+            n_batches = len(bucket) // self.batch_size if self.drop_last else -(-len(bucket) // self.batch_size)
+            batches.extend(bucket[i * self.batch_size:(i + 1) * self.batch_size].tolist() for i in range(n_batches))
+        if self.shuffle:
+            batches = [batches[i] for i in self.rng.permutation(len(batches))]
+        self.last_batches = batches
+        return batches
+
+    def __iter__(self):
+        return iter(self.get_batches())
+
+    def get_padding_efficiency(self):
+        """
+        The padding efficiency of the last epoch, see get_padding_efficiency
+        """
+        batches = self.last_batches if self.last_batches is not None else self.get_batches()
+        return get_padding_efficiency(self.durations, batches)
+
+    def get_random_padding_efficiency(self, rng=None):
+        """
+        The padding efficiency of batching the same items without bucketing, for comparison
+        """
+        if rng is None:
+            rng = np.random.RandomState()
+        order = rng.permutation(len(self.durations))
+        batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+        return get_padding_efficiency(self.durations, batches)
+
+
+def hash_uint64(values):
+    """
+    Mix 64 bit integers into well distributed hashes, with the finalizer of the SplitMix64 generator
+    :param values: An integer array
+    :return: A uint64 array with the same shape
+    """
+    with np.errstate(over='ignore'):
+        z = np.asarray(values).astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+def hash_keys(*keys):
+    """
+    Hash a sequence of integers or integer arrays, which are broadcast together, into one uint64 array
+    """
+    h = np.zeros((), dtype=np.uint64)
+    for key in keys:
+        h = hash_uint64(h ^ np.asarray(key).astype(np.uint64))
+    return h
+
+
+def get_item_uniforms(seed, epoch, items, stream=0):
+    """
+    Random numbers in [0, 1) which only depend on the seed, the epoch, the item and the stream of randomness, so an item
+    gets the same numbers whichever worker reads it and in whatever batch
+    :param stream: Different streams give independent numbers for the same item, e.g. for different random choices
+    :return: A float array with the shape of items
+    """
+    return (hash_keys(seed, epoch, stream, items) >> np.uint64(11)) * (1. / 2**53)
+
+
+def permute_positions(positions, n_items, seed, epoch):
+    """
+    Apply a random permutation of range(n_items), determined by the seed and epoch, to the given positions. Each
+    position is mapped independently by a Feistel network over the smallest power of 4 covering n_items, walking the
+    cycle of values outside range(n_items), so any part of an epoch's order is computed without the rest.
+    :param positions: An integer array of positions in the epoch, in range(n_items)
+    :return: An int64 array with the items at those positions
+    """
+    positions = np.asarray(positions, dtype=np.uint64)
+    half_bits = max(1, (int(n_items - 1).bit_length() + 1) // 2)
+    mask = np.uint64((1 << half_bits) - 1)
+    round_keys = [hash_keys(seed, epoch, round_number) for round_number in range(4)]
+
+    def feistel(x):
+        left, right = x >> np.uint64(half_bits), x & mask
+        for round_key in round_keys:
+            left, right = right, left ^ (hash_uint64(right ^ round_key) & mask)
+        return (left << np.uint64(half_bits)) | right
+
+    items = feistel(positions)
+    outside = np.flatnonzero(items >= n_items)
+    while len(outside) > 0:
+        items[outside] = feistel(items[outside])
+        outside = outside[items[outside] >= n_items]
+    return items.astype(np.int64)
+
+
+class EpochSampler(object):
+    """
+    Deterministic and resumable iteration over the items of a wrapper. The order of the items in an epoch and the
+    cropping of every item are derived from (seed, epoch, item) alone, so they don't depend on the number of workers or
+    how the items are batched. The state of the iteration is the seed, the epoch and the position in the epoch, see
+    get_state and set_state.
+    """
+    def __init__(self, n_items, seed=0, shuffle=True, epoch=0, position=0):
+        """
+        :param n_items: The number of items of the wrapper
+        :param seed: Seed of the item order and the item randomness
+        :param shuffle: If False, the items are taken in order every epoch
+        :param epoch: The epoch to start at
+        :param position: The position in the epoch to start at
+        """
+        self.n_items = n_items
+        self.seed = seed
+        self.shuffle = shuffle
+        self.epoch = epoch
+        self.position = position
+
+    @classmethod
+    def from_wrapper(cls, wrapper, **kwargs):
+        return cls(len(wrapper), **kwargs)
+
+    def __len__(self):
+        return self.n_items
+
+    def get_items(self, start=0, end=None, epoch=None):
+        """
+        Return the items at positions start to end of an epoch
+        :param epoch: The epoch, the current epoch if None
+        """
+        if epoch is None:
+            epoch = self.epoch
+        end = self.n_items if end is None else min(end, self.n_items)
+        positions = np.arange(start, max(start, end), dtype=np.int64)
+        if not self.shuffle:
+            return positions
+        return permute_positions(positions, self.n_items, self.seed, epoch)
+
+    def get_crop_positions(self, items, epoch=None):
+        """
+        Return where to crop the given items in an epoch, see multimodal.dataset.video.crop_times
+        """
+        if epoch is None:
+            epoch = self.epoch
+        return get_item_uniforms(self.seed, epoch, items)
+
+    def get_state(self):
+        """
+        :return: A dictionary with the state of the iteration, which can be stored in a checkpoint
+        """
+        return dict(seed=self.seed, epoch=self.epoch, position=self.position, n_items=self.n_items,
+                    shuffle=self.shuffle)
+
+    def set_state(self, state):
+        """
+        Continue the iteration from a state returned by get_state
+        """
+        if state['n_items'] != self.n_items:
+            raise ValueError("The state is for {} items, the sampler has {}".format(state['n_items'], self.n_items))
+        self.seed = state['seed']
+        self.epoch = state['epoch']
+        self.position = state['position']
+        self.shuffle = state['shuffle']
+
+    def iter_batch_items(self, batch_size, drop_last=False):
+        """
+        Iterate over the rest of the current epoch in batches of items. The position is advanced when a batch is
+        handed out, so a state saved after processing a batch continues with the next one. At the end of the epoch,
+        the sampler moves on to the next epoch.
+        :return: A generator of item arrays
+        """
+        while self.position < self.n_items:
+            items = self.get_items(self.position, self.position + batch_size)
+            if drop_last and len(items) < batch_size:
+                break
+            self.position += len(items)
+            yield items
+        self.epoch += 1
+        self.position = 0
+
+    def __iter__(self):
+        while self.position < self.n_items:
+            for item in self.get_items(self.position, self.position + 1024).tolist():
+                self.position += 1
+                yield item
+        self.epoch += 1
+        self.position = 0
+
+    def iter_batches(self, wrapper, batch_size, packed=False, drop_last=False):
+        """
+        Iterate over the rest of the current epoch in batches read from a wrapper, see iter_batch_items
+        :return: A generator of multimodal.dataset.batching.Batch
+        """
+        for items in self.iter_batch_items(batch_size, drop_last=drop_last):
+            yield get_batch(wrapper, items.tolist(), packed=packed,
+                            crop_positions=self.get_crop_positions(items, self.epoch))
+
+
+def build_alias_table(weights):
+    """
+    Build the table of Walker's alias method, for drawing indices with probability proportional to their weight in
+    constant time
+    :param weights: Non-negative weights, at least one of them positive
+    :return: A tuple (probabilities, aliases). Index i is kept with probability probabilities[i], otherwise it's
+             replaced by aliases[i].
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    if len(weights) == 0 or np.any(weights < 0) or not np.sum(weights) > 0:
+        raise ValueError("The weights must be non-negative with a positive sum")
+    scaled = weights * (len(weights) / np.sum(weights))
+    probabilities = np.ones(len(weights))
+    aliases = np.arange(len(weights))
+    small = np.flatnonzero(scaled < 1).tolist()
+    large = np.flatnonzero(scaled >= 1).tolist()
+    scaled = scaled.tolist()
+    while small and large:
+        less, more = small.pop(), large.pop()
+        probabilities[less] = scaled[less]
+        aliases[less] = more
+        scaled[more] -= 1 - scaled[less]
+        if scaled[more] < 1:
+            small.append(more)
+        else:
+            large.append(more)
+    return probabilities, aliases
+
+
+def draw_alias(probabilities, aliases, n, rng):
+    """
+    Draw n indices from an alias table, see build_alias_table
+    """
+    indices = rng.randint(len(probabilities), size=n)
+    return np.where(rng.random_sample(n) < probabilities[indices], indices, aliases[indices])
+
+
+class WindowBatch(collections.namedtuple('WindowBatch', ['datasets', 'times', 'streams'])):
+    """
+    A batch of random windows. datasets has the dataset index of each window and times its start and end time in
+    seconds, streams has an array of shape (batch_size, window_frames, ...) for each stream.
+    """
+
+
+class RandomWindowSampler(object):
+    """
+    Sampler of fixed length windows drawn uniformly over all the footage of a collection of datasets, i.e. every
+    dataset is chosen with probability proportional to the number of windows which fit in it.
+    """
+    def __init__(self, datasets, stream_facets, window_length, rng=None, max_gap=0):
+        """
+        :param datasets: A VideoDatasets, or a list of VideoDataset
+        :param stream_facets: The modalities to read windows from, their default facets are used. The streams of a
+                              modality must have the same rate in all datasets.
+        :param window_length: The length of the windows in seconds
+        :param rng: The RandomState used for drawing windows
+        :param max_gap: Windows of a dataset which are at most this many frames apart are read together
+        """
+        if rng is None:
+            rng = np.random.RandomState()
+        if isinstance(stream_facets, str):
+            stream_facets = [stream_facets]
+        self.datasets = getattr(datasets, 'datasets', datasets)
+        self.stream_facets = stream_facets
+        self.window_length = window_length
+        self.rng = rng
+        self.max_gap = max_gap
+        self.streams = [[dataset.modalities[stream_facet].get_facet() for stream_facet in stream_facets]
+                        for dataset in self.datasets]
+        self.rates = [self.streams[0][s].get_samplerate() for s in range(len(stream_facets))]
+        for dataset_streams in self.streams:
+            if [stream.get_samplerate() for stream in dataset_streams] != self.rates:
+                raise ValueError("The streams of {} must have the same rates in all datasets".format(stream_facets))
+        self.window_frames = [int(np.ceil(window_length * rate)) for rate in self.rates]
+        self.lengths = np.array([min(stream.get_length_s() for stream in dataset_streams)
+                                 for dataset_streams in self.streams])
+        fits = np.array([all(stream.get_n_frames() >= window_frames
+                             for stream, window_frames in zip(dataset_streams, self.window_frames))
+                         for dataset_streams in self.streams], dtype=bool)
+        self.start_ranges = np.where(fits, np.maximum(self.lengths - window_length, 0), 0)
+        self.probabilities, self.aliases = build_alias_table(self.start_ranges)
+
+    def get_total_length(self):
+        return float(np.sum(self.lengths))
+
+    def draw(self, n):
+        """
+        Draw random windows
+        :return: A tuple (datasets, starts) with the dataset index and start time in seconds of each window
+        """
+        datasets = draw_alias(self.probabilities, self.aliases, n, self.rng)
+        return datasets, self.rng.random_sample(n) * self.start_ranges[datasets]
+
+    def read_windows(self, datasets, starts):
+        """
+        Read windows of all streams. The windows of a dataset are read together, sorted by start, and windows which
+        overlap or are close are read with a single read.
+        :param datasets: The dataset index of each window
+        :param starts: The start time of each window in seconds
+        :return: A WindowBatch
+        """
+        datasets = np.asarray(datasets, dtype=np.int64)
+        starts = np.asarray(starts, dtype=np.float64)
+        stream_arrays = []
+        for s, (rate, window_frames) in enumerate(zip(self.rates, self.window_frames)):
+            first_stream = self.streams[datasets[0]][s] if len(datasets) else self.streams[0][s]
+            frames = np.empty((len(datasets), window_frames) + tuple(first_stream.get_frame_shape()),
+                              dtype=first_stream.get_frame_dtype())
+            for dataset in np.unique(datasets).tolist():
+                windows = np.flatnonzero(datasets == dataset)
+                stream = self.streams[dataset][s]
+                start_frames = np.minimum((starts[windows] * rate).astype(np.int64),
+                                          max(stream.get_n_frames() - window_frames, 0))
+                frame_ranges = np.stack([start_frames, start_frames + window_frames], axis=1)
+                order = np.argsort(start_frames, kind='stable')
+                for window, window_frames_read in zip(windows[order].tolist(),
+                                                      iter_frame_ranges(stream, frame_ranges[order],
+                                                                        max_gap=self.max_gap,
+                                                                        batch_size=len(windows))):
+                    frames[window] = window_frames_read
+            stream_arrays.append(frames)
+        times = np.stack([starts, starts + self.window_length], axis=1)
+        return WindowBatch(datasets, times, stream_arrays)
+
+    def get_batch(self, batch_size):
+        """
+        Draw and read a batch of random windows
+        :return: A WindowBatch
+        """
+        return self.read_windows(*self.draw(batch_size))
+
+    def iter_batches(self, batch_size, n_batches):
+        for i in range(n_batches):
+            yield self.get_batch(batch_size)
@@ -0,0 +1,239 @@
+"""
+Export of wrapper items into shard files which are read sequentially, for training from filesystems where random
+access into the HDF5 files of the datasets is slow.
+
+A shard is a single binary file with one packed array per stream, holding the decoded frames of all items of the shard
+concatenated, followed by the offsets of the items in each stream and the texts of the items as packed UTF-8 strings.
+The arrays start at aligned byte offsets and are described (offset, dtype and shape) in a JSON file, so they can be
+memory mapped directly. Items are written in order, so reading a shard from start to end only reads forward.
+
+The shards of a dataset are written by a single process, every shard but the last is about shard_bytes large. The
+directory of an export has the shards, a JSON file for every dataset listing its shards, and an index.json listing
+the shards of all datasets in order.
+"""
+import hashlib
+import json
+import os
+import os.path
+from numbers import Integral
+
+import numpy as np
+
+from multimodal.dataset.batching import PackedSequences
+from multimodal.dataset.facet.subtitle_facet import PackedStrings
+from multimodal.dataset.video import VideoDataset
+
+SHARD_ALIGNMENT = 64
+INDEX_NAME = 'index.json'
+
+
+def get_dataset_prefix(dataset_path):
+    """
+    The file name prefix of the shards of a dataset, unique for datasets with the same name in different directories
+    """
+    name = os.path.splitext(os.path.basename(dataset_path))[0]
+    path_hash = hashlib.sha1(os.path.abspath(dataset_path).encode('utf-8')).hexdigest()[:8]
+    return '{}-{}'.format(name, path_hash)
+
+
+def write_shard(shard_path, texts, stream_items):
+    """
+    Write a shard file
+    :param shard_path: Path of the shard file
+    :param texts: The text of each item, None for items without text
+    :param stream_items: For each stream, a list with the frames of each item
+    :return: A dictionary describing the arrays of the shard, as stored in the index
+    """
+    arrays = []
+    for s, items in enumerate(stream_items):
+        offsets = np.zeros(len(items) + 1, dtype=np.int64)
+        np.cumsum([len(frames) for frames in items], out=offsets[1:])
+        arrays.append(('stream{}'.format(s), np.concatenate(items)))
+        arrays.append(('stream{}_offsets'.format(s), offsets))
+    packed_texts = PackedStrings.from_strings(['' if text is None else text for text in texts])
+    arrays.append(('texts', packed_texts.data))
+    arrays.append(('text_offsets', packed_texts.offsets))
+    arrays.append(('has_text', np.array([text is not None for text in texts])))
+
+    descriptions = dict()
+    tmp_path = shard_path + '.tmp'
+    with open(tmp_path, 'wb') as fp:
+        for name, array in arrays:
+            offset = -(-fp.tell() // SHARD_ALIGNMENT) * SHARD_ALIGNMENT
+            fp.write(b'\0' * (offset - fp.tell()))
+            np.ascontiguousarray(array).tofile(fp)
+            descriptions[name] = dict(offset=offset, dtype=array.dtype.str, shape=list(array.shape))
+    os.replace(tmp_path, shard_path)
+    return dict(path=os.path.basename(shard_path), n_items=len(texts), arrays=descriptions)
+
+
+def export_wrapper(wrapper, path_prefix, shard_bytes=256 * 2**20):
+    """
+    Write all items of a wrapper to shards
+    :param wrapper: A wrapper with a get_stream_segments method, e.g. from VideoDataset.get_subtitled_streams
+    :param path_prefix: The shards are written to path_prefix-00000.shard, path_prefix-00001.shard and so on
+    :param shard_bytes: A shard is written when the frames of its items reach this size
+    :return: The list of shard descriptions
+    """
+    shards = []
+    texts, stream_items, n_bytes = [], None, 0
+    for i in range(len(wrapper)):
+        text, segments = wrapper.get_stream_segments(i)
+        frames = [stream.get_frames_by_seconds(times) for stream, times in segments]
+        if stream_items is None:
+            stream_items = [[] for stream_frames in frames]
+        texts.append(text)
+        for items, stream_frames in zip(stream_items, frames):
+            items.append(np.asarray(stream_frames))
+            n_bytes += items[-1].nbytes
+        if n_bytes >= shard_bytes:
+            shards.append(write_shard('{}-{:05d}.shard'.format(path_prefix, len(shards)), texts, stream_items))
+            texts, stream_items, n_bytes = [], [[] for items in stream_items], 0
+    if texts:
+        shards.append(write_shard('{}-{:05d}.shard'.format(path_prefix, len(shards)), texts, stream_items))
+    return shards
+
+
+def get_wrapper(dataset, wrapper_type, stream_facets, subtitle_id=None, max_duration=None, rng=None):
+    """
+    Create a wrapper of a dataset by name: 'subtitled', 'complement' or 'randomized', see the get_subtitled_* methods
+    of VideoDataset
+    """
+    methods = dict(subtitled=dataset.get_subtitled_streams,
+                   complement=dataset.get_subtitled_complement_streams,
+                   randomized=dataset.get_subtitled_streams_randomized)
+    return methods[wrapper_type](stream_facets, subtitle_id=subtitle_id, max_duration=max_duration, rng=rng)
+
+
+def export_dataset(dataset_path, output_directory, stream_facets, wrapper_type='subtitled', subtitle_id=None,
+                   max_duration=None, seed=None, shard_bytes=256 * 2**20):
+    """
+    Export the items of a wrapper of a dataset to shards in output_directory. The description of the shards is
+    written last, to a JSON file named after the shards, so a dataset is only complete if that file exists.
+    :param seed: Seed of the random cropping and segment choices of the wrapper
+    :return: The number of exported items
+    """
+    path_prefix = os.path.join(output_directory, get_dataset_prefix(dataset_path))
+    with VideoDataset(dataset_path) as dataset:
+        wrapper = get_wrapper(dataset, wrapper_type, stream_facets, subtitle_id=subtitle_id,
+                              max_duration=max_duration, rng=np.random.RandomState(seed))
+        shards = export_wrapper(wrapper, path_prefix, shard_bytes=shard_bytes)
+        streams = [dict(name=name, rate=float(stream.get_samplerate()))
+                   for name, stream in zip(stream_facets, wrapper.streams)]
+    with open(path_prefix + '.json', 'w') as fp:
+        json.dump(dict(dataset_path=dataset_path, streams=streams, shards=shards), fp)
+    return sum(shard['n_items'] for shard in shards)
+
+
+def write_index(output_directory, dataset_paths):
+    """
+    Write the index of an export, listing the shards of the datasets which have been completely exported
+    :return: The index as a dictionary
+    """
+    datasets, shards, streams = [], [], None
+    for dataset_path in dataset_paths:
+        description_path = os.path.join(output_directory, get_dataset_prefix(dataset_path) + '.json')
+        if not os.path.exists(description_path):
+            continue
+        with open(description_path) as fp:
+            description = json.load(fp)
+        datasets.append(dataset_path)
+        streams = description['streams']
+        for shard in description['shards']:
+            shards.append(dict(shard, dataset=len(datasets) - 1))
+    index = dict(datasets=datasets, streams=streams, shards=shards,
+                 n_items=sum(shard['n_items'] for shard in shards))
+    with open(os.path.join(output_directory, INDEX_NAME), 'w') as fp:
+        json.dump(index, fp, indent=1)
+    return index
+
+
+class Shard(object):
+    """
+    The memory mapped arrays of a shard. streams has a PackedSequences for every stream.
+    """
+    def __init__(self, path, description):
+        self.path = path
+        self.n_items = description['n_items']
+        arrays = {name: np.memmap(path, dtype=np.dtype(array['dtype']), mode='r', offset=array['offset'],
+                                  shape=tuple(array['shape']))
+                  if np.prod(array['shape']) > 0 else np.empty(array['shape'], dtype=np.dtype(array['dtype']))
+                  for name, array in description['arrays'].items()}
+        n_streams = sum(1 for name in arrays if name.endswith('_offsets') and name.startswith('stream'))
+        self.streams = [PackedSequences(arrays['stream{}'.format(s)], arrays['stream{}_offsets'.format(s)])
+                        for s in range(n_streams)]
+        self.texts = PackedStrings(arrays['texts'], arrays['text_offsets'])
+        self.has_text = arrays['has_text']
+
+    def __len__(self):
+        return self.n_items
+
+    def __getitem__(self, item):
+        text = self.texts[item] if self.has_text[item] else None
+        return text, [stream.get_sequence(item) for stream in self.streams]
+
+    def __iter__(self):
+        for text, has_text, *frames in zip(self.texts, self.has_text,
+                                           *[iter_sequences(stream) for stream in self.streams]):
+            yield (text if has_text else None), frames
+
+
+def iter_sequences(sequences):
+    offsets = sequences.offsets.tolist()
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        yield sequences.data[start:end]
+
+
+class ShardedDataset(object):
+    """
+    Reader of an export. Items are (text, frames) like the items of SubtitlesAndStreamsWrapper, with text None for
+    items without text. Iterating over the dataset, or over get_shard(i), reads the shards sequentially.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_NAME)) as fp:
+            self.index = json.load(fp)
+        self.streams = self.index['streams']
+        self.shard_offsets = np.zeros(len(self.index['shards']) + 1, dtype=np.int64)
+        np.cumsum([shard['n_items'] for shard in self.index['shards']], out=self.shard_offsets[1:])
+        self.shards = dict()
+
+    def __len__(self):
+        return int(self.shard_offsets[-1])
+
+    def get_n_shards(self):
+        return len(self.index['shards'])
+
+    def get_shard(self, i):
+        try:
+            return self.shards[i]
+        except KeyError:
+            description = self.index['shards'][i]
+            shard = self.shards[i] = Shard(os.path.join(self.directory, description['path']), description)
+            return shard
+
+    def get_dataset_path(self, shard_id):
+        return self.index['datasets'][self.index['shards'][shard_id]['dataset']]
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return (self[i] for i in range(*item.indices(len(self))))
+        elif isinstance(item, Integral):
+            if item < 0:
+                item += len(self)
+            if not 0 <= item < len(self):
+                raise IndexError()
+            shard_id = int(np.searchsorted(self.shard_offsets, item, side='right')) - 1
+            return self.get_shard(shard_id)[item - int(self.shard_offsets[shard_id])]
+        else:
+            raise TypeError("Invalid argument type. {}".format(type(item)))
+
+    def __iter__(self):
+        for i in range(self.get_n_shards()):
+            for item in self.get_shard(i):
+                yield item
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['shards'] = dict()
+        return state
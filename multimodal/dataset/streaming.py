@@ -0,0 +1,121 @@
+"""
+Sliding windows over whole streams, e.g. for frame level inference over a video. The streams are read from start to end
+in chunks, every frame is read and decoded once, and the frames shared by consecutive windows are kept in a buffer of
+fixed size instead of being read again.
+"""
+import numpy as np
+
+from multimodal.dataset.video import get_aligned_frame_ranges
+
+
+def get_run_ends(frame_ranges):
+    """
+    For each of a sequence of frame ranges with increasing starts and ends, the end of the run of overlapping or
+    adjacent ranges it's part of, i.e. how far the stream can be read ahead without reading frames which aren't needed
+    """
+    if len(frame_ranges) == 0:
+        return np.zeros(0, dtype=np.int64)
+    run_starts = np.flatnonzero(np.concatenate([[True], frame_ranges[1:, 0] > frame_ranges[:-1, 1]]))
+    run_lengths = np.diff(np.append(run_starts, len(frame_ranges)))
+    return np.repeat(frame_ranges[np.append(run_starts[1:], len(frame_ranges)) - 1, 1], run_lengths)
+
+
+class StreamBuffer(object):
+    """
+    Buffer of the most recently read frames of a stream. It holds the frames from buffer_start to buffer_end, and
+    when it's full the frames still needed are moved to the front to make room for the next chunk.
+    """
+    def __init__(self, stream, window_frames, chunk_frames):
+        """
+        :param stream: A facet with read_frames_into, get_n_frames, get_frame_shape and get_frame_dtype
+        :param window_frames: The largest number of frames requested at a time
+        :param chunk_frames: Number of frames to read at a time
+        """
+        self.stream = stream
+        self.n_frames = stream.get_n_frames()
+        self.chunk_frames = max(1, chunk_frames)
+        self.frames = np.empty((window_frames + self.chunk_frames,) + tuple(stream.get_frame_shape()),
+                               dtype=stream.get_frame_dtype())
+        self.buffer_start = 0
+        self.buffer_end = 0
+        self.n_read = 0
+
+    def get(self, start, end, read_end=None):
+        """
+        Return frames start to end as a view of the buffer, which is valid until the next call. Requests must not
+        start before the previous one.
+        :param read_end: Frames are not read beyond this frame, as they're not going to be requested
+        """
+        end = min(end, self.n_frames)
+        read_end = self.n_frames if read_end is None else min(read_end, self.n_frames)
+        if start >= self.buffer_end:
+            # Nothing in the buffer is needed anymore, the frames in between are skipped
+            self.buffer_start = self.buffer_end = start
+        while self.buffer_end < end:
+            used = self.buffer_end - self.buffer_start
+            if used + self.chunk_frames > len(self.frames):
+                keep_start = max(start, self.buffer_start)
+                kept = self.buffer_end - keep_start
+                self.frames[:kept] = self.frames[keep_start - self.buffer_start:used]
+                self.buffer_start, used = keep_start, kept
+            n = min(self.chunk_frames, max(read_end, end) - self.buffer_end, len(self.frames) - used)
+            self.stream.read_frames_into(self.buffer_end, self.buffer_end + n, self.frames[used:used + n])
+            self.buffer_end += n
+            self.n_read += n
+        return self.frames[start - self.buffer_start:max(start, end) - self.buffer_start]
+
+
+class SlidingWindows(object):
+    """
+    Iterator over windows of length window seconds every hop seconds over one or more streams. The frame ranges of
+    each stream are computed with get_aligned_frame_ranges, so the windows of streams of different rates cover the same
+    time. Only windows which fit within all streams are produced.
+    """
+    def __init__(self, streams, window, hop, chunk_seconds=1., copy=False):
+        """
+        :param streams: The stream facets, e.g. the audio and video facets of a dataset
+        :param window: Window length in seconds
+        :param hop: Time in seconds between the starts of consecutive windows
+        :param chunk_seconds: The streams are read in chunks of at least this many seconds, and at least one hop
+        :param copy: If False, the frames of a window are views of the buffers which are only valid until the next
+                     window is produced. If True, they are copies.
+        """
+        self.streams = streams
+        self.window = window
+        self.hop = hop
+        self.copy = copy
+        length = min(stream.get_length_s() for stream in streams)
+        n_windows = int(np.floor((length - window) / hop + 1e-9)) + 1 if length >= window else 0
+        starts = np.arange(n_windows) * hop
+        self.times = np.stack([starts, starts + window], axis=1)
+        self.frame_ranges = []
+        self.read_ends = []
+        self.buffers = []
+        for stream in streams:
+            rate = stream.get_samplerate()
+            frame_ranges = get_aligned_frame_ranges(self.times, rate)
+            window_frames = int(np.max(frame_ranges[:, 1] - frame_ranges[:, 0])) if n_windows else 0
+            chunk_frames = max(int(np.ceil(hop * rate)), int(np.ceil(chunk_seconds * rate)))
+            self.frame_ranges.append(frame_ranges)
+            self.read_ends.append(get_run_ends(frame_ranges))
+            self.buffers.append(StreamBuffer(stream, window_frames, chunk_frames))
+
+    def __len__(self):
+        return len(self.times)
+
+    def __iter__(self):
+        """
+        :return: A generator of ((start, end), frames) with the window times in seconds and the frames of each stream
+        """
+        for i, (start, end) in enumerate(self.times.tolist()):
+            frames = []
+            for buffer, frame_ranges, read_ends in zip(self.buffers, self.frame_ranges, self.read_ends):
+                window_frames = buffer.get(frame_ranges[i, 0], frame_ranges[i, 1], read_ends[i])
+                frames.append(window_frames.copy() if self.copy else window_frames)
+            yield (start, end), frames
+
+    def get_n_read(self):
+        """
+        Return the number of frames read from each stream so far
+        """
+        return [buffer.n_read for buffer in self.buffers]
@@ -0,0 +1,297 @@
+"""
+Inverted index from the words in subtitles to the time segments where they are shown, over all subtitle facets of a
+collection of datasets.
+
+The index is an SQLite database. For every token and facet there is one row with the indices of the cues containing
+the token and their start and end times, packed as numpy arrays. Rows are stored clustered by token, so looking up a
+word only reads the rows for that word. Every indexed dataset is recorded with its modification time and size, and
+updating the index only reprocesses the datasets which are new or have changed since they were indexed.
+"""
+import collections
+import os
+import os.path
+import re
+import sqlite3
+
+import h5py
+import numpy as np
+
+from multimodal.batch import run_batch
+
+TOKEN_REGEX = re.compile(r"\w+(?:'\w+)*")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS facets (
+    id INTEGER PRIMARY KEY,
+    dataset_id INTEGER NOT NULL REFERENCES datasets(id),
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS facets_dataset ON facets(dataset_id);
+CREATE TABLE IF NOT EXISTS tokens (
+    id INTEGER PRIMARY KEY,
+    token TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS postings (
+    token_id INTEGER NOT NULL,
+    facet_id INTEGER NOT NULL,
+    cues BLOB NOT NULL,
+    times BLOB NOT NULL,
+    PRIMARY KEY (token_id, facet_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_facet ON postings(facet_id);
+"""
+
+
+class SubtitleSegment(collections.namedtuple('SubtitleSegment', ['dataset_path', 'facet', 'cue', 'start', 'end'])):
+    """
+    A subtitle cue found in the index
+    """
+    @property
+    def times(self):
+        """
+        The time interval of the cue in seconds, as accepted by get_frames_by_seconds of the stream facets
+        """
+        return np.array([self.start, self.end])
+
+
+def tokenize(text):
+    """
+    Split a text into lower case word tokens
+    """
+    return TOKEN_REGEX.findall(text.lower())
+
+
+def get_file_signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def extract_postings(dataset_path, modality='subtitles'):
+    """
+    Tokenize all subtitle facets of a dataset. This is run in the worker processes when building the index.
+    :return: A tuple (mtime_ns, size, facets) where facets is a list of (facet name, postings) and postings is a list of
+             (token, cues, times), with cues the bytes of a sorted int32 array of the cues containing the token and times
+             the bytes of a float64 array of shape (len(cues), 2) with their start and end times
+    """
+    from multimodal.dataset.facet import is_facet, make_facet
+    mtime_ns, size = get_file_signature(dataset_path)
+    facets = []
+    with h5py.File(dataset_path, 'r') as store:
+        if modality in store:
+            for facet_name, facet_group in store[modality].items():
+                if not is_facet(facet_group) or facet_group.attrs['FacetHandler'] != 'SubtitleFacet':
+                    continue
+                facet = make_facet(facet_group)
+                strings = list(facet.strings)
+                times = facet.times.astype(np.float64).reshape(-1, 2)
+                vocabulary = dict()
+                posting_tokens = []
+                posting_cues = []
+                for cue, (start_string, end_string) in enumerate(facet.string_index.tolist()):
+                    for token in set(tokenize(' '.join(strings[start_string:end_string]))):
+                        posting_tokens.append(vocabulary.setdefault(token, len(vocabulary)))
+                        posting_cues.append(cue)
+                # Group the postings by token, a stable sort keeps the cues of each token in order
+                order = np.argsort(np.array(posting_tokens, dtype=np.int64), kind='stable')
+                cues = np.array(posting_cues, dtype=np.int32)[order]
+                cue_times = times[cues]
+                boundaries = np.searchsorted(np.array(posting_tokens, dtype=np.int64)[order],
+                                             np.arange(len(vocabulary) + 1)).tolist()
+                postings = [(token, cues[boundaries[i]:boundaries[i + 1]].tobytes(),
+                             cue_times[boundaries[i]:boundaries[i + 1]].tobytes())
+                            for token, i in vocabulary.items()]
+                facets.append((facet_name, postings))
+    return mtime_ns, size, facets
+
+
+class SubtitleIndex(object):
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.connection = sqlite3.connect(index_path)
+        # Every dataset is added in its own transaction, with a write-ahead log these don't have to wait for the disk
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self.token_ids = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def get_indexed_datasets(self):
+        """
+        :return: A dictionary mapping the paths of the indexed datasets to their (mtime_ns, size) when indexed
+        """
+        rows = self.connection.execute("SELECT path, mtime_ns, size FROM datasets")
+        return {path: (mtime_ns, size) for path, mtime_ns, size in rows}
+
+    def get_stale_datasets(self, dataset_paths):
+        """
+        Find which of the datasets needs to be (re)indexed, and which indexed datasets are no longer in dataset_paths
+        :return: A tuple (stale_paths, removed_paths)
+        """
+        indexed = self.get_indexed_datasets()
+        dataset_paths = [os.path.abspath(path) for path in dataset_paths]
+        stale_paths = [path for path in dataset_paths
+                       if path not in indexed or indexed[path] != get_file_signature(path)]
+        removed_paths = sorted(set(indexed) - set(dataset_paths))
+        return stale_paths, removed_paths
+
+    def remove_dataset(self, dataset_path):
+        row = self.connection.execute("SELECT id FROM datasets WHERE path = ?", (dataset_path,)).fetchone()
+        if row is None:
+            return
+        dataset_id, = row
+        facet_ids = [(facet_id,) for facet_id, in
+                     self.connection.execute("SELECT id FROM facets WHERE dataset_id = ?", (dataset_id,))]
+        self.connection.executemany("DELETE FROM postings WHERE facet_id = ?", facet_ids)
+        self.connection.execute("DELETE FROM facets WHERE dataset_id = ?", (dataset_id,))
+        self.connection.execute("DELETE FROM datasets WHERE id = ?", (dataset_id,))
+
+    def get_token_id(self, token):
+        if self.token_ids is None:
+            self.token_ids = dict(self.connection.execute("SELECT token, id FROM tokens"))
+        try:
+            return self.token_ids[token]
+        except KeyError:
+            token_id = self.connection.execute("INSERT INTO tokens (token) VALUES (?)", (token,)).lastrowid
+            self.token_ids[token] = token_id
+            return token_id
+
+    def add_dataset(self, dataset_path, extracted_postings):
+        """
+        Add the postings of a dataset, as returned by extract_postings, replacing any earlier postings for it
+        """
+        mtime_ns, size, facets = extracted_postings
+        try:
+            with self.connection:
+                self.remove_dataset(dataset_path)
+                dataset_id = self.connection.execute("INSERT INTO datasets (path, mtime_ns, size) VALUES (?, ?, ?)",
+                                                     (dataset_path, mtime_ns, size)).lastrowid
+                for facet_name, postings in facets:
+                    facet_id = self.connection.execute("INSERT INTO facets (dataset_id, name) VALUES (?, ?)",
+                                                       (dataset_id, facet_name)).lastrowid
+                    self.connection.executemany(
+                        "INSERT INTO postings (token_id, facet_id, cues, times) VALUES (?, ?, ?, ?)",
+                        [(self.get_token_id(token), facet_id, cues, times) for token, cues, times in postings])
+        except Exception:
+            # Tokens added in the rolled back transaction are gone from the database
+            self.token_ids = None
+            raise
+
+    def update(self, dataset_paths, n_processes=1, modality='subtitles'):
+        """
+        Bring the index up to date with the given datasets. Datasets which are new or modified since they were indexed
+        are tokenized in parallel, and datasets which are no longer among dataset_paths are removed from the index.
+        :param dataset_paths: The paths of all datasets which should be in the index
+        :param n_processes: Number of worker processes used for tokenizing
+        :param modality: The modality containing the subtitle facets
+        :return: A BatchReport for the datasets which were (re)indexed
+        """
+        stale_paths, removed_paths = self.get_stale_datasets(dataset_paths)
+        with self.connection:
+            for dataset_path in removed_paths:
+                self.remove_dataset(dataset_path)
+        return run_batch(extract_postings, stale_paths, n_processes=n_processes, kwargs=dict(modality=modality),
+                         callback=self.add_dataset)
+
+    def get_postings(self, token):
+        """
+        :return: A dictionary mapping facet ids to (cues, times) arrays for the cues containing the token
+        """
+        rows = self.connection.execute(
+            "SELECT postings.facet_id, postings.cues, postings.times FROM postings JOIN tokens "
+            "ON postings.token_id = tokens.id WHERE tokens.token = ?", (token,))
+        return {facet_id: (np.frombuffer(cues, dtype=np.int32), np.frombuffer(times, dtype=np.float64).reshape(-1, 2))
+                for facet_id, cues, times in rows}
+
+    def query_facets(self, words):
+        """
+        Find the subtitle cues containing all of the words
+        :return: A dictionary mapping facet ids to (cues, times) arrays
+        """
+        tokens = set(token for word in words for token in tokenize(word))
+        if not tokens:
+            return dict()
+        postings = None
+        for token in tokens:
+            token_postings = self.get_postings(token)
+            if postings is None:
+                postings = token_postings
+                continue
+            intersection = dict()
+            for facet_id in postings.keys() & token_postings.keys():
+                cues, times = postings[facet_id]
+                common = np.isin(cues, token_postings[facet_id][0], assume_unique=True)
+                if np.any(common):
+                    intersection[facet_id] = (cues[common], times[common])
+            postings = intersection
+            if not postings:
+                break
+        return postings
+
+    def get_facet_names(self, facet_ids):
+        """
+        :return: A dictionary mapping facet ids to (dataset path, facet name)
+        """
+        facet_ids = list(facet_ids)
+        names = dict()
+        for i in range(0, len(facet_ids), 500):
+            chunk = facet_ids[i:i + 500]
+            rows = self.connection.execute(
+                "SELECT facets.id, datasets.path, facets.name FROM facets JOIN datasets "
+                "ON facets.dataset_id = datasets.id WHERE facets.id IN ({})".format(', '.join('?' * len(chunk))),
+                chunk)
+            names.update((facet_id, (path, name)) for facet_id, path, name in rows)
+        return names
+
+    def query(self, word):
+        """
+        Find the subtitle cues containing a word
+        :param word: The word to look for, it's matched against the tokens of the subtitles case insensitively
+        :return: A list of SubtitleSegment ordered by dataset, facet and cue
+        """
+        tokens = tokenize(word)
+        if len(tokens) != 1:
+            raise ValueError("Expected a single word, got {!r}".format(word))
+        return self.query_all(tokens)
+
+    def query_all(self, words):
+        """
+        Find the subtitle cues containing all of the words
+        :return: A list of SubtitleSegment ordered by dataset, facet and cue
+        """
+        segments = []
+        for (dataset_path, facet_name), (cues, times) in sorted(self.query_times_and_cues(words).items()):
+            segments.extend(SubtitleSegment(dataset_path, facet_name, cue, start, end)
+                            for cue, (start, end) in zip(cues.tolist(), times.tolist()))
+        return segments
+
+    def query_times_and_cues(self, words):
+        """
+        Find the subtitle cues containing all of the words
+        :return: A dictionary mapping (dataset path, facet name) to a tuple (cues, times) of the indices of the
+                 matching cues and an array of shape (n, 2) with their start and end times
+        """
+        postings = self.query_facets(words)
+        names = self.get_facet_names(postings.keys())
+        return {names[facet_id]: cues_times for facet_id, cues_times in postings.items()}
+
+    def query_times(self, words):
+        """
+        Find the subtitle cues containing all of the words, grouped for reading the streams of each dataset
+        :return: A dictionary mapping (dataset path, facet name) to an array of shape (n, 2) with the start and end
+                 times of the matching cues
+        """
+        return {key: times for key, (cues, times) in self.query_times_and_cues(words).items()}
@@ -0,0 +1,130 @@
+"""
+Voice activity detection backends. A backend classifies fixed length frames of PCM audio as speech or non-speech,
+the smoothing of the frame decisions into voiced segments is done in
+:py:func:`multimodal.dataset.add_vad_signal.vad_slice_audio_signal`.
+"""
+import numpy as np
+
+
+class VadBackend(object):
+    """
+    Base class for VAD backends. Subclasses implement *classify_frames* which takes a whole chunk of audio and returns
+    one boolean decision per frame.
+    """
+    name = None
+
+    def __init__(self, frame_duration_ms=30):
+        self.frame_duration_ms = frame_duration_ms
+
+    def get_frame_length(self, sample_rate):
+        return self.frame_duration_ms * sample_rate // 1000
+
+    def get_parameters(self):
+        """
+        Return the parameters of this backend as a dictionary, suitable for storing as HDF5 attributes
+        """
+        return dict(frame_duration_ms=self.frame_duration_ms)
+
+    def get_attrs(self):
+        """
+        Return the attributes which should be stored alongside voiced segments detected by this backend
+        """
+        attrs = {'VadBackend': self.name}
+        attrs.update(('vad_' + key, value) for key, value in self.get_parameters().items())
+        return attrs
+
+    def classify_frames(self, audio_frames, sample_rate):
+        """
+        Classify the audio as speech or non-speech, one decision per frame. Trailing samples which doesn't fill a
+        whole frame are ignored.
+        :param audio_frames: A numpy array of 16 bit PCM audio samples
+        :param sample_rate: The sample rate of the audio samples
+        :return: A boolean numpy array of shape (len(audio_frames) // frame_length,)
+        """
+        raise NotImplementedError()
+
+
+class WebRtcVadBackend(VadBackend):
+    """
+    Backend using the WebRTC VAD classifier. This is the most accurate backend, but it makes one call per frame.
+    """
+    name = 'webrtc'
+
+    def __init__(self, mode=3, frame_duration_ms=30):
+        super(WebRtcVadBackend, self).__init__(frame_duration_ms=frame_duration_ms)
+        import webrtcvad
+        self.mode = mode
+        self.vad = webrtcvad.Vad()
+        self.vad.set_mode(mode)
+
+    def get_parameters(self):
+        parameters = super(WebRtcVadBackend, self).get_parameters()
+        parameters['mode'] = self.mode
+        return parameters
+
+    def classify_frames(self, audio_frames, sample_rate):
+        frame_length = self.get_frame_length(sample_rate)
+        num_windows = len(audio_frames) // frame_length
+        audio_bytes = np.ascontiguousarray(audio_frames[:num_windows*frame_length], dtype=np.int16).tobytes()
+        n_bytes = frame_length * 2
+        is_speech = np.zeros(num_windows, dtype=bool)
+        for i in range(num_windows):
+            is_speech[i] = self.vad.is_speech(audio_bytes[i*n_bytes:(i+1)*n_bytes], sample_rate)
+        return is_speech
+
+
+class EnergyVadBackend(VadBackend):
+    """
+    Pure numpy backend which classifies frames by their energy and zero-crossing rate. The whole chunk of audio is
+    classified in a single vectorized pass, which makes this backend much faster than the WebRTC backend at the cost
+    of accuracy in noisy recordings.
+
+    A frame is considered speech if its energy (in dB relative to full scale) is above both *energy_threshold_db* and
+    the estimated noise floor plus *noise_margin_db*, and its zero-crossing rate is below *max_zero_crossing_rate*.
+    The noise floor is estimated as the *noise_percentile* percentile of the frame energies.
+    """
+    name = 'energy'
+
+    def __init__(self, energy_threshold_db=-45., noise_margin_db=10., noise_percentile=10,
+                 max_zero_crossing_rate=0.35, frame_duration_ms=30):
+        super(EnergyVadBackend, self).__init__(frame_duration_ms=frame_duration_ms)
+        self.energy_threshold_db = energy_threshold_db
+        self.noise_margin_db = noise_margin_db
+        self.noise_percentile = noise_percentile
+        self.max_zero_crossing_rate = max_zero_crossing_rate
+
+    def get_parameters(self):
+        parameters = super(EnergyVadBackend, self).get_parameters()
+        parameters.update(energy_threshold_db=self.energy_threshold_db,
+                          noise_margin_db=self.noise_margin_db,
+                          noise_percentile=self.noise_percentile,
+                          max_zero_crossing_rate=self.max_zero_crossing_rate)
+        return parameters
+
+    def classify_frames(self, audio_frames, sample_rate):
+        frame_length = self.get_frame_length(sample_rate)
+        num_windows = len(audio_frames) // frame_length
+        if num_windows == 0:
+            return np.zeros(0, dtype=bool)
+        frames = np.reshape(audio_frames[:num_windows*frame_length], (num_windows, frame_length))
+        frames = frames.astype(np.float32) / 2**15
+
+        energy = np.mean(np.square(frames), axis=1)
+        energy_db = 10 * np.log10(energy + 1e-10)
+        signs = np.signbit(frames)
+        zero_crossing_rate = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (frame_length - 1)
+
+        noise_floor_db = np.percentile(energy_db, self.noise_percentile)
+        threshold_db = max(self.energy_threshold_db, noise_floor_db + self.noise_margin_db)
+        return (energy_db > threshold_db) & (zero_crossing_rate < self.max_zero_crossing_rate)
+
+
+VAD_BACKENDS = {backend.name: backend for backend in (WebRtcVadBackend, EnergyVadBackend)}
+
+
+def make_vad_backend(name, **kwargs):
+    try:
+        backend_class = VAD_BACKENDS[name]
+    except KeyError:
+        raise NotImplementedError("Could not find VAD backend {}".format(name))
+    return backend_class(**kwargs)
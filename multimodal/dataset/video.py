@@ -1,9 +1,13 @@
+import collections
 import numpy as np
 from numbers import Integral
+from multimodal.dataset.annotation import iter_frame_ranges
+from multimodal.dataset.batching import allocate_sequences, get_sequence_slots
 from multimodal.dataset.multimodal import MultiModalDataset, MultiModalDatasets
 from multimodal.dataset.facet.subtitle_facet import SubtitleFacet
 from multimodal.dataset.facet.video_facet import VideoFacet
 from multimodal.dataset.facet.audio_facet import AudioFacet
+from multimodal.dataset.sampling import block_shuffle
 
 class TimeModality(object):
     def get_frames(self, times):
@@ -11,6 +15,60 @@ class TimeModality(object):
     def get_facet(self):
         return self
 
+def crop_times(times, max_duration, rng=None, positions=None):
+    """
+    Randomly crop the time segments which are longer than max_duration to max_duration
+    :param times: An array of shape (n, 2) or (2,) with start and end times
+    :param max_duration: The maximum duration in seconds, if None the times are returned unchanged
+    :param rng: The RandomState used to pick where the cropped segments start
+    :param positions: Instead of drawing from rng, where in each segment the crop starts, as a number in [0, 1) for
+                      each segment (or one for all) which is scaled to the part of the segment the crop can start in
+    :return: A new array with the same shape as times
+    """
+    times = np.array(times, dtype=np.float64)
+    if max_duration is None:
+        return times
+    segments = times.reshape(-1, 2)
+    segment_lengths = segments[:, 1] - segments[:, 0]
+    long_segments = segment_lengths > max_duration
+    if positions is None:
+        positions = rng.random_sample(np.count_nonzero(long_segments))
+    else:
+        positions = np.broadcast_to(np.asarray(positions, dtype=np.float64), long_segments.shape)[long_segments]
+    segment_starts = segments[long_segments, 0] + positions * (segment_lengths[long_segments] - max_duration)
+    segments[long_segments, 0] = segment_starts
+    segments[long_segments, 1] = segment_starts + max_duration
+    return times
+
+
+def get_aligned_frame_ranges(times, rate):
+    """
+    Convert time windows to frame ranges at a rate such that the ranges of all rates cover the same windows. The first
+    frame is the one the window starts in, and the number of frames is the window duration times the rate rounded to
+    the nearest frame, so windows of the same duration always get the same number of frames. Truncating the start and
+    end separately would let the lengths, and the alignment between rates, vary by a frame with the rounding of the
+    window times.
+    :param times: An array of shape (n, 2) with start and end times in seconds
+    :param rate: The rate of the stream in frames per second
+    :return: An integer array of shape (n, 2), which may extend outside the stream
+    """
+    times = np.asarray(times, dtype=np.float64).reshape(-1, 2)
+    # Times which are a whole number of frames, like 1.2 s at 100 Hz, can be a rounding error below the frame boundary
+    starts = np.floor(times[:, 0] * rate + 1e-6).astype(np.int64)
+    lengths = np.maximum(np.round((times[:, 1] - times[:, 0]) * rate).astype(np.int64), 0)
+    return np.stack([starts, starts + lengths], axis=1)
+
+
+class TimeWindows(collections.namedtuple('TimeWindows', ['times', 'frame_ranges', 'streams'])):
+    """
+    The data of several facets in a batch of time windows. For each facet, frame_ranges has the frame range of every
+    window (None for subtitle facets) and streams has the data: a batching.PaddedSequences with the frames of every
+    window for stream facets, and for subtitle facets a list with the texts of the subtitles shown in each window.
+    Ranges extending outside a stream are cut to the frames which exist, the lengths of the PaddedSequences tell how
+    many frames were read.
+    """
+
+
 class SubtitlesAndStreamsWrapper(object):
     """
     Dataset iterating over subtitles and audio in the video dataset.
@@ -27,57 +85,127 @@ class SubtitlesAndStreamsWrapper(object):
     def __len__(self):
         return len(self.subtitles)
 
-    def __getitem__(self, item):
-        subtitles = self.subtitles[item]
-        if isinstance(item, slice):
-            times, text = zip(*subtitles)
-            if self.max_duration is not None:
-                # We should randomly sample shorter time intervals for the times which are to long
-                segment_lengths = times[:,1] - times[:,0]
-                long_indices = times[:,1] - times[:,0] > self.max_duration
-                segment_start = self.rng.random_sample(times.shape[0]) * (segment_lengths - self.max_duration)
-                times[long_indices] = np.hstack([segment_start, segment_start+self.max_duration])
-            frames = [stream.get_frames_by_seconds(times) for stream in self.streams]
-            return zip(text, *frames)
-        elif isinstance(item, Integral):
-            times, text = subtitles
-            if self.max_duration is not None:
-                segment_length = times[1] - times[0]
-                if segment_length > self.max_duration:
-                    start_time = self.rng.random_sample() * (segment_length - self.max_duration)
-                    times[0] = start_time
-                    times[1] = start_time + self.max_duration
-            frames = [stream.get_frames_by_seconds(times) for stream in self.streams]
-            return (text, frames)
-        else:
-            raise TypeError("Invalid argument type. {}".format(type(item)))
+    def get_durations(self):
+        """
+        Return the duration in seconds of each item, after cropping to max_duration, without reading any streams
+        """
+        times = np.asarray(self.subtitles.times, dtype=np.float64).reshape(-1, 2)
+        durations = times[:, 1] - times[:, 0]
+        if self.max_duration is not None:
+            durations = np.minimum(durations, self.max_duration)
+        return durations
+
+    def get_stream_segments(self, item, crop_position=None):
+        """
+        Return the text of an item and the time segment to read from each stream
+        :param crop_position: Where to crop the item if it's longer than max_duration, see crop_times. Drawn from the
+                              rng of the wrapper if None.
+        :return: A tuple (text, segments) where segments is a list of (stream, times) with times in seconds
+        """
+        return self.get_stream_segments_batch([item], None if crop_position is None else [crop_position])[0]
+
+    def get_stream_segments_batch(self, items, crop_positions=None):
+        """
+        Return the texts and stream segments of several items, the cropping is done for all items at once
+        :return: A list with (text, segments) for each item, see get_stream_segments
+        """
+        items = np.asarray(items, dtype=np.int64)
+        texts = [self.subtitles[item][1] for item in items.tolist()]
+        times = crop_times(np.asarray(self.subtitles.times)[items].reshape(-1, 2), self.max_duration, self.rng,
+                           crop_positions)
+        return [(text, [(stream, item_times) for stream in self.streams]) for text, item_times in zip(texts, times)]
 
     def __getitem__(self, item):
-        subtitles = self.subtitles[item]
         if isinstance(item, slice):
-            times, text = zip(*subtitles)
-            if self.max_duration is not None:
-                # We should randomly sample shorter time intervals for the times which are to long
-                segment_lengths = times[:,1] - times[:,0]
-                long_indices = times[:,1] - times[:,0] > self.max_duration
-                segment_start = self.rng.random_sample(times.shape[0]) * (segment_lengths - self.max_duration)
-                times[long_indices] = np.hstack([segment_start, segment_start+self.max_duration])
-            frames = [stream.get_frames_by_second(times) for stream in self.streams]
-            return zip(text, *frames)
+            return ((text, *frames) for text, frames in (self[i] for i in range(*item.indices(len(self)))))
         elif isinstance(item, Integral):
-            times, text = subtitles
-            if self.max_duration is not None:
-                segment_length = times[1] - times[0]
-                if segment_length > self.max_duration:
-                    start_time = self.rng.random_sample() * (segment_length - self.max_duration)
-                    times[0] = start_time
-                    times[1] = start_time + self.max_duration
-            frames = [stream.get_frames_by_second(times) for stream in self.streams]
+            text, segments = self.get_stream_segments(item)
+            frames = [stream.get_frames_by_seconds(times) for stream, times in segments]
             return (text, frames)
         else:
             raise TypeError("Invalid argument type. {}".format(type(item)))
 
 
+def fit_time_segments(times, source_times, stream_lengths):
+    """
+    Adjust each segment of source_times to the length of the corresponding segment of times, keeping its center.
+    Segments which are made longer are shifted to stay within their stream, segments which are made shorter are
+    trimmed equally at both ends.
+    :param times: An array of shape (n, 2) with the segments whose lengths should be matched
+    :param source_times: An array of shape (n, 2) with the segments to adjust
+    :param stream_lengths: The length in seconds of the stream of each source segment, or a single length for all
+    :return: A new array of shape (n, 2)
+    """
+    times = np.asarray(times).reshape(-1, 2)
+    segments = np.array(source_times, dtype=np.result_type(times, source_times, np.float64)).reshape(-1, 2)
+    diff_s = (times[:, 1] - times[:, 0]) - (segments[:, 1] - segments[:, 0])
+    diff_s_half = diff_s / 2
+    segments[:, 0] -= diff_s_half
+    segments[:, 1] += diff_s - diff_s_half
+    expanded = diff_s >= 0
+    # Shift the time from the start to the end, or from the end to the start, for segments expanded past the stream
+    before_start = expanded & (segments[:, 0] < 0)
+    past_end = expanded & ~before_start & (segments[:, 1] > stream_lengths)
+    segments[before_start, 1] -= segments[before_start, 0]
+    segments[before_start, 0] = 0
+    stream_ends = np.broadcast_to(stream_lengths, len(segments))[past_end]
+    segments[past_end, 0] -= segments[past_end, 1] - stream_ends
+    segments[past_end, 1] = stream_ends
+    return segments
+
+
+def make_cross_dataset_time_segments(times, offsets, stream_lengths, rng):
+    """
+    For every segment of a time table covering several datasets, pick a random segment of another dataset and adjust
+    it to the length of the segment, see fit_time_segments.
+    :param times: An array of shape (n, 2) with the segments of all datasets, concatenated
+    :param offsets: The segments of dataset d are times[offsets[d]:offsets[d+1]]
+    :param stream_lengths: The stream length in seconds of each dataset
+    :param rng: The RandomState used to pick the segments
+    :return: A tuple (segments, source_datasets) with the adjusted segments and the dataset each was taken from
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    dataset_lengths = np.diff(offsets)
+    dataset_ids = np.repeat(np.arange(len(dataset_lengths)), dataset_lengths)
+    n_others = len(times) - dataset_lengths[dataset_ids]
+    if np.any(n_others == 0):
+        raise ValueError("Segments from other datasets need at least two datasets with segments")
+    # Draw among the segments of the other datasets by skipping over the dataset's own block of the table
+    sources = (rng.random_sample(len(times)) * n_others).astype(np.int64)
+    sources += np.where(sources >= offsets[:-1][dataset_ids], dataset_lengths[dataset_ids], 0)
+    source_datasets = dataset_ids[sources]
+    segments = fit_time_segments(times, times[sources], np.asarray(stream_lengths)[source_datasets])
+    return segments, source_datasets
+
+
+def set_cross_dataset_segments(wrappers, rng=None):
+    """
+    Replace the random stream segments of SubtitlesAndRandomStreamsWrappers with segments from the other wrappers. The
+    time table of all wrappers is built from the subtitle times they already hold, so this can be called every epoch.
+    :param wrappers: A list of SubtitlesAndRandomStreamsWrapper over the same stream modalities
+    :param rng: The RandomState used to pick the segments
+    """
+    if rng is None:
+        rng = np.random.RandomState()
+    times = np.concatenate([np.asarray(wrapper.times, dtype=np.float64).reshape(-1, 2) for wrapper in wrappers])
+    offsets = np.zeros(len(wrappers) + 1, dtype=np.int64)
+    np.cumsum([len(wrapper.times) for wrapper in wrappers], out=offsets[1:])
+    stream_lengths = np.array([wrapper.stream_length for wrapper in wrappers])
+    source_streams = [wrapper.streams for wrapper in wrappers]
+    n_streams = len(wrappers[0].streams)
+    synched_streams = all(wrapper.synched_streams for wrapper in wrappers)
+    if synched_streams:
+        stream_draws = [make_cross_dataset_time_segments(times, offsets, stream_lengths, rng)] * n_streams
+    else:
+        stream_draws = [make_cross_dataset_time_segments(times, offsets, stream_lengths, rng)
+                        for s in range(n_streams)]
+    for i, wrapper in enumerate(wrappers):
+        start, end = offsets[i], offsets[i + 1]
+        wrapper.set_stream_times([segments[start:end] for segments, sources in stream_draws],
+                                 [sources[start:end] for segments, sources in stream_draws],
+                                 source_streams)
+
+
 class SubtitlesAndRandomStreamsWrapper(object):
     """
     Wrapper which supports __getitem__ over a subtitle facet and one or more stream facets. This version returns random
@@ -89,18 +217,15 @@ class SubtitlesAndRandomStreamsWrapper(object):
             rng = np.random.RandomState()
         self.subtitles = subtitles
         self.streams = streams
+        self.synched_streams = synched_streams
         self.max_duration = max_duration
         self.rng = rng
 
         # We want to transpose the times segments so that they belong to the wrong subtitle
-        stream_lengths = min(stream.get_length_s() for stream in self.streams)
+        self.stream_length = min(stream.get_length_s() for stream in self.streams)
         self.times = np.array(self.subtitles.get_times())
-
-        if synched_streams:
-            stream_times = self.make_random_time_segments(self.times, stream_lengths)
-            self.stream_times = [stream_times for stream in self.streams]
-        else:
-            self.stream_times = [self.make_random_time_segments(self.times, stream_lengths) for stream in self.streams]
+        self.stream_sources = None
+        self.resample_stream_times()
 
     def make_random_time_segments(self, times, stream_lengths):
         # Randomly pick some other time segment from the subtitles, but adjust its length to fit the original
@@ -108,66 +233,83 @@ class SubtitlesAndRandomStreamsWrapper(object):
         # subtitle, making it harder to solve.
         transposed_times = np.copy(times)
         self.rng.shuffle(transposed_times)
-        for i in range(len(times)):
-            original_time = times[i]
-            transposed_time = transposed_times[i]
-            original_time_duration = original_time[1] - original_time[0]
-            tranposed_time_duration = transposed_time[1] - transposed_time[0]
-            diff_s = original_time_duration - tranposed_time_duration
-            diff_s_half = diff_s / 2
-            if diff_s < 0:
-                # The transposed segment is longer, lets trim it at both sides
-                start, end = transposed_time
-                start -= diff_s_half
-                end += diff_s - diff_s_half
-            else:
-                # The transposed segment is shorter, let's expand it in both directions, minding edge cases (the
-                # end or start of the stream)
-                start, end = transposed_time
-                start -= diff_s_half
-                end += diff_s - diff_s_half
-
-                if start < 0:
-                    # Shift the time from the start to the end
-                    end -= start
-                    start = 0
-                elif end > stream_lengths:
-                    start -= end - stream_lengths
-                    end = stream_lengths
-            new_duration = end - start
-            transposed_times[i] = start, end
-        return transposed_times
+        return fit_time_segments(times, transposed_times, stream_lengths)
+
+    def resample_stream_times(self):
+        """
+        Draw new random stream segments from the subtitles of this dataset, e.g. for a new epoch
+        :raises ValueError: If the segments are taken from other datasets, those have to be drawn again for all
+                            wrappers with set_cross_dataset_segments, see VideoDatasets.resample_stream_times
+        """
+        if self.stream_sources is not None:
+            raise ValueError("The stream segments are taken from other datasets, resample them with "
+                             "set_cross_dataset_segments")
+        if self.synched_streams:
+            stream_times = self.make_random_time_segments(self.times, self.stream_length)
+            self.set_stream_times([stream_times for stream in self.streams])
+        else:
+            self.set_stream_times([self.make_random_time_segments(self.times, self.stream_length)
+                                   for stream in self.streams])
+
+    def set_stream_times(self, stream_times, stream_sources=None, source_streams=None):
+        """
+        Set the segments read from the streams
+        :param stream_times: A list with an array of shape (n, 2) of segments for each stream
+        :param stream_sources: Optional list with an array for each stream giving the index into source_streams of the
+                               streams each segment is read from, if None the segments are read from the own streams
+        :param source_streams: The streams of the datasets the segments are taken from, a list of stream lists
+        """
+        self.stream_times = stream_times
+        self.stream_sources = stream_sources
+        self.source_streams = source_streams
 
     def __len__(self):
         return len(self.subtitles)
 
+    def get_durations(self):
+        """
+        Return the duration in seconds of each item, after cropping to max_duration, without reading any streams
+        """
+        times = np.asarray(self.subtitles.times, dtype=np.float64).reshape(-1, 2)
+        durations = times[:, 1] - times[:, 0]
+        if self.max_duration is not None:
+            durations = np.minimum(durations, self.max_duration)
+        return durations
+
+    def get_stream_segments(self, item, crop_position=None):
+        """
+        Return the text of an item and the time segment to read from each stream
+        :param crop_position: Where to crop the item if it's longer than max_duration, see crop_times. Drawn from the
+                              rng of the wrapper if None.
+        :return: A tuple (text, segments) where segments is a list of (stream, times) with times in seconds
+        """
+        return self.get_stream_segments_batch([item], None if crop_position is None else [crop_position])[0]
+
+    def get_stream_segments_batch(self, items, crop_positions=None):
+        """
+        Return the texts and stream segments of several items, the cropping is done for all items at once. With
+        crop_positions given, the segments of all streams of an item are cropped at the same position.
+        :return: A list with (text, segments) for each item, see get_stream_segments
+        """
+        items = np.asarray(items, dtype=np.int64)
+        texts = [self.subtitles[item][1] for item in items.tolist()]
+        stream_segments = []
+        for s, (stream_times, stream) in enumerate(zip(self.stream_times, self.streams)):
+            times = crop_times(np.asarray(stream_times)[items].reshape(-1, 2), self.max_duration, self.rng,
+                               crop_positions)
+            if self.stream_sources is None:
+                streams = [stream] * len(items)
+            else:
+                streams = [self.source_streams[source][s] for source in self.stream_sources[s][items].tolist()]
+            stream_segments.append(list(zip(streams, times)))
+        return [(text, [segments[i] for segments in stream_segments]) for i, text in enumerate(texts)]
+
     def __getitem__(self, item):
-        subtitles = self.subtitles[item]
         if isinstance(item, slice):
-            _, text = zip(*subtitles)
-            frames = []
-            for stream_times, stream in zip(self.stream_times, self.streams):
-                times = stream_times[item]
-                if self.max_duration is not None:
-                    # We should randomly sample shorter time intervals for the times which are to long
-                    segment_lengths = times[:,1] - times[:,0]
-                    long_indices = times[:,1] - times[:,0] > self.max_duration
-                    segment_start = self.rng.random_sample(times.shape[0]) * (segment_lengths - self.max_duration)
-                    times[long_indices] = np.hstack([segment_start, segment_start+self.max_duration])
-                frames.append(stream.get_frames_by_seconds(times))
-                return zip(text, *frames)
+            return ((text, *frames) for text, frames in (self[i] for i in range(*item.indices(len(self)))))
         elif isinstance(item, Integral):
-            _, text = subtitles
-            frames = []
-            for stream_times, stream in zip(self.stream_times, self.streams):
-                times = stream_times[item]
-                if self.max_duration is not None:
-                    segment_length = times[1] - times[0]
-                    if segment_length > self.max_duration:
-                        start_time = self.rng.random_sample() * (segment_length - self.max_duration)
-                        times[0] = start_time
-                        times[1] = start_time + self.max_duration
-                frames.append(stream.get_frames_by_seconds(times))
+            text, segments = self.get_stream_segments(item)
+            frames = [stream.get_frames_by_seconds(times) for stream, times in segments]
             return (text, frames)
         else:
             raise TypeError("Invalid argument type. {}".format(type(item)))
@@ -184,27 +326,29 @@ class SubtitlesComplementAndStreamsWrapper(SubtitlesAndStreamsWrapper):
     def __len__(self):
         return len(self.times)
 
+    def get_durations(self):
+        durations = self.times[:, 1] - self.times[:, 0]
+        if self.max_duration is not None:
+            durations = np.minimum(durations, self.max_duration)
+        return durations
+
+    def get_stream_segments_batch(self, items, crop_positions=None):
+        """
+        Return the stream segments of several items, these items have no text
+        :return: A list with (None, segments) for each item, see get_stream_segments
+        """
+        items = np.asarray(items, dtype=np.int64)
+        if np.any((items < -len(self.times)) | (items >= len(self.times))):
+            raise IndexError()
+        times = crop_times(self.times[items].reshape(-1, 2), self.max_duration, self.rng, crop_positions)
+        return [(None, [(stream, item_times) for stream in self.streams]) for item_times in times]
+
     def __getitem__(self, item):
         if isinstance(item, slice):
-            times = self.times[item]
-            if self.max_duration is not None:
-                # We should randomly sample shorter time intervals for the times which are to long
-                segment_lengths = times[:,1] - times[:,0]
-                long_indices = times[:,1] - times[:,0] > self.max_duration
-                segment_start = self.rng.random_sample(times.shape[0]) * (segment_lengths - self.max_duration)
-                times[long_indices] = np.hstack([segment_start, segment_start+self.max_duration])
-            frames = [stream.get_frames_by_second(times) for stream in self.streams]
-            return zip(*frames)
+            return (tuple(self[i]) for i in range(*item.indices(len(self))))
         elif isinstance(item, Integral):
-            times = self.times[item]
-            if self.max_duration is not None:
-                segment_length = times[1] - times[0]
-                if segment_length > self.max_duration:
-                    start_time = self.rng.random_sample() * (segment_length - self.max_duration)
-                    times[0] = start_time
-                    times[1] = start_time + self.max_duration
-            frames = [stream.get_frames_by_second(times) for stream in self.streams]
-            return frames
+            _, segments = self.get_stream_segments(item)
+            return [stream.get_frames_by_seconds(times) for stream, times in segments]
         else:
             raise TypeError("Invalid argument type. {}".format(type(item)))
 
@@ -230,26 +374,84 @@ class VideoDataset(MultiModalDataset):
                                                     max_duration=max_duration,
                                                     rng=rng)
 
-    def get_subtitled_streams_randomized(self, stream_facets, subtitle_id = None, max_duration = None, rng = None):
+    def get_subtitled_streams_randomized(self, stream_facets, subtitle_id=None, max_duration=None, rng=None,
+                                         synched_streams=True):
         if isinstance(stream_facets, str):
             stream_facets = [stream_facets]
         streams = [self.modalities[stream_facet].get_facet() for stream_facet in stream_facets]
         subtitles = self.modalities['subtitles'].get_facet(subtitle_id)
         return SubtitlesAndRandomStreamsWrapper(subtitles=subtitles,
                                                 streams=streams,
+                                                synched_streams=synched_streams,
                                                 max_duration=max_duration,
                                                 rng=rng)
 
     def get_time_interval_frames(self, time_interval_name, stream_facet_name, max_duration=None, rng=None):
         """
-        :param time_interval_name:
-        :param stream_facet_name:
+        Read the frames of a stream for each interval of an annotation track. The track is looked up on the stream
+        facet first, and then on the dataset itself.
+        :param time_interval_name: The name of the annotation track
+        :param stream_facet_name: The modality of the stream, its default facet is used
         :param max_duration:
         :param rng:
-        :return:
+        :return: A generator of ((start, end), frames) with the times in seconds
         """
         facet = self.modalities[stream_facet_name].get_facet()
-        return facet.get_time_interval_frames(time_interval_name)
+        if facet.has_time_intervals(time_interval_name):
+            track = facet.get_annotation_track(time_interval_name)
+        else:
+            track = self.get_annotation_track(time_interval_name)
+        return track.iter_frames(facet)
+
+    def read_time_windows(self, times, facets, max_gap=0):
+        """
+        Read the same time windows from several facets, e.g. the video, audio and subtitles of seconds 12 to 14. The
+        frame ranges are computed once per rate for all windows (see get_aligned_frame_ranges), so facets with the
+        same rate share them, and each facet reads its windows in order, reading overlapping or close windows together
+        (see iter_frame_ranges).
+        :param times: An array of shape (n, 2) with the start and end of each window in seconds
+        :param facets: A list of modality names, for their default facets, or (modality, facet_id) pairs
+        :param max_gap: Windows at most this many frames apart are read with a single read
+        :return: A TimeWindows
+        """
+        times = np.ascontiguousarray(times, dtype=np.float64).reshape(-1, 2)
+        all_frame_ranges, streams = [], []
+        rate_frame_ranges = dict()
+        for facet_id in facets:
+            modality, facet_id = (facet_id, None) if isinstance(facet_id, str) else facet_id
+            facet = self.modalities[modality].get_facet(facet_id)
+            if isinstance(facet, SubtitleFacet):
+                offsets, cues = facet.get_time_index().overlapping_batch(times[:, 0], times[:, 1])
+                texts = [facet[cue][1] for cue in cues.tolist()]
+                all_frame_ranges.append(None)
+                streams.append([texts[start:end] for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())])
+                continue
+            rate = float(facet.get_samplerate())
+            if rate not in rate_frame_ranges:
+                rate_frame_ranges[rate] = get_aligned_frame_ranges(times, rate)
+            frame_ranges = rate_frame_ranges[rate]
+            read_ranges = np.clip(frame_ranges, 0, facet.get_n_frames())
+            sequences = allocate_sequences(read_ranges[:, 1] - read_ranges[:, 0], facet.get_frame_shape(),
+                                           facet.get_frame_dtype())
+            if np.any(read_ranges[:, 1] > read_ranges[:, 0]):
+                for slot, frames in zip(get_sequence_slots(sequences),
+                                        iter_frame_ranges(facet, read_ranges, max_gap=max_gap,
+                                                          batch_size=max(len(read_ranges), 1))):
+                    slot[...] = frames
+            all_frame_ranges.append(frame_ranges)
+            streams.append(sequences)
+        return TimeWindows(times, all_frame_ranges, streams)
+
+    def get_sliding_windows(self, stream_facets, window, hop, chunk_seconds=1., copy=False):
+        """
+        Iterate over windows of the streams every hop seconds, reading and decoding every frame once, see
+        multimodal.dataset.streaming.SlidingWindows
+        """
+        from multimodal.dataset.streaming import SlidingWindows
+        if isinstance(stream_facets, str):
+            stream_facets = [stream_facets]
+        streams = [self.modalities[stream_facet].get_facet() for stream_facet in stream_facets]
+        return SlidingWindows(streams, window, hop, chunk_seconds=chunk_seconds, copy=copy)
 
     def setup_modalities(self):
         MultiModalDataset.setup_modalities(self)
@@ -286,36 +488,134 @@ class VideoDataset(MultiModalDataset):
 
 
 class WrapperCollection(object):
+    """
+    Concatenation of the wrappers of several datasets. Global item i belongs to the wrapper w with
+    offsets[w] <= i < offsets[w + 1], where it is item i - offsets[w].
+    """
     def __init__(self, wrappers):
         self.wrappers = wrappers
-        self.wrapper_lengths = [len(wrapper) for wrapper in self.wrappers]
-        self.cumsum_lengths = np.cumsum(self.wrapper_lengths)
-        self.total_length = sum(self.wrapper_lengths)
+        self.wrapper_lengths = np.array([len(wrapper) for wrapper in self.wrappers], dtype=np.int64)
+        self.offsets = np.zeros(len(self.wrappers) + 1, dtype=np.int64)
+        np.cumsum(self.wrapper_lengths, out=self.offsets[1:])
+        self.total_length = int(self.offsets[-1])
+        # The wrapper of every item, so that finding the wrapper of an item is a single lookup
+        self.item_wrappers = np.repeat(np.arange(len(self.wrappers), dtype=np.int32), self.wrapper_lengths)
 
     def __len__(self):
-        return sum(self.wrapper_lengths)
+        return self.total_length
+
+    def get_durations(self):
+        return np.concatenate([wrapper.get_durations() for wrapper in self.wrappers])
+
+    def locate(self, item):
+        """
+        Find the wrapper of a global item
+        :return: A tuple (wrapper_id, wrapper_item)
+        """
+        if not -self.total_length <= item < self.total_length:
+            raise IndexError("Item {} out of range for collection of length {}".format(item, self.total_length))
+        if item < 0:
+            item += self.total_length
+        wrapper_id = int(self.item_wrappers[item])
+        return wrapper_id, int(item - self.offsets[wrapper_id])
+
+    def locate_batch(self, items):
+        """
+        Find the wrappers of an array of global items
+        :return: A tuple (wrapper_ids, wrapper_items) of arrays with the same shape as items
+        """
+        items = np.asarray(items, dtype=np.int64)
+        if np.any((items < -self.total_length) | (items >= self.total_length)):
+            raise IndexError("Items out of range for collection of length {}".format(self.total_length))
+        items = np.where(items < 0, items + self.total_length, items)
+        wrapper_ids = self.item_wrappers[items]
+        return wrapper_ids, items - self.offsets[wrapper_ids]
+
+    def get_stream_segments(self, item, crop_position=None):
+        wrapper_id, wrapper_item = self.locate(item)
+        return self.wrappers[wrapper_id].get_stream_segments(wrapper_item, crop_position)
+
+    def get_stream_segments_batch(self, items, crop_positions=None):
+        """
+        Return the texts and stream segments of several items, each wrapper handles its items at once
+        """
+        wrapper_ids, wrapper_items = self.locate_batch(items)
+        if crop_positions is not None:
+            crop_positions = np.broadcast_to(np.asarray(crop_positions, dtype=np.float64), wrapper_ids.shape)
+        item_segments = [None] * len(wrapper_ids)
+        for wrapper_id in np.unique(wrapper_ids).tolist():
+            positions = np.flatnonzero(wrapper_ids == wrapper_id)
+            segments = self.wrappers[wrapper_id].get_stream_segments_batch(
+                wrapper_items[positions], None if crop_positions is None else crop_positions[positions])
+            for position, item in zip(positions.tolist(), segments):
+                item_segments[position] = item
+        return item_segments
+
+    def get_block_shuffled_indices(self, buffer_size, rng=None):
+        """
+        Return a shuffled order of the items which visits the datasets in random order and shuffles the items within
+        windows of buffer_size items, see multimodal.dataset.sampling.block_shuffle.
+        """
+        return block_shuffle(self.wrapper_lengths, buffer_size, rng)
 
     def __getitem__(self, item):
         if isinstance(item, slice):
-            # Figure out which wrappers the item spans
-            raise NotImplementedError()
+            return (self[i] for i in range(*item.indices(len(self))))
         elif isinstance(item, Integral):
-            wrapper_id = np.searchsorted(self.cumsum_lengths, item)
-            wrapper_item = item - self.cumsum_lengths[wrapper_id]
+            wrapper_id, wrapper_item = self.locate(item)
             return self.wrappers[wrapper_id][wrapper_item]
         else:
             raise TypeError("Invalid argument type. {}".format(type(item)))
 
 
 class VideoDatasets(object):
+    """
+    A collection of video datasets. The files are opened when they're first used, in the handle pool of the process
+    (see multimodal.dataset.handles). The size of the pool is shared by all datasets of the process and is set with
+    multimodal.dataset.handles.set_max_open, not per collection.
+    """
     def __init__(self, dataset_paths):
         self.dataset_paths = dataset_paths
-        self.datasets = [VideoDataset(dataset_path) for dataset_path in dataset_paths]
+        self.datasets = [VideoDataset(dataset_path, pooled=True) for dataset_path in dataset_paths]
 
     def get_facet_wrapper(self, *args, **kwargs):
         wrappers = [dataset.get_facet_wrapper(*args, **kwargs) for dataset in self.datasets]
         return WrapperCollection(wrappers)
 
+    def get_subtitled_streams(self, *args, **kwargs):
+        return WrapperCollection([dataset.get_subtitled_streams(*args, **kwargs) for dataset in self.datasets])
+
+    def get_subtitled_streams_randomized(self, stream_facets, subtitle_id=None, max_duration=None, rng=None,
+                                         synched_streams=True, cross_dataset=False):
+        """
+        Subtitles paired with stream segments of other subtitles, as a WrapperCollection
+        :param cross_dataset: If True, the stream segments are taken from the other datasets, see
+                              set_cross_dataset_segments, otherwise from the same dataset
+        """
+        if rng is None:
+            rng = np.random.RandomState()
+        wrappers = [dataset.get_subtitled_streams_randomized(stream_facets, subtitle_id=subtitle_id,
+                                                             max_duration=max_duration, rng=rng,
+                                                             synched_streams=synched_streams)
+                    for dataset in self.datasets]
+        if cross_dataset:
+            set_cross_dataset_segments(wrappers, rng)
+        return WrapperCollection(wrappers)
+
+    def resample_stream_times(self, collection, rng=None):
+        """
+        Draw new random stream segments for a collection from get_subtitled_streams_randomized, e.g. for a new epoch.
+        Segments taken from other datasets are drawn from the other datasets again.
+        :param collection: The WrapperCollection of SubtitlesAndRandomStreamsWrappers
+        :param rng: The RandomState used for segments from other datasets, that of the first wrapper if None
+        """
+        wrappers = collection.wrappers
+        if any(wrapper.stream_sources is not None for wrapper in wrappers):
+            set_cross_dataset_segments(wrappers, wrappers[0].rng if rng is None else rng)
+        else:
+            for wrapper in wrappers:
+                wrapper.resample_stream_times()
+
     def __enter__(self):
         return self
 
@@ -1,46 +1,234 @@
+"""
+Operations on sets of time intervals. Interval sets are ndarrays of shape (n, 2) with start and end times, the
+intervals are half-open [start, end). The set operations first normalize their arguments: empty intervals are dropped
+and overlapping or touching intervals are merged, giving time-sorted disjoint intervals. All operations work on whole
+arrays with sorting and binary search instead of stepping through the intervals one by one.
+"""
 import numpy as np
 
 
+def as_intervals(intervals):
+    return np.reshape(np.asarray(intervals), (-1, 2))
+
+
+def _join_groups(starts, ends, new_group):
+    """
+    Join runs of consecutive intervals into one interval each, from the start of the first interval of the run to the
+    end of the last. *new_group* is a boolean array which is True for the intervals starting a run.
+    """
+    first = np.flatnonzero(new_group)
+    last = np.append(first[1:], len(starts)) - 1
+    return np.stack([starts[first], ends[last]], axis=1)
+
+
+def normalize(intervals):
+    """
+    Sort the intervals, drop empty ones and merge the ones which overlap or touch
+    :param intervals: An ndarray of shape (n, 2)
+    :return: An ndarray of shape (m <= n, 2) with time-sorted disjoint intervals
+    """
+    intervals = as_intervals(intervals)
+    intervals = intervals[intervals[:, 1] > intervals[:, 0]]
+    if len(intervals) == 0:
+        return intervals
+    starts = intervals[:, 0]
+    if np.any(starts[1:] < starts[:-1]):
+        intervals = intervals[np.argsort(starts, kind='stable')]
+        starts = intervals[:, 0]
+    running_ends = np.maximum.accumulate(intervals[:, 1])
+    new_group = np.ones(len(intervals), dtype=bool)
+    new_group[1:] = starts[1:] > running_ends[:-1]
+    return _join_groups(starts, running_ends, new_group)
+
+
+def union(*interval_sets):
+    """
+    The union of any number of interval sets, as time-sorted disjoint intervals
+    """
+    if not interval_sets:
+        return np.zeros((0, 2))
+    return normalize(np.concatenate([as_intervals(intervals) for intervals in interval_sets]))
+
+
+def contains(intervals, times):
+    """
+    Check which of the time points lie inside the intervals
+    :param intervals: Time-sorted disjoint intervals, as returned by normalize
+    :param times: Array of time points
+    :return: A boolean array with the same shape as *times*
+    """
+    times = np.asarray(times)
+    if len(intervals) == 0:
+        return np.zeros(times.shape, dtype=bool)
+    candidates = np.searchsorted(intervals[:, 0], times, side='right') - 1
+    return (candidates >= 0) & (intervals[np.maximum(candidates, 0), 1] > times)
+
+
+def _combine(a, b, operation):
+    """
+    Apply a boolean operation pointwise to two interval sets. The endpoints of both sets split the time line into
+    elementary segments which are either completely inside or completely outside of each set, so the operation only
+    has to be evaluated at the start of each segment.
+    """
+    a = normalize(a)
+    b = normalize(b)
+    boundaries = np.unique(np.concatenate([a.ravel(), b.ravel()]))
+    if len(boundaries) < 2:
+        return np.zeros((0, 2), dtype=boundaries.dtype)
+    selected = operation(contains(a, boundaries[:-1]), contains(b, boundaries[:-1]))
+    changes = np.diff(np.concatenate([[False], selected, [False]]).astype(np.int8))
+    return np.stack([boundaries[:-1][changes[:-1] == 1], boundaries[1:][changes[1:] == -1]], axis=1)
+
+
+def intersection(a, b):
+    """
+    The intersection of two interval sets, as time-sorted disjoint intervals
+    """
+    return _combine(a, b, np.logical_and)
+
+
+def difference(a, b):
+    """
+    The parts of the intervals in *a* which are not covered by *b*, as time-sorted disjoint intervals
+    """
+    return _combine(a, b, lambda in_a, in_b: in_a & ~in_b)
+
+
+def complement(intervals, start, end):
+    """
+    The gaps between the intervals inside [start, end)
+    :return: An ndarray of shape (m, 2) with time-sorted disjoint intervals
+    """
+    intervals = normalize(intervals)
+    gap_starts = np.maximum(np.append(start, intervals[:, 1]), start)
+    gap_ends = np.minimum(np.append(intervals[:, 0], end), end)
+    non_empty = gap_ends > gap_starts
+    return np.stack([gap_starts[non_empty], gap_ends[non_empty]], axis=1)
+
+
+def total_length(intervals):
+    """
+    The total length of time covered by the intervals, where overlaps are only counted once
+    """
+    intervals = normalize(intervals)
+    return np.sum(intervals[:, 1] - intervals[:, 0])
+
+
+def _covered_before(cover, times):
+    """
+    The length of time covered by *cover* before each of the times. *cover* is a float array of time-sorted disjoint
+    intervals.
+    """
+    cumulative_lengths = np.append(0., np.cumsum(cover[:, 1] - cover[:, 0]))
+    started = np.searchsorted(cover[:, 0], times, side='right')
+    if len(cover) == 0:
+        return cumulative_lengths[started]
+    # The last interval which started before the time might still be going on, remove the part after the time
+    remaining = np.maximum(cover[np.maximum(started - 1, 0), 1] - times, 0)
+    return cumulative_lengths[started] - np.where(started > 0, remaining, 0)
+
+
+def coverage_ratio(intervals, cover):
+    """
+    How much of each interval is covered by another interval set
+    :param intervals: An ndarray of shape (n, 2), these don't need to be sorted or disjoint
+    :param cover: An ndarray of shape (m, 2) with the covering intervals
+    :return: A float array of length n with the ratio of each interval which lies inside the intervals of *cover*. The
+             ratio is nan for empty intervals.
+    """
+    intervals = as_intervals(intervals).astype(np.float64)
+    cover = normalize(cover).astype(np.float64)
+    covered = _covered_before(cover, intervals[:, 1]) - _covered_before(cover, intervals[:, 0])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return covered / (intervals[:, 1] - intervals[:, 0])
+
+
+def merge_close(intervals, gap):
+    """
+    Merge intervals which are separated by less than *gap*
+    :return: An ndarray with time-sorted disjoint intervals
+    """
+    intervals = normalize(intervals)
+    if len(intervals) == 0:
+        return intervals
+    new_group = np.ones(len(intervals), dtype=bool)
+    new_group[1:] = intervals[1:, 0] >= intervals[:-1, 1] + gap
+    return _join_groups(intervals[:, 0], intervals[:, 1], new_group)
+
+
+def remove_short(intervals, min_length):
+    """
+    Remove the intervals which aren't longer than *min_length*
+    """
+    intervals = as_intervals(intervals)
+    return intervals[intervals[:, 1] - intervals[:, 0] > min_length]
+
+
+def _split(intervals, n_pieces, piece_lengths):
+    """
+    Split each interval i into n_pieces[i] consecutive pieces, all but the last of length piece_lengths[i]. The last
+    piece ends where the interval ends.
+    :return: A tuple (piece_starts, piece_ends)
+    """
+    n_pieces = n_pieces.astype(np.int64)
+    interval_indices = np.repeat(np.arange(len(intervals)), n_pieces)
+    first_pieces = np.cumsum(n_pieces) - n_pieces
+    piece_numbers = np.arange(len(interval_indices)) - first_pieces[interval_indices]
+    offsets = (piece_numbers * piece_lengths[interval_indices]).astype(intervals.dtype, copy=False)
+    piece_starts = intervals[interval_indices, 0] + offsets
+    piece_ends = np.empty_like(piece_starts)
+    piece_ends[:-1] = piece_starts[1:]
+    piece_ends[first_pieces[1:] - 1] = intervals[:-1, 1]
+    if len(piece_ends) > 0:
+        piece_ends[-1] = intervals[-1, 1]
+    return piece_starts, piece_ends
+
+
+def split_long(intervals, max_length):
+    """
+    Split the intervals which are longer than *max_length* into the smallest number of equally long pieces which are
+    at most *max_length* long
+    :return: An ndarray of shape (m >= n, 2) with the pieces in the same order as the intervals
+    """
+    intervals = as_intervals(intervals)
+    lengths = intervals[:, 1] - intervals[:, 0]
+    n_pieces = np.maximum(np.ceil(lengths / max_length), 1)
+    piece_starts, piece_ends = _split(intervals.astype(np.result_type(lengths, np.float64)), n_pieces,
+                                      lengths / n_pieces)
+    return np.stack([piece_starts, piece_ends], axis=1)
+
+
+def _check_disjoint_sorted(intervals, name):
+    """
+    Raise a ValueError unless the intervals are time-sorted and disjoint, touching intervals are allowed
+    """
+    if np.any(intervals[:, 1] < intervals[:, 0]) or np.any(intervals[1:, 0] < intervals[:-1, 1]):
+        raise ValueError("{} must be time-sorted and disjoint, use normalize() to merge overlapping "
+                         "intervals".format(name))
+
+
 def filter_overlapping_intervals(to_be_filtered, filter_intervals, filter_coverage=0.6):
     """
     Removes any interval in *to_be_filtered* which overlaps an interval in *filter_intervals* by a ratio of at least *filter_coverate*
-    :param to_be_filtered: An ndarray fo shape (n, 2) with time-sorted intervals
-    :param filter_intervals: An ndarray of shape (m, 2) with time-sorted intervals
+    :param to_be_filtered: An ndarray fo shape (n, 2) with time-sorted disjoint intervals
+    :param filter_intervals: An ndarray of shape (m, 2) with time-sorted disjoint intervals, e.g. as returned by
+                             merge_intervals or normalize
     :param filter_coverage: The ratio of how much the intervals needs to be covered by the filter interval to be removed
     :return: A ndarray of shape (p < n, 2) with the intervals not covered by any filter intervals.
+    :raises ValueError: If either of the interval sets has overlapping or unsorted intervals
     """
-    current_filter_interval = 0
-    current_interval = 0
-    filtered_intervals = []
-    while current_filter_interval < len(filter_intervals) and current_interval < len(to_be_filtered):
-        start, end = to_be_filtered[current_interval]
-        interval_length = end - start
-        overlap = 0
+    to_be_filtered = as_intervals(to_be_filtered)
+    filter_intervals = as_intervals(filter_intervals)
+    _check_disjoint_sorted(to_be_filtered, 'to_be_filtered')
+    _check_disjoint_sorted(filter_intervals, 'filter_intervals')
+    if len(filter_intervals) == 0:
+        return to_be_filtered[:0]
+    # Intervals are only considered as long as there are filter intervals left; once an interval reaches the end of
+    # the last filter interval, the ones after it are dropped
+    considered = np.ones(len(to_be_filtered), dtype=bool)
+    considered[1:] = to_be_filtered[:-1, 1] < filter_intervals[-1, 1]
+    return to_be_filtered[considered & (coverage_ratio(to_be_filtered, filter_intervals) < filter_coverage)]
 
-        # Find all filter intevals which overlaps the current, and add their overlap
-        while current_filter_interval < len(filter_intervals):
-            filter_start, filter_end = filter_intervals[current_filter_interval]
-
-            if filter_start > end:
-                # The current filter is beyond the current interval to be filtered, we're done and the interval did not get filtered
-                break
-            elif start < filter_end:
-                # The filter overlaps the interval, accumulate the overlap
-                # it to the list
-                filter_length = filter_end - filter_start
-                filter_overlap = (filter_length -
-                           (max(0, start - filter_start) +  # This is how much the filter overlaps on the "left" side of the interval
-                            max(0, filter_end - end)))      # This is how much the filter overlaps on the "right" side of the interval
-                overlap += filter_overlap
-            if end < filter_end:
-                # This was the last filter which applied to the current interval, go on to the next interval but keep
-                # this filter
-                break
-            current_filter_interval += 1
-        if overlap/interval_length < filter_coverage:
-            filtered_intervals.append((start, end))
-        current_interval += 1
-    return np.array(filtered_intervals)
 
 def old_filter_overlapping_intervals(to_be_filtered, filter_intervals, filter_coverage=0.6):
     """
@@ -89,17 +277,11 @@ def merge_intervals(intervals, merge_duration):
     """
     if len(intervals) < 2:
         return intervals
-    merged_intervals = []
-    previous_start, previous_end = intervals[0]
-    for i in range(1, len(intervals)):
-        start, end = intervals[i]
-        if start < previous_end + merge_duration:
-            previous_end = end
-        else:
-            merged_intervals.append([previous_start, previous_end])
-            previous_start, previous_end = start, end
-    merged_intervals.append([previous_start, previous_end])
-    return np.array(merged_intervals)
+    intervals = as_intervals(intervals)
+    # A merged interval ends where its last interval ends, so each interval is compared with the one before it
+    new_group = np.ones(len(intervals), dtype=bool)
+    new_group[1:] = intervals[1:, 0] >= intervals[:-1, 1] + merge_duration
+    return _join_groups(intervals[:, 0], intervals[:, 1], new_group)
 
 
 def merge_annotated_intervals(intervals, min_overlap=0):
@@ -112,42 +294,191 @@ def merge_annotated_intervals(intervals, min_overlap=0):
     """
     if len(intervals) < 2:
         return intervals
-    merged_intervals = []
-    previous_start, previous_end, *data = intervals[0]
-    data_values = [[x] for x in data]
-
-    for start, end, *data in intervals[1:]:
-        if start < previous_end + min_overlap:
-            previous_end = end
-            for i, x in enumerate(data):
-                data_values[i].append(x)
-        else:
-            merged_intervals.append([previous_start, previous_end, *data_values])
-            previous_start, previous_end = start, end
-            data_values = [[x] for x in data]
-    merged_intervals.append([previous_start, previous_end, *data_values])
-    return merged_intervals
+    starts = np.array([interval[0] for interval in intervals])
+    ends = np.array([interval[1] for interval in intervals])
+    new_group = np.ones(len(intervals), dtype=bool)
+    new_group[1:] = starts[1:] >= ends[:-1] + min_overlap
+    first = np.flatnonzero(new_group).tolist()
+    last = first[1:] + [len(intervals)]
+    data_columns = [[interval[k] for interval in intervals] for k in range(2, len(intervals[0]))]
+    return [[intervals[i][0], intervals[j - 1][1], *[column[i:j] for column in data_columns]]
+            for i, j in zip(first, last)]
 
 
 def trim_intervals(intervals, trim_length):
-    interval_lengths = intervals[:,1] - intervals[:,0]
-    return intervals[interval_lengths > trim_length]
+    return remove_short(intervals, trim_length)
 
 
 def limit_length(intervals, length_limit):
-    for start, end in intervals:
-        interval_length = end - start
-        if interval_length >= length_limit:
-            # We divide the samples as evenly as possible among the windows
-            num_sub_intervals = int(np.ceil(interval_length/length_limit))
-            sub_interval_length = int(np.ceil(interval_length/num_sub_intervals))
-            # The first num_sub_intervals - 1 are the same length
-            for i in range(num_sub_intervals - 1):
-                sub_start = i*sub_interval_length
-                sub_end = sub_start + sub_interval_length
-                yield (start + sub_start, start + sub_end)
-            # We let the remaining sub-interval take care of uneven lengths
-            sub_start = (num_sub_intervals-1)*sub_interval_length
-            yield start + sub_start, end
+    intervals = as_intervals(intervals)
+    interval_lengths = intervals[:, 1] - intervals[:, 0]
+    # We divide the samples as evenly as possible among the windows, in pieces of whole time steps
+    long_intervals = interval_lengths >= length_limit
+    num_sub_intervals = np.where(long_intervals, np.ceil(interval_lengths / length_limit), 1)
+    sub_interval_lengths = np.ceil(interval_lengths / num_sub_intervals).astype(np.int64)
+    # The last sub-interval takes care of uneven lengths
+    yield from zip(*_split(intervals, num_sub_intervals, sub_interval_lengths))
+
+
+class IntervalTree(object):
+    """
+    Centered interval tree over half-open intervals [start, end). Used by IntervalIndex as a fallback for interval sets
+    where intervals overlap each other, which breaks the assumptions of the sorted array queries.
+    """
+    def __init__(self, starts, ends, ids=None):
+        starts = np.asarray(starts)
+        ends = np.asarray(ends)
+        if ids is None:
+            ids = np.arange(len(starts))
+        self.root = self._build(starts, ends, ids)
+
+    def _build(self, starts, ends, ids):
+        if len(ids) == 0:
+            return None
+        endpoints = np.sort(np.concatenate([starts, ends]))
+        center = endpoints[len(endpoints) // 2]
+        # Since the center is an endpoint of at least one interval, every node contains at least one interval
+        contains_center = (starts <= center) & (ends >= center)
+        left = ends < center
+        right = starts > center
+        return (center,
+                starts[contains_center], ends[contains_center], ids[contains_center],
+                self._build(starts[left], ends[left], ids[left]),
+                self._build(starts[right], ends[right], ids[right]))
+
+    def query_point(self, time):
+        """
+        Return the ids of all intervals which contains *time*
+        """
+        found = []
+        node = self.root
+        while node is not None:
+            center, starts, ends, ids, left, right = node
+            found.append(ids[(starts <= time) & (ends > time)])
+            if time < center:
+                node = left
+            elif time > center:
+                node = right
+            else:
+                break
+        return np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+
+    def query_interval(self, start, end):
+        """
+        Return the ids of all intervals which overlaps the interval [start, end)
+        """
+        found = []
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            if node is None:
+                continue
+            center, starts, ends, ids, left, right = node
+            found.append(ids[(starts < end) & (ends > start)])
+            if start < center:
+                nodes.append(left)
+            if end > center:
+                nodes.append(right)
+        return np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+
+
+class IntervalIndex(object):
+    """
+    Sorted index over a set of half-open intervals [start, end), giving vectorized overlap and point-in-time queries.
+
+    The intervals are sorted by start time. If the intervals don't overlap each other the end times are sorted as well
+    and all queries are answered by binary search in the sorted arrays. Otherwise an IntervalTree is built on first use
+    for the queries which can't be answered from the sorted arrays.
+    """
+    def __init__(self, intervals):
+        intervals = np.reshape(np.asarray(intervals), (-1, 2))
+        self.intervals = intervals
+        self.order = np.argsort(intervals[:, 0], kind='stable')
+        self.starts = intervals[self.order, 0]
+        self.ends = intervals[self.order, 1]
+        self.sorted_ends = np.sort(self.ends)
+        if len(intervals) > 0:
+            self.max_ends = np.maximum.accumulate(self.ends)
         else:
-            yield start, end
+            self.max_ends = self.ends
+        self.is_disjoint = bool(np.all(self.starts[1:] >= self.ends[:-1]))
+        self._tree = None
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def get_tree(self):
+        if self._tree is None:
+            self._tree = IntervalTree(self.starts, self.ends)
+        return self._tree
+
+    def overlapping(self, start, end):
+        """
+        Return the indices of all intervals overlapping [start, end), sorted by interval start
+        """
+        if self.is_disjoint:
+            lo = np.searchsorted(self.ends, start, side='right')
+            hi = np.searchsorted(self.starts, end, side='left')
+            return self.order[lo:max(lo, hi)]
+        sorted_indices = np.sort(self.get_tree().query_interval(start, end))
+        return self.order[sorted_indices]
+
+    def overlapping_batch(self, starts, ends):
+        """
+        Vectorized version of *overlapping* for many query intervals.
+        :param starts: Array of query interval starts
+        :param ends: Array of query interval ends
+        :return: A tuple (offsets, indices), the intervals overlapping query i are indices[offsets[i]:offsets[i+1]]
+        """
+        starts = np.asarray(starts)
+        ends = np.asarray(ends)
+        if self.is_disjoint:
+            lo = np.searchsorted(self.ends, starts, side='right')
+            hi = np.maximum(lo, np.searchsorted(self.starts, ends, side='left'))
+            counts = hi - lo
+            offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+            np.cumsum(counts, out=offsets[1:])
+            # Each query contributes the run lo[i], lo[i] + 1, ..., hi[i] - 1
+            positions = np.arange(offsets[-1]) - np.repeat(offsets[:-1] - lo, counts)
+            return offsets, self.order[positions]
+        found = [self.overlapping(start, end) for start, end in zip(starts, ends)]
+        offsets = np.zeros(len(found) + 1, dtype=np.int64)
+        np.cumsum([len(indices) for indices in found], out=offsets[1:])
+        indices = np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+        return offsets, indices
+
+    def count_overlapping(self, starts, ends):
+        """
+        Return the number of intervals overlapping each of the query intervals [starts[i], ends[i]). This works
+        without the interval tree even if the intervals overlap each other.
+        """
+        # An interval overlaps the query if it starts before the query ends, unless it also ends before the query starts
+        return (np.searchsorted(self.starts, ends, side='left') -
+                np.searchsorted(self.sorted_ends, starts, side='right'))
+
+    def active_at(self, times):
+        """
+        Find which interval is active at each of the given times. If more than one interval is active, the one which
+        started last is chosen.
+        :param times: Array of time points
+        :return: An integer array with the same shape as *times* with indices of the active intervals, or -1 where no
+                 interval is active
+        """
+        times = np.asarray(times)
+        active = np.full(times.shape, -1, dtype=np.int64)
+        if len(self) == 0:
+            return active
+        candidates = np.searchsorted(self.starts, times, side='right') - 1
+        has_candidate = candidates >= 0
+        clipped_candidates = np.maximum(candidates, 0)
+        is_active = has_candidate & (self.ends[clipped_candidates] > times)
+        active[is_active] = self.order[candidates[is_active]]
+        if not self.is_disjoint:
+            # The last interval starting before the time has ended, but an earlier and longer one might still be active
+            unresolved = has_candidate & ~is_active & (self.max_ends[clipped_candidates] > times)
+            tree = self.get_tree()
+            for position in np.flatnonzero(unresolved):
+                containing = tree.query_point(times.flat[position])
+                if len(containing) > 0:
+                    active.flat[position] = self.order[containing.max()]
+        return active
@@ -5,11 +5,14 @@
    original available at https://github.com/cdown/srt"""
 
 from __future__ import unicode_literals
+import collections
 import functools
 import re
 from datetime import timedelta
 import logging
 
+import numpy as np
+
 
 log = logging.getLogger(__name__)
 
@@ -53,6 +56,24 @@ SRT_REGEX = re.compile(
 TS_LEN = 12
 STANDARD_TS_COLON_OFFSET = 2
 
+# Used by the array parser. It matches the separating line breaks before a subtitle header together with the header,
+# so splitting on it gives the contents of the subtitles. It starts with a literal line feed, which lets the regex
+# engine skip quickly through the contents, so a carriage return before it is left at the end of the preceding
+# content and the first header in a file needs a line feed prepended. The timestamp fields have the widths which
+# srt_timestamp_to_timedelta expects.
+RGX_TIMESTAMP_FIELDS = RGX_TIMESTAMP_MAGNITUDE_DELIM.join([r"(\d{2,})", r"(\d\d)", r"(\d\d)", r"(\d\d\d)"])
+SRT_HEADER_REGEX = re.compile(
+    r"\n(?:{eof})?({idx})\s*{eof}{ts} +-[ -]> +{ts} ?({proprietary}){eof}".format(
+        idx=RGX_INDEX,
+        ts=RGX_TIMESTAMP_FIELDS,
+        proprietary=RGX_PROPRIETARY,
+        eof=RGX_POSSIBLE_CRLF,
+    )
+)
+SRT_HEADER_GROUPS = 10
+SRT_PIECE_END_REGEX = re.compile(r"{eof}\Z".format(eof=RGX_POSSIBLE_CRLF))
+SRT_TRAILING_EOF_REGEX = re.compile(r"(?:{eof}){{1,2}}\Z".format(eof=RGX_POSSIBLE_CRLF))
+
 ZERO_TIMEDELTA = timedelta(0)
 
 # Warning message if truthy return -> Function taking a Subtitle, skip if True
@@ -331,6 +352,215 @@ def parse(srt):
     _raise_if_not_contiguous(srt, expected_start, len(srt))
 
 
+class SubtitleArrays(collections.namedtuple('SubtitleArrays',
+                                            ['index', 'times', 'content', 'content_offsets', 'proprietary'])):
+    """
+    Subtitles parsed into arrays.
+
+    :ivar index: Integer array with the SRT index of each subtitle
+    :ivar times: Float64 array of shape (n, 2) with start and end times in seconds
+    :ivar content: The contents of all subtitles concatenated into a single string
+    :ivar content_offsets: Integer array of length n + 1, the content of subtitle i is
+                           content[content_offsets[i]:content_offsets[i+1]]
+    :ivar proprietary: List with the proprietary metadata of each subtitle
+    """
+    def get_content(self, i):
+        return self.content[self.content_offsets[i]:self.content_offsets[i + 1]]
+
+    def get_contents(self):
+        return [self.get_content(i) for i in range(len(self.index))]
+
+
+def parse_arrays(srt, skip_invalid=False):
+    r'''
+    Convert an SRT formatted string directly to arrays of times and packed content, without creating any
+    :py:class:`Subtitle` or :py:class:`~datetime.timedelta` objects. The same input is accepted as by
+    :py:func:`parse` and the same subtitles are found, with the exception of timestamps with fields of unusual
+    widths, which :py:func:`parse` doesn't convert correctly.
+
+    .. doctest::
+
+        >>> arrays = parse_arrays("""\
+        ... 422
+        ... 00:31:39,931 --> 00:31:41,931
+        ... Using mainly spoons,
+        ...
+        ... """)
+        >>> arrays.times
+        array([[1899.931, 1901.931]])
+        >>> arrays.get_contents()
+        ['Using mainly spoons,']
+
+    :param str srt: Subtitles in SRT format
+    :param bool skip_invalid: If True, leave out subtitles which :py:func:`compose` would skip (see
+                              SUBTITLE_SKIP_CONDITIONS)
+    :returns: The parsed subtitles
+    :rtype: :py:class:`SubtitleArrays`
+    '''
+    arrays = _parse_arrays_piece(srt, first=True, final=True)
+    if skip_invalid:
+        arrays = _skip_invalid_arrays(arrays)
+    return arrays
+
+
+def iter_parse_arrays(fp, chunk_size=2**20, skip_invalid=False):
+    """
+    Streaming version of :py:func:`parse_arrays`, reads the SRT file in chunks and yields the subtitles parsed so
+    far as :py:class:`SubtitleArrays` after each chunk. Memory use is bounded by the chunk size rather than the file
+    size.
+
+    :param fp: A file object opened in text mode
+    :param int chunk_size: Number of characters to read at a time
+    :param bool skip_invalid: See :py:func:`parse_arrays`
+    :rtype: :term:`generator` of :py:class:`SubtitleArrays`
+    """
+    buffer = ''
+    first = True
+    n_leading_whitespace = 0
+    while True:
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            break
+        buffer += chunk
+        if first:
+            # Leading whitespace is skipped, as in parse, so that the first header is at the start of the buffer
+            stripped = buffer.lstrip()
+            n_leading_whitespace += len(buffer) - len(stripped)
+            if not stripped:
+                buffer = ''
+                continue
+            buffer = '\n' + stripped
+        # Everything before the last complete header in the buffer belongs to subtitles which are complete
+        # The buffer starts with a header, unless nothing has been parsed yet, which we must not split at
+        first_header = SRT_HEADER_REGEX.match(buffer)
+        search_start = first_header.end() if first_header is not None else 0
+        last_header_start = _find_last_header(buffer, search_start)
+        if last_header_start is None:
+            continue
+        arrays = _parse_arrays_piece(buffer[:last_header_start], first=first, final=False)
+        buffer = buffer[last_header_start:]
+        first = False
+        if skip_invalid:
+            arrays = _skip_invalid_arrays(arrays)
+        yield arrays
+    if first and not buffer and n_leading_whitespace > 0:
+        raise SRTParseError(0, n_leading_whitespace, ' ' * n_leading_whitespace)
+    arrays = _parse_arrays_piece(buffer, first=first, final=True)
+    if skip_invalid:
+        arrays = _skip_invalid_arrays(arrays)
+    yield arrays
+
+
+def _find_last_header(srt, start):
+    """
+    Find the start of the last complete subtitle header in srt[start:], searching backwards line by line. This may be
+    the last line break before the header rather than the first, see _parse_arrays_piece.
+    """
+    position = len(srt)
+    while True:
+        position = srt.rfind('\n', start, position)
+        if position < 0:
+            return None
+        if SRT_HEADER_REGEX.match(srt, position):
+            return position
+
+
+def concatenate_arrays(arrays_list):
+    """
+    Concatenate a sequence of :py:class:`SubtitleArrays`, e.g. the output of :py:func:`iter_parse_arrays`
+    """
+    arrays_list = list(arrays_list)
+    offsets = [np.zeros(1, dtype=np.int64)]
+    total_length = 0
+    for arrays in arrays_list:
+        offsets.append(arrays.content_offsets[1:] + total_length)
+        total_length += len(arrays.content)
+    return SubtitleArrays(
+        index=np.concatenate([np.zeros(0, dtype=np.int64)] + [arrays.index for arrays in arrays_list]),
+        times=np.concatenate([np.zeros((0, 2))] + [arrays.times for arrays in arrays_list]),
+        content=''.join(arrays.content for arrays in arrays_list),
+        content_offsets=np.concatenate(offsets),
+        proprietary=[proprietary for arrays in arrays_list for proprietary in arrays.proprietary],
+    )
+
+
+def _parse_arrays_piece(srt, first, final):
+    """
+    Parse a piece of an SRT file into arrays. Unless this is the first piece, the piece starts with a header. Unless
+    this is the final piece, it ends right before the line feed of the line break preceding the next header.
+    """
+    if first:
+        stripped = srt.lstrip()
+        offset = len(srt) - len(stripped)
+        if final and not stripped and offset > 0:
+            # Input with only whitespace is an error, as in parse
+            raise SRTParseError(0, offset, srt)
+        srt = '\n' + stripped
+        offset -= 1
+    else:
+        offset = 0
+    parts = SRT_HEADER_REGEX.split(srt)
+    if parts[0] and parts[0] != '\n':
+        # All of the text is unmatched, or there is text before the first subtitle
+        raise SRTParseError(max(offset, 0), offset + len(parts[0]), parts[0])
+    stride = SRT_HEADER_GROUPS + 1
+    contents = parts[stride::stride]
+    if final and contents:
+        contents[-1] = SRT_TRAILING_EOF_REGEX.sub('', contents[-1], count=1)
+    n_followed = len(contents) - 1 if final else len(contents)
+    for i in range(n_followed):
+        # The carriage return of the line break before the next header
+        if contents[i].endswith('\r'):
+            contents[i] = contents[i][:-1]
+    if not final and contents:
+        # The piece was cut at the last line break before the next header, while split starts the header at the first
+        # line break of the blank line before it
+        contents[-1] = SRT_PIECE_END_REGEX.sub('', contents[-1], count=1)
+    contents = [content.replace("\r\n", "\n") for content in contents]
+
+    fields = [np.array(list(map(int, parts[i::stride])), dtype=np.int64) for i in range(1, SRT_HEADER_GROUPS)]
+    index = fields[0]
+    # Whole milliseconds are converted to seconds in a single division, which gives exactly the same value as
+    # timedelta.total_seconds()
+    start_ms = ((fields[1] * SECONDS_IN_HOUR + fields[2] * SECONDS_IN_MINUTE + fields[3]) * 1000 + fields[4])
+    end_ms = ((fields[5] * SECONDS_IN_HOUR + fields[6] * SECONDS_IN_MINUTE + fields[7]) * 1000 + fields[8])
+    times = np.stack([start_ms, end_ms], axis=1) / 1000.
+    content_offsets = np.zeros(len(contents) + 1, dtype=np.int64)
+    np.cumsum([len(content) for content in contents], out=content_offsets[1:])
+    return SubtitleArrays(index=index,
+                          times=times,
+                          content=''.join(contents),
+                          content_offsets=content_offsets,
+                          proprietary=parts[SRT_HEADER_GROUPS::stride])
+
+
+def _skip_invalid_arrays(arrays):
+    """
+    Remove the subtitles which would be skipped by :py:func:`sort_and_reindex`
+    """
+    contents = arrays.get_contents()
+    has_content = np.array([bool(content.strip()) for content in contents], dtype=bool)
+    valid = has_content & (arrays.times[:, 0] >= 0) & (arrays.times[:, 0] < arrays.times[:, 1])
+    if np.all(valid):
+        return arrays
+    for i in np.flatnonzero(~valid):
+        if not has_content[i]:
+            reason = "No content"
+        elif arrays.times[i, 0] < 0:
+            reason = "Start time < 0 seconds"
+        else:
+            reason = "Subtitle start time >= end time"
+        log.warning("Skipped subtitle at index %d: %s", arrays.index[i], reason)
+    kept_contents = [content for content, keep in zip(contents, valid) if keep]
+    content_offsets = np.zeros(len(kept_contents) + 1, dtype=np.int64)
+    np.cumsum([len(content) for content in kept_contents], out=content_offsets[1:])
+    return SubtitleArrays(index=arrays.index[valid],
+                          times=arrays.times[valid],
+                          content=''.join(kept_contents),
+                          content_offsets=content_offsets,
+                          proprietary=[proprietary for proprietary, keep in zip(arrays.proprietary, valid) if keep])
+
+
 def _raise_if_not_contiguous(srt, expected_start, actual_start):
     """
     Raise :py:class:`SRTParseError` with diagnostic info if expected_start does
@@ -381,6 +611,119 @@ def compose(subtitles, reindex=True, start_index=1, strict=True, eol=None):
     return "".join(subtitle.to_srt(strict=strict, eol=eol) for subtitle in subtitles)
 
 
+def seconds_to_microseconds(seconds):
+    """
+    Convert an array of times in seconds to whole microseconds, rounding half to even like
+    ``timedelta(seconds=float(t))`` does
+    """
+    seconds = np.asarray(seconds, dtype=np.float64)
+    whole_seconds = np.floor(seconds)
+    fractions = np.round((seconds - whole_seconds) * 1e6)
+    return whole_seconds.astype(np.int64) * 1000000 + fractions.astype(np.int64)
+
+
+def milliseconds_to_srt_timestamps(milliseconds):
+    r"""
+    Format an array of non-negative times in whole milliseconds as SRT timestamps. The digits of all timestamps are
+    computed with array operations, only timestamps of 100 hours or more are formatted one at a time.
+
+    .. doctest::
+
+        >>> milliseconds_to_srt_timestamps([4984000, 360006123])
+        ['01:23:04,000', '100:00:06,123']
+
+    :param milliseconds: Integer array of times
+    :returns: The timestamps in SRT format
+    :rtype: list of str
+    """
+    milliseconds = np.asarray(milliseconds, dtype=np.int64)
+    hours, remainder = np.divmod(milliseconds, SECONDS_IN_HOUR * 1000)
+    minutes, remainder = np.divmod(remainder, SECONDS_IN_MINUTE * 1000)
+    seconds, remainder = np.divmod(remainder, 1000)
+    characters = np.empty((len(milliseconds), TS_LEN), dtype=np.uint8)
+    characters[:, [2, 5]] = ord(':')
+    characters[:, 8] = ord(',')
+    for field, first_column, n_digits in ((hours, 0, 2), (minutes, 3, 2), (seconds, 6, 2), (remainder, 9, 3)):
+        for digit in range(n_digits):
+            characters[:, first_column + n_digits - 1 - digit] = field // 10**digit % 10 + ord('0')
+    timestamps = characters.view('S{}'.format(TS_LEN)).ravel().astype('U{}'.format(TS_LEN)).tolist()
+    for i in np.flatnonzero(hours >= 100):
+        timestamps[i] = "%02d:%02d:%02d,%03d" % (hours[i], minutes[i], seconds[i], remainder[i])
+    return timestamps
+
+
+def compose_arrays(times, contents, fp=None, reindex=True, start_index=1, strict=True, eol=None,
+                   block_size=10000):
+    r"""
+    Compose SRT blocks directly from an array of times and a list of contents, without creating any
+    :py:class:`Subtitle` or :py:class:`~datetime.timedelta` objects. The output is the same as that of
+    :py:func:`compose` for subtitles created with ``timedelta(seconds=float(t))``.
+
+    .. doctest::
+
+        >>> compose_arrays([[2, 3], [0.5, 1.25]], ['y', 'x'])
+        '1\n00:00:00,500 --> 00:00:01,250\nx\n\n2\n00:00:02,000 --> 00:00:03,000\ny\n\n'
+
+    :param times: Array of shape (n, 2) with start and end times in seconds
+    :param contents: Sequence of n content strings
+    :param fp: If not None, a file object opened in text mode which the SRT blocks are written to, block_size
+               subtitles at a time, instead of being returned
+    :param bool reindex: Whether to sort the subtitles by start time, skip invalid ones and renumber them, as
+                         :py:func:`sort_and_reindex` does. Otherwise they are numbered in the given order.
+    :param int start_index: The index of the first subtitle
+    :param bool strict: See :py:func:`compose`
+    :param str eol: The end of line string to use (default "\n")
+    :param int block_size: Number of subtitles to compose per write to fp
+    :returns: The SRT formatted string if fp is None
+    """
+    times = np.asarray(times, dtype=np.float64).reshape(-1, 2)
+    # Subtitles compare by their timedeltas, so everything is done on the times rounded to microseconds
+    start_us = seconds_to_microseconds(times[:, 0])
+    end_us = seconds_to_microseconds(times[:, 1])
+    if reindex:
+        # The sort is stable, like sorted()
+        order = np.lexsort((end_us, start_us))
+        has_content = np.array([bool(contents[i].strip()) for i in order], dtype=bool)
+        start_order, end_order = start_us[order], end_us[order]
+        valid = has_content & (start_order >= 0) & (start_order < end_order)
+        for i in np.flatnonzero(~valid):
+            if not has_content[i]:
+                reason = SUBTITLE_SKIP_CONDITIONS[0][0]
+            elif start_order[i] < 0:
+                reason = SUBTITLE_SKIP_CONDITIONS[1][0]
+            else:
+                reason = SUBTITLE_SKIP_CONDITIONS[2][0]
+            log.warning("Skipped subtitle at position %d: %s", order[i], reason)
+        order = order[valid]
+    else:
+        order = np.arange(len(times))
+
+    if eol is None:
+        eol = "\n"
+    template = "{}" + eol + "{} --> {}" + eol + "{}" + eol + eol
+    output = []
+    for block_start in range(0, len(order), block_size):
+        block_order = order[block_start:block_start + block_size]
+        starts = milliseconds_to_srt_timestamps(start_us[block_order] // MICROSECONDS_IN_MILLISECOND)
+        ends = milliseconds_to_srt_timestamps(end_us[block_order] // MICROSECONDS_IN_MILLISECOND)
+        block_contents = [contents[i] for i in block_order]
+        if strict:
+            block_contents = [make_legal_content(content)
+                              if "\n\n" in content or content.startswith("\n") or content.endswith("\n") else content
+                              for content in block_contents]
+        if eol != "\n":
+            block_contents = [content.replace("\n", eol) for content in block_contents]
+        first_index = start_index + block_start
+        text = "".join([template.format(index, start, end, content) for index, start, end, content
+                        in zip(range(first_index, first_index + len(block_order)), starts, ends, block_contents)])
+        if fp is not None:
+            fp.write(text)
+        else:
+            output.append(text)
+    if fp is None:
+        return "".join(output)
+
+
 class SRTParseError(Exception):
     """
     Raised when part of an SRT block could not be parsed.
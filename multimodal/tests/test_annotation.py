@@ -0,0 +1,123 @@
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import h5py
+import imageio
+import numpy as np
+
+from multimodal.dataset.annotation import iter_frame_ranges
+from multimodal.dataset.video import VideoDataset
+
+
+def make_video_facet(video_modality, n_frames, fps):
+    """
+    A small video facet with frames of constant color, so that the frame number can be recovered after JPEG compression
+    """
+    frames = [np.full((8, 8, 3), 10 * i, dtype=np.uint8) for i in range(n_frames)]
+    encoded = [np.frombuffer(imageio.imwrite('<bytes>', frame, format='jpeg'), dtype=np.uint8) for frame in frames]
+    group = video_modality.create_group('video1')
+    group.attrs['FacetHandler'] = 'VideoFacet'
+    group.attrs['rate'] = fps
+    group.create_dataset('frame_sizes', data=np.cumsum([len(data) for data in encoded]).astype(np.uint64))
+    group.create_dataset('frames', data=np.concatenate(encoded))
+
+
+class TestAnnotationTracks(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dataset_path = os.path.join(self.directory, 'dataset.h5')
+        with h5py.File(self.dataset_path, 'w') as store:
+            audio_group = store.require_group('audio').create_group('audio0')
+            audio_group.attrs['FacetHandler'] = 'AudioFacet'
+            audio_group.attrs['rate'] = 100
+            audio_group.create_dataset('sound', data=np.arange(1000, dtype=np.int16))
+            # Time intervals as they were stored before annotation tracks
+            audio_group.create_dataset('voiced_segments', data=np.array([[10, 20], [50, 80]]))
+            make_video_facet(store.require_group('video'), 20, 10.)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_facet_tracks(self):
+        with VideoDataset(self.dataset_path, mode='r+') as dataset:
+            audio = dataset.get_facet('audio')
+            self.assertTrue(audio.has_time_intervals('voiced_segments'))
+            np.testing.assert_array_equal(audio.get_time_intervals('voiced_segments'), [[10, 20], [50, 80]])
+            times, frames = zip(*dataset.get_time_interval_frames('voiced_segments', 'audio'))
+            self.assertEqual(list(times), [(0.1, 0.2), (0.5, 0.8)])
+            np.testing.assert_array_equal(frames[1], np.arange(50, 80))
+
+            track = audio.add_time_intervals('words', np.array([[300, 400], [100, 250], [200, 300]]),
+                                             labels=['c', 'a', 'b'], attrs={'source': 'test'})
+            self.assertEqual(audio.get_annotation_names(), ['words'])
+            self.assertEqual(audio.get_time_intervals_attrs('words'), {'source': 'test'})
+            np.testing.assert_array_equal(track.times, [[100, 250], [200, 300], [300, 400]])
+            self.assertEqual(track.get_labels().tolist(), ['a', 'b', 'c'])
+            np.testing.assert_array_equal(track.overlapping(2.4, 3.1), [0, 1, 2])
+            np.testing.assert_array_equal(track.overlapping(2.4, 3.1, label='b'), [1])
+            np.testing.assert_array_equal(track.within(0.5, 3.), [0, 1])
+            np.testing.assert_array_equal(track.containing([0., 1.5, 2.2, 3.5]), [-1, 0, 1, 2])
+            offsets, indices = track.overlapping_batch([2.4, 0., 1.], [3.1, 0.5, 3.5])
+            self.assertEqual((offsets.tolist(), indices.tolist()), ([0, 3, 3, 6], [0, 1, 2, 0, 1, 2]))
+            offsets, indices = track.overlapping_batch([2.4, 0., 1.], [3.1, 0.5, 3.5], label='b')
+            self.assertEqual((offsets.tolist(), indices.tolist()), ([0, 1, 1, 2], [1, 1]))
+            offsets, indices = track.overlapping_batch([2.4], [3.1], label='unknown')
+            self.assertEqual((offsets.tolist(), indices.tolist()), ([0, 0], []))
+
+            # Overlapping intervals are read together but returned separately
+            frames = track.get_frames(audio)
+            for (start, end), interval_frames in zip(track.times, frames):
+                np.testing.assert_array_equal(interval_frames, np.arange(start, end))
+
+        # Old style tracks weren't necessarily sorted, they're sorted when read
+        with h5py.File(self.dataset_path, 'r+') as store:
+            store['audio/audio0'].create_dataset('unsorted_segments', data=np.array([[50, 80], [30, 40], [10, 20]]))
+        with VideoDataset(self.dataset_path, mode='r+') as dataset:
+            track = dataset.get_facet('audio').get_annotation_track('unsorted_segments')
+            np.testing.assert_array_equal(track.times, [[10, 20], [30, 40], [50, 80]])
+            np.testing.assert_array_equal(track.within(0.05, 0.45), [0, 1])
+            np.testing.assert_array_equal(track.overlapping(0.35, 0.6), [1, 2])
+
+        with VideoDataset(self.dataset_path, mode='r+') as dataset:
+            audio = dataset.get_facet('audio')
+            audio.add_time_intervals('words', np.array([[0, 10]]), overwrite=True)
+            self.assertIsNone(audio.get_annotation_track('words').get_labels())
+
+    def test_dataset_tracks_and_video(self):
+        with VideoDataset(self.dataset_path, mode='r+') as dataset:
+            dataset.add_annotation_track('scenes', np.array([[0.5, 1.], [0.2, 0.7], [1.5, 1.8]]),
+                                         labels=['x', 'y', 'x'])
+        with VideoDataset(self.dataset_path) as dataset:
+            self.assertNotIn('annotations', dataset.modalities)
+            self.assertEqual(dataset.get_annotation_names(), ['scenes'])
+            scenes = dataset.get_annotation_track('scenes')
+            self.assertEqual(scenes.get_labels().tolist(), ['y', 'x', 'x'])
+            intervals = list(dataset.get_time_interval_frames('scenes', 'video'))
+            self.assertEqual([times for times, frames in intervals], [(0.2, 0.7), (0.5, 1.), (1.5, 1.8)])
+            for (start, end), frames in intervals:
+                self.assertEqual(frames.shape[1:], (8, 8, 3))
+                frame_numbers = np.round(frames.mean(axis=(1, 2, 3)) / 10).astype(int)
+                np.testing.assert_array_equal(frame_numbers, np.arange(int(start * 10), int(end * 10)))
+
+    def test_iter_frame_ranges(self):
+        class CountingFacet(object):
+            def __init__(self):
+                self.reads = []
+
+            def get_frames(self, times):
+                start, end = times
+                self.reads.append((start, end))
+                return np.arange(start, end)
+
+        facet = CountingFacet()
+        ranges = np.array([[5, 10], [0, 3], [8, 12], [20, 25], [4, 4]])
+        frames = list(iter_frame_ranges(facet, ranges, max_gap=1))
+        self.assertEqual(facet.reads, [(0, 3), (5, 12), (20, 25)])
+        for (start, end), range_frames in zip(ranges, frames):
+            np.testing.assert_array_equal(range_frames, np.arange(start, end))
+
+
+if __name__ == '__main__':
+    unittest.main()
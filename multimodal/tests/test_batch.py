@@ -0,0 +1,76 @@
+import contextlib
+import io
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from multimodal.batch import get_job_key, read_manifest, run_batch
+
+
+def square_or_fail(path, power=2):
+    """
+    A job which fails for paths containing 'bad' unless the file *path* + '.fixed' exists
+    """
+    if 'bad' in path and not os.path.exists(path + '.fixed'):
+        raise ValueError("Broken file {}".format(path))
+    return len(os.path.basename(path)) ** power
+
+
+class TestRunBatch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.jobs = [os.path.join(self.directory, name) for name in ['a', 'bad', 'ccc']]
+        self.manifest_path = os.path.join(self.directory, 'manifest.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_quietly(self, *args, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return run_batch(*args, **kwargs)
+
+    def test_failures_and_manifest(self):
+        report = self.run_quietly(square_or_fail, self.jobs, manifest_path=self.manifest_path)
+        self.assertEqual((report.n_jobs, report.n_succeeded, report.n_failed, report.n_skipped), (3, 2, 1, 0))
+        key, error = report.failures[0]
+        self.assertEqual(key, self.jobs[1])
+        self.assertIn('ValueError: Broken file', error)
+        entries = read_manifest(self.manifest_path)
+        self.assertEqual({key: entry['status'] for key, entry in entries.items()},
+                         {self.jobs[0]: 'ok', self.jobs[1]: 'failed', self.jobs[2]: 'ok'})
+        self.assertIsNone(entries[self.jobs[0]]['error'])
+
+        # A rerun only retries the failed job, the last entry of a job in the manifest counts
+        open(self.jobs[1] + '.fixed', 'w').close()
+        results = dict()
+        report = self.run_quietly(square_or_fail, self.jobs, manifest_path=self.manifest_path,
+                                  callback=results.__setitem__)
+        self.assertEqual((report.n_succeeded, report.n_failed, report.n_skipped), (1, 0, 2))
+        self.assertEqual(results, {self.jobs[1]: 9})
+        self.assertEqual(read_manifest(self.manifest_path)[self.jobs[1]]['status'], 'ok')
+        self.assertEqual(self.run_quietly(square_or_fail, self.jobs, manifest_path=self.manifest_path).n_skipped, 3)
+
+    def test_callback(self):
+        for n_processes in [1, 2]:
+            results = dict()
+            jobs = [(job, 3) for job in self.jobs]
+            report = self.run_quietly(square_or_fail, jobs, n_processes=n_processes, callback=results.__setitem__)
+            self.assertEqual(report.n_processed, 3)
+            self.assertEqual(results, {self.jobs[0]: 1, self.jobs[2]: 27})
+            results = dict()
+            self.run_quietly(square_or_fail, self.jobs[::2], n_processes=n_processes, kwargs=dict(power=1),
+                             callback=results.__setitem__)
+            self.assertEqual(results, {self.jobs[0]: 1, self.jobs[2]: 3})
+
+    def test_read_manifest(self):
+        self.assertEqual(read_manifest(None), dict())
+        self.assertEqual(read_manifest(self.manifest_path), dict())
+        with open(self.manifest_path, 'w') as fp:
+            fp.write('{"key": "a", "status": "failed"}\n\n{"key": "a", "status": "ok"}\n{"key": "b", "sta')
+        self.assertEqual(read_manifest(self.manifest_path), {'a': {'key': 'a', 'status': 'ok'}})
+        self.assertEqual(get_job_key(('a', 1)), 'a')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+
+from multimodal.dataset.batching import collate, get_batch, iter_batches
+from multimodal.dataset.facet.subtitle_facet import SubtitleFacet
+from multimodal.dataset.sampling import BucketBatchSampler, EpochSampler
+from multimodal.dataset.video import VideoDataset
+from multimodal.tests.test_annotation import make_video_facet
+
+SUBRIP = """1
+00:00:00,100 --> 00:00:00,550
+First
+
+2
+00:00:00,800 --> 00:00:01,000
+Second
+
+3
+00:00:01,200 --> 00:00:01,900
+Third
+"""
+
+
+def make_subtitled_dataset(dataset_path, subrip_path, offset=0):
+    """
+    A dataset with 2 seconds of audio and video, the audio samples are numbered from offset + 1
+    """
+    with h5py.File(dataset_path, 'w') as store:
+        audio_group = store.require_group('audio').create_group('audio0')
+        audio_group.attrs['FacetHandler'] = 'AudioFacet'
+        audio_group.attrs['rate'] = 100
+        audio_group.create_dataset('sound', data=np.arange(offset + 1, offset + 201, dtype=np.int16))
+        make_video_facet(store.require_group('video'), 20, 10.)
+        SubtitleFacet.create_facet('subs', store.require_group('subtitles'), subrip_path)
+
+
+class TestBatching(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dataset_path = os.path.join(self.directory, 'dataset.h5')
+        subrip_path = os.path.join(self.directory, 'subtitles.srt')
+        with open(subrip_path, 'w') as fp:
+            fp.write(SUBRIP)
+        make_subtitled_dataset(self.dataset_path, subrip_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_same_as_items(self):
+        with VideoDataset(self.dataset_path) as dataset:
+            wrapper = dataset.get_subtitled_streams(['audio', 'video'])
+            items = [wrapper[i] for i in range(len(wrapper))]
+            for packed in (False, True):
+                batches = list(iter_batches(wrapper, 2, packed=packed))
+                self.assertEqual([len(batch.indices) for batch in batches], [2, 1])
+                batch = get_batch(wrapper, [2, 0, 1], packed=packed)
+                self.assertEqual(batch.texts, ['Third', 'First', 'Second'])
+                audio, video = batch.streams
+                np.testing.assert_array_equal(audio.lengths, [69, 45, 20])
+                np.testing.assert_array_equal(video.lengths, [6, 4, 2])
+                if packed:
+                    self.assertEqual(audio.data.shape, (134,))
+                    self.assertEqual(video.data.shape, (12, 8, 8, 3))
+                else:
+                    self.assertEqual(audio.data.shape, (3, 69))
+                    self.assertEqual(video.data.shape, (3, 6, 8, 8, 3))
+                    self.assertTrue(np.all(audio.data[1, 45:] == 0))
+                for i, j in enumerate(batch.indices):
+                    text, (item_audio, item_video) = items[j]
+                    np.testing.assert_array_equal(audio.get_sequence(i), item_audio)
+                    np.testing.assert_array_equal(video.get_sequence(i), item_video)
+
+    def test_bucket_sampler(self):
+        with VideoDataset(self.dataset_path) as dataset:
+            wrapper = dataset.get_subtitled_streams(['audio'], max_duration=0.5)
+            np.testing.assert_allclose(wrapper.get_durations(), [0.45, 0.2, 0.5], rtol=1e-6)
+            sampler = BucketBatchSampler.from_wrapper(wrapper, 2, n_buckets=2, shuffle=False)
+            batches = [batch.indices for batch in (get_batch(wrapper, indices) for indices in sampler)]
+            self.assertEqual(batches, [[1, 0], [2]])
+
+    def test_deterministic_cropping(self):
+        with VideoDataset(self.dataset_path) as dataset:
+            wrapper = dataset.get_subtitled_streams(['audio'], max_duration=0.3)
+            item_audio = dict()
+            for batch_size in (1, 2, 3):
+                sampler = EpochSampler.from_wrapper(wrapper, seed=3, epoch=2)
+                for batch in sampler.iter_batches(wrapper, batch_size):
+                    for i, item in enumerate(batch.indices):
+                        audio = batch.streams[0].get_sequence(i)
+                        self.assertLessEqual(len(audio), 30)
+                        if item in item_audio:
+                            np.testing.assert_array_equal(audio, item_audio[item])
+                        item_audio[item] = audio
+            self.assertEqual(sorted(item_audio), [0, 1, 2])
+
+    def test_collate(self):
+        sequences = [np.ones((3, 2)), np.zeros((1, 2)), np.full((2, 2), 2.)]
+        padded = collate(sequences)
+        self.assertEqual(padded.data.shape, (3, 3, 2))
+        packed = collate(sequences, packed=True)
+        np.testing.assert_array_equal(packed.offsets, [0, 3, 4, 6])
+        for i, sequence in enumerate(sequences):
+            np.testing.assert_array_equal(padded.get_sequence(i), sequence)
+            np.testing.assert_array_equal(packed.get_sequence(i), sequence)
+
+
+if __name__ == '__main__':
+    unittest.main()
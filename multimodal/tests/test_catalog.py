@@ -0,0 +1,66 @@
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import h5py
+
+from multimodal.dataset.catalog import CorpusCatalog, get_catalog_path
+from multimodal.tests.test_batching import SUBRIP, make_subtitled_dataset
+
+
+class TestCorpusCatalog(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.subrip_path = os.path.join(self.directory, 'subtitles.srt')
+        with open(self.subrip_path, 'w') as fp:
+            fp.write(SUBRIP)
+        self.dataset_paths = [os.path.join(self.directory, 'dataset{}.h5'.format(i)) for i in range(3)]
+        for dataset_path in self.dataset_paths:
+            make_subtitled_dataset(dataset_path, self.subrip_path)
+        with h5py.File(self.dataset_paths[1], 'r+') as store:
+            store['audio/audio0'].attrs['rate'] = 50
+        self.catalog_path = get_catalog_path(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_update_and_find(self):
+        with CorpusCatalog(self.catalog_path) as catalog:
+            report = catalog.update(self.dataset_paths)
+            self.assertEqual(report.n_succeeded, 3)
+            facets = catalog.get_facets(self.dataset_paths[1])
+            self.assertEqual([(facet.modality, facet.name, facet.handler) for facet in facets],
+                             [('audio', 'audio0', 'AudioFacet'), ('subtitles', 'subs', 'SubtitleFacet'),
+                              ('video', 'video1', 'VideoFacet')])
+            audio, subtitles, video = facets
+            self.assertEqual((audio.rate, audio.n_frames, audio.length_s, audio.is_default), (50., 200, 4., True))
+            self.assertEqual((video.rate, video.n_frames, video.length_s), (10., 20, 2.))
+            self.assertEqual((subtitles.n_cues, subtitles.rate), (3, None))
+            self.assertEqual(catalog.get_lengths(self.dataset_paths), {self.dataset_paths[0]: 2.,
+                                                                       self.dataset_paths[1]: 4.,
+                                                                       self.dataset_paths[2]: 2.})
+
+            self.assertEqual(catalog.find_datasets(modality='subtitles', facet='subs', min_length=3),
+                             self.dataset_paths[1:2])
+            self.assertEqual(catalog.find_datasets(handler='SubtitleFacet', min_cues=3), self.dataset_paths)
+            self.assertEqual(catalog.find_datasets(min_cues=4), [])
+            self.assertEqual(catalog.find_datasets(facet='audiodescription'), [])
+            with catalog.get_video_datasets(max_length=2) as datasets:
+                self.assertEqual(len(datasets.datasets), 2)
+                self.assertEqual(datasets.datasets[0].get_facet('audio').get_n_frames(), 200)
+
+        # Only the modified dataset is read again, and removed datasets are dropped
+        with h5py.File(self.dataset_paths[0], 'r+') as store:
+            del store['subtitles']
+        os.utime(self.dataset_paths[0], ns=(0, 0))
+        with CorpusCatalog(self.catalog_path) as catalog:
+            report = catalog.update(self.dataset_paths[:2])
+            self.assertEqual(report.n_jobs, 1)
+            self.assertEqual(catalog.find_datasets(modality='subtitles'), self.dataset_paths[1:2])
+            self.assertEqual(catalog.find_datasets(), self.dataset_paths[:2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,268 @@
+import unittest
+import numpy as np
+from multimodal.intervals import (IntervalIndex, normalize, union, intersection, difference, complement, coverage_ratio,
+                                  merge_close, remove_short, split_long, filter_overlapping_intervals, merge_intervals,
+                                  merge_annotated_intervals, limit_length)
+
+
+# The per-interval loops which the functions in multimodal.intervals used to be, kept as reference implementations
+def loop_filter_overlapping_intervals(to_be_filtered, filter_intervals, filter_coverage=0.6):
+    current_filter_interval = 0
+    current_interval = 0
+    filtered_intervals = []
+    while current_filter_interval < len(filter_intervals) and current_interval < len(to_be_filtered):
+        start, end = to_be_filtered[current_interval]
+        interval_length = end - start
+        overlap = 0
+
+        # Find all filter intevals which overlaps the current, and add their overlap
+        while current_filter_interval < len(filter_intervals):
+            filter_start, filter_end = filter_intervals[current_filter_interval]
+
+            if filter_start > end:
+                # The current filter is beyond the current interval to be filtered, we're done and the interval did not get filtered
+                break
+            elif start < filter_end:
+                # The filter overlaps the interval, accumulate the overlap
+                # it to the list
+                filter_length = filter_end - filter_start
+                filter_overlap = (filter_length -
+                           (max(0, start - filter_start) +  # This is how much the filter overlaps on the "left" side of the interval
+                            max(0, filter_end - end)))      # This is how much the filter overlaps on the "right" side of the interval
+                overlap += filter_overlap
+            if end < filter_end:
+                # This was the last filter which applied to the current interval, go on to the next interval but keep
+                # this filter
+                break
+            current_filter_interval += 1
+        if overlap/interval_length < filter_coverage:
+            filtered_intervals.append((start, end))
+        current_interval += 1
+    return np.array(filtered_intervals)
+
+
+def loop_merge_intervals(intervals, merge_duration):
+    if len(intervals) < 2:
+        return intervals
+    merged_intervals = []
+    previous_start, previous_end = intervals[0]
+    for i in range(1, len(intervals)):
+        start, end = intervals[i]
+        if start < previous_end + merge_duration:
+            previous_end = end
+        else:
+            merged_intervals.append([previous_start, previous_end])
+            previous_start, previous_end = start, end
+    merged_intervals.append([previous_start, previous_end])
+    return np.array(merged_intervals)
+
+
+def loop_merge_annotated_intervals(intervals, min_overlap=0):
+    if len(intervals) < 2:
+        return intervals
+    merged_intervals = []
+    previous_start, previous_end, *data = intervals[0]
+    data_values = [[x] for x in data]
+
+    for start, end, *data in intervals[1:]:
+        if start < previous_end + min_overlap:
+            previous_end = end
+            for i, x in enumerate(data):
+                data_values[i].append(x)
+        else:
+            merged_intervals.append([previous_start, previous_end, *data_values])
+            previous_start, previous_end = start, end
+            data_values = [[x] for x in data]
+    merged_intervals.append([previous_start, previous_end, *data_values])
+    return merged_intervals
+
+
+def loop_limit_length(intervals, length_limit):
+    for start, end in intervals:
+        interval_length = end - start
+        if interval_length >= length_limit:
+            # We divide the samples as evenly as possible among the windows
+            num_sub_intervals = int(np.ceil(interval_length/length_limit))
+            sub_interval_length = int(np.ceil(interval_length/num_sub_intervals))
+            # The first num_sub_intervals - 1 are the same length
+            for i in range(num_sub_intervals - 1):
+                sub_start = i*sub_interval_length
+                sub_end = sub_start + sub_interval_length
+                yield (start + sub_start, start + sub_end)
+            # We let the remaining sub-interval take care of uneven lengths
+            sub_start = (num_sub_intervals-1)*sub_interval_length
+            yield start + sub_start, end
+        else:
+            yield start, end
+
+
+def make_intervals(rng, n, disjoint):
+    if disjoint:
+        boundaries = np.cumsum(rng.uniform(0.1, 5, size=2*n))
+        return boundaries.reshape(n, 2)
+    starts = rng.uniform(0, 100, size=n)
+    return np.stack([starts, starts + rng.uniform(0.3, 10, size=n)], axis=1)
+
+
+def make_grid_intervals(rng, n):
+    """
+    Random, possibly empty or overlapping, intervals with integer endpoints in [0, 100]
+    """
+    starts = rng.randint(0, 100, size=n)
+    return np.stack([starts, np.minimum(starts + rng.randint(-2, 15, size=n), 100)], axis=1)
+
+
+def grid_mask(intervals):
+    """
+    Membership of the points 0.5, 1.5, ..., 99.5 in the intervals
+    """
+    points = np.arange(100) + 0.5
+    return np.any((intervals[:, :1] <= points) & (intervals[:, 1:] > points), axis=0)
+
+
+def make_segmentation(rng, n, scale, dtype):
+    """
+    Time-sorted disjoint intervals, like the voiced segments or merged subtitles of a file in samples
+    """
+    boundaries = np.cumsum(rng.randint(1, scale, size=2*n))
+    return boundaries.reshape(n, 2).astype(dtype)
+
+
+def make_touching_segmentation(rng, n, scale, dtype):
+    """
+    Time-sorted disjoint intervals where about a third of the intervals start where the previous one ends
+    """
+    lengths = rng.randint(1, scale, size=n)
+    gaps = np.where(rng.uniform(size=n) < 1 / 3, 0, rng.randint(1, scale, size=n))
+    starts = np.cumsum(gaps + np.append(0, lengths[:-1]))
+    return np.stack([starts, starts + lengths], axis=1).astype(dtype)
+
+
+class TestIntervalAlgebra(unittest.TestCase):
+    def assert_disjoint_sorted(self, intervals):
+        self.assertTrue(np.all(intervals[:, 1] > intervals[:, 0]))
+        self.assertTrue(np.all(intervals[1:, 0] > intervals[:-1, 1]))
+
+    def test_set_operations_match_masks(self):
+        rng = np.random.RandomState(1729)
+        for i in range(100):
+            a = make_grid_intervals(rng, rng.randint(0, 20))
+            b = make_grid_intervals(rng, rng.randint(0, 20))
+            in_a, in_b = grid_mask(a), grid_mask(b)
+            for result, expected in ((union(a, b), in_a | in_b),
+                                     (intersection(a, b), in_a & in_b),
+                                     (difference(a, b), in_a & ~in_b),
+                                     (complement(a, 10, 90), ~in_a & (np.arange(100) >= 10) & (np.arange(100) < 90))):
+                self.assert_disjoint_sorted(result)
+                np.testing.assert_array_equal(grid_mask(result), expected)
+
+            non_empty = a[a[:, 1] > a[:, 0]]
+            expected_ratios = [np.mean(in_b[start:end]) for start, end in non_empty]
+            np.testing.assert_allclose(coverage_ratio(non_empty, b), expected_ratios)
+
+    def test_merge_trim_split(self):
+        intervals = np.array([[0., 1.], [1.5, 2.], [4., 10.], [9., 10.5]])
+        np.testing.assert_array_equal(merge_close(intervals, 0.6), [[0., 2.], [4., 10.5]])
+        np.testing.assert_array_equal(merge_close(intervals, 0.5), [[0., 1.], [1.5, 2.], [4., 10.5]])
+        np.testing.assert_array_equal(remove_short(intervals, 1), [[4., 10.], [9., 10.5]])
+        np.testing.assert_array_equal(split_long(intervals, 2), [[0., 1.], [1.5, 2.], [4., 6.], [6., 8.], [8., 10.],
+                                                                 [9., 10.5]])
+        self.assertEqual(split_long(np.zeros((0, 2)), 1).shape, (0, 2))
+
+
+class TestLoopEquivalence(unittest.TestCase):
+    def test_filter_overlapping_intervals(self):
+        rng = np.random.RandomState(1729)
+        for i in range(50):
+            voiced = make_segmentation(rng, rng.randint(1, 200), 2000, np.int64)
+            subtitled = make_segmentation(rng, rng.randint(1, 100), 4000, np.uint64)
+            for coverage in (0., 0.3, 0.7, 1.):
+                expected = loop_filter_overlapping_intervals(voiced, subtitled, coverage)
+                filtered = filter_overlapping_intervals(voiced, subtitled, coverage)
+                np.testing.assert_array_equal(filtered, expected.reshape(-1, 2))
+
+    def test_filter_touching_intervals(self):
+        rng = np.random.RandomState(1729)
+        for i in range(200):
+            voiced = make_touching_segmentation(rng, rng.randint(1, 50), 200, np.int64)
+            subtitled = make_touching_segmentation(rng, rng.randint(1, 30), 400, np.uint64)
+            for coverage in (0., 0.3, 0.7, 1.):
+                expected = loop_filter_overlapping_intervals(voiced, subtitled, coverage)
+                filtered = filter_overlapping_intervals(voiced, subtitled, coverage)
+                np.testing.assert_array_equal(filtered, expected.reshape(-1, 2))
+
+    def test_filter_overlapping_input(self):
+        # The loop compares each interval to one filter interval at a time, which isn't the same as the coverage by
+        # all of them once the intervals overlap, so overlapping input is rejected instead of silently filtered
+        # differently
+        with self.assertRaises(ValueError):
+            filter_overlapping_intervals([[0, 10], [2, 3], [20, 30]], [[1, 4], [25, 40]], 0.6)
+        with self.assertRaises(ValueError):
+            filter_overlapping_intervals([[0, 10], [20, 30]], [[1, 4], [2, 8], [25, 40]], 0.6)
+        with self.assertRaises(ValueError):
+            filter_overlapping_intervals([[20, 30], [0, 10]], [[1, 4]], 0.6)
+        np.testing.assert_array_equal(
+            filter_overlapping_intervals([[0, 10], [20, 30]], normalize([[1, 4], [2, 8], [25, 40]]), 0.6),
+            [[20, 30]])
+        np.testing.assert_array_equal(
+            filter_overlapping_intervals(normalize([[0, 10], [2, 3], [20, 30]]), [[1, 4], [25, 40]], 0.6),
+            [[0, 10], [20, 30]])
+
+    def test_merge_intervals(self):
+        rng = np.random.RandomState(1729)
+        for i in range(50):
+            starts = np.sort(rng.randint(0, 10000, size=rng.randint(0, 100)))
+            intervals = np.stack([starts, starts + rng.randint(1, 500, size=len(starts))], axis=1)
+            for merge_duration in (-10, 0, 100):
+                np.testing.assert_array_equal(merge_intervals(intervals, merge_duration),
+                                              loop_merge_intervals(intervals, merge_duration))
+                words = [[float(start) / 100, float(end) / 100, 'word{}'.format(j)]
+                         for j, (start, end) in enumerate(intervals)]
+                self.assertEqual(merge_annotated_intervals(words, merge_duration / 100),
+                                 loop_merge_annotated_intervals(words, merge_duration / 100))
+
+    def test_limit_length(self):
+        rng = np.random.RandomState(1729)
+        for dtype in (np.int64, np.float64):
+            intervals = make_segmentation(rng, 500, 3000, dtype)
+            for length_limit in (1, 50, 333.3, 2000):
+                self.assertEqual([tuple(piece) for piece in limit_length(intervals, length_limit)],
+                                 [tuple(piece) for piece in loop_limit_length(intervals, length_limit)])
+
+
+class TestIntervalIndex(unittest.TestCase):
+    def test_queries_match_brute_force(self):
+        rng = np.random.RandomState(1729)
+        for disjoint in (True, False):
+            intervals = make_intervals(rng, 200, disjoint)
+            index = IntervalIndex(intervals)
+            self.assertEqual(index.is_disjoint, disjoint)
+
+            query_starts = rng.uniform(-5, 120, size=100)
+            query_ends = query_starts + rng.uniform(0, 20, size=100)
+            offsets, indices = index.overlapping_batch(query_starts, query_ends)
+            counts = index.count_overlapping(query_starts, query_ends)
+            for i, (start, end) in enumerate(zip(query_starts, query_ends)):
+                expected = np.flatnonzero((intervals[:, 0] < end) & (intervals[:, 1] > start))
+                np.testing.assert_array_equal(np.sort(index.overlapping(start, end)), expected)
+                np.testing.assert_array_equal(np.sort(indices[offsets[i]:offsets[i+1]]), expected)
+                self.assertEqual(counts[i], len(expected))
+
+            timestamps = rng.uniform(-5, 120, size=1000)
+            active = index.active_at(timestamps)
+            for t, found in zip(timestamps, active):
+                containing = np.flatnonzero((intervals[:, 0] <= t) & (intervals[:, 1] > t))
+                if len(containing) == 0:
+                    self.assertEqual(found, -1)
+                else:
+                    self.assertIn(found, containing)
+                    self.assertEqual(intervals[found, 0], intervals[containing, 0].max())
+
+    def test_empty(self):
+        index = IntervalIndex(np.zeros((0, 2)))
+        self.assertEqual(len(index.overlapping(0, 1)), 0)
+        np.testing.assert_array_equal(index.active_at([0., 1.]), [-1, -1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import time
+import unittest
+
+from multimodal.dataset.prefetch import PrefetchIterator, prefetch
+
+
+class SlowWrapper(object):
+    """
+    Items which take longer to load the lower their index, so they are finished out of order
+    """
+    def __init__(self, n_items, delay):
+        self.n_items = n_items
+        self.delay = delay
+
+    def __len__(self):
+        return self.n_items
+
+    def __getitem__(self, item):
+        if item == 13:
+            raise ValueError("Broken item")
+        time.sleep(self.delay * (self.n_items - item) / self.n_items)
+        return item * 2
+
+
+class TestPrefetch(unittest.TestCase):
+    def test_order_and_stats(self):
+        wrapper = SlowWrapper(10, 0.02)
+        with PrefetchIterator(wrapper, depth=4, n_workers=4) as iterator:
+            items = list(iterator)
+            self.assertEqual(items, [2 * i for i in range(10)])
+        stats = iterator.stats
+        self.assertEqual(stats.n_items, 10)
+        self.assertGreater(stats.n_stalls, 0)
+        self.assertGreater(stats.load_time, stats.stall_time)
+        self.assertIn('10 items', stats.format_summary())
+
+        # A slow consumer never has to wait once the first items are loaded
+        with PrefetchIterator(wrapper, indices=[9, 8, 7, 6], depth=2, n_workers=2) as iterator:
+            time.sleep(0.05)
+            for item in iterator:
+                time.sleep(0.02)
+        self.assertEqual(iterator.stats.n_stalls, 0)
+        self.assertEqual(iterator.stats.get_suggested_workers(), 1)
+
+    def test_errors_and_processes(self):
+        with self.assertRaises(ValueError):
+            list(prefetch(SlowWrapper(20, 0.), n_workers=2))
+        items = list(prefetch(list(range(5)), indices=[4, 0, 3], n_workers=2, processes=True))
+        self.assertEqual(items, [4, 0, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
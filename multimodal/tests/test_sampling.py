@@ -0,0 +1,163 @@
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+
+from multimodal.dataset.sampling import (BucketBatchSampler, EpochSampler, RandomWindowSampler, block_shuffle,
+                                         build_alias_table, draw_alias, get_item_uniforms, get_padding_efficiency,
+                                         permute_positions)
+from multimodal.dataset.video import VideoDataset, VideoDatasets, WrapperCollection
+from multimodal.tests.test_annotation import make_video_facet
+
+
+class TestBucketBatchSampler(unittest.TestCase):
+    def setUp(self):
+        self.durations = np.random.RandomState(1729).uniform(0.3, 10, size=5000)
+
+    def test_batches(self):
+        sampler = BucketBatchSampler(self.durations, 32, n_buckets=20, rng=np.random.RandomState(1))
+        epochs = [list(sampler), list(sampler)]
+        for batches in epochs:
+            self.assertEqual(len(batches), len(sampler))
+            self.assertTrue(all(len(batch) <= 32 for batch in batches))
+            np.testing.assert_array_equal(np.sort(np.concatenate(batches)), np.arange(len(self.durations)))
+        self.assertNotEqual(epochs[0], epochs[1])
+
+        efficiency = sampler.get_padding_efficiency()
+        random_efficiency = sampler.get_random_padding_efficiency(np.random.RandomState(2))
+        self.assertGreater(efficiency, 0.95)
+        self.assertLess(random_efficiency, 0.6)
+
+        limits = sampler.get_bucket_limits()
+        self.assertEqual(limits.shape, (20, 2))
+        self.assertTrue(np.all(limits[1:, 0] >= limits[:-1, 1]))
+
+    def test_drop_last_and_order(self):
+        sampler = BucketBatchSampler(self.durations[:100], 8, n_buckets=3, shuffle=False, drop_last=True)
+        batches = list(sampler)
+        self.assertEqual(len(batches), len(sampler))
+        self.assertEqual(len(batches), 33 // 8 + 33 // 8 + 34 // 8)
+        self.assertTrue(all(len(batch) == 8 for batch in batches))
+        batch_durations = [self.durations[batch] for batch in batches]
+        self.assertTrue(all(a.max() <= b.min() for a, b in zip(batch_durations, batch_durations[1:])))
+
+    def test_padding_efficiency(self):
+        self.assertEqual(get_padding_efficiency([1., 2., 4.], [[0, 1], [2]]), 7. / 8.)
+        self.assertEqual(get_padding_efficiency([1., 2.], []), 1.)
+
+
+class TestBlockShuffle(unittest.TestCase):
+    def test_collection_lookup(self):
+        wrappers = [list(range(0, 3)), [], list(range(10, 15)), list(range(20, 22))]
+        collection = WrapperCollection(wrappers)
+        items = sum(wrappers, [])
+        self.assertEqual(len(collection), len(items))
+        self.assertEqual([collection[i] for i in range(len(items))], items)
+        self.assertEqual([collection[i] for i in range(-len(items), 0)], items)
+        self.assertEqual(list(collection[2:9:2]), items[2:9:2])
+        self.assertEqual(collection.locate(3), (2, 0))
+        wrapper_ids, wrapper_items = collection.locate_batch([0, 7, -1])
+        np.testing.assert_array_equal(wrapper_ids, [0, 2, 3])
+        np.testing.assert_array_equal(wrapper_items, [0, 4, 1])
+        with self.assertRaises(IndexError):
+            collection[len(items)]
+
+    def test_block_shuffle(self):
+        rng = np.random.RandomState(1729)
+        group_lengths = rng.randint(0, 50, size=200)
+        group_ids = np.repeat(np.arange(len(group_lengths)), group_lengths)
+        buffer_size = 64
+        epochs = [block_shuffle(group_lengths, buffer_size, rng) for i in range(2)]
+        for indices in epochs:
+            np.testing.assert_array_equal(np.sort(indices), np.arange(len(group_ids)))
+            # The groups are shorter than the buffer, so all items of a group are within two consecutive windows
+            first_visit = np.unique(group_ids[indices], return_index=True)[1]
+            last_visit = len(indices) - 1 - np.unique(group_ids[indices[::-1]], return_index=True)[1]
+            self.assertLess(np.max(last_visit - first_visit), 2 * buffer_size)
+        self.assertFalse(np.array_equal(epochs[0], epochs[1]))
+
+
+class TestEpochSampler(unittest.TestCase):
+    def test_permutation(self):
+        for n_items in (1, 2, 7, 64, 1000):
+            items = permute_positions(np.arange(n_items), n_items, 1729, 0)
+            np.testing.assert_array_equal(np.sort(items), np.arange(n_items))
+            np.testing.assert_array_equal(permute_positions(np.arange(5, n_items), n_items, 1729, 0), items[5:])
+        self.assertFalse(np.array_equal(permute_positions(np.arange(1000), 1000, 1729, 1), items))
+
+        uniforms = get_item_uniforms(1, 2, np.arange(10000))
+        self.assertTrue(np.all((uniforms >= 0) & (uniforms < 1)))
+        self.assertAlmostEqual(uniforms.mean(), 0.5, places=1)
+        np.testing.assert_array_equal(get_item_uniforms(1, 2, [17, 3]), uniforms[[17, 3]])
+
+    def test_resume(self):
+        sampler = EpochSampler(10, seed=5)
+        batches = sampler.iter_batch_items(3)
+        first_batches = [next(batches), next(batches)]
+        state = sampler.get_state()
+        rest = list(batches)
+        self.assertEqual(sampler.epoch, 1)
+        np.testing.assert_array_equal(np.sort(np.concatenate(first_batches + rest)), np.arange(10))
+
+        resumed = EpochSampler(10)
+        resumed.set_state(state)
+        resumed_rest = list(resumed.iter_batch_items(3))
+        self.assertEqual(len(resumed_rest), len(rest))
+        for batch, resumed_batch in zip(rest, resumed_rest):
+            np.testing.assert_array_equal(batch, resumed_batch)
+        self.assertEqual(list(resumed), list(EpochSampler(10, seed=5, epoch=1)))
+        with self.assertRaises(ValueError):
+            EpochSampler(11).set_state(state)
+
+
+class TestRandomWindowSampler(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dataset_paths = []
+        # Datasets with 1, 1.5 and 2.5 seconds of audio and video
+        for i, n_frames in enumerate([10, 15, 25]):
+            dataset_path = os.path.join(self.directory, 'dataset{}.h5'.format(i))
+            with h5py.File(dataset_path, 'w') as store:
+                audio_group = store.require_group('audio').create_group('audio0')
+                audio_group.attrs['FacetHandler'] = 'AudioFacet'
+                audio_group.attrs['rate'] = 100
+                audio_group.create_dataset('sound', data=np.arange(10 * n_frames, dtype=np.int16) + 1000 * i)
+                make_video_facet(store.require_group('video'), n_frames, 10.)
+            self.dataset_paths.append(dataset_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_alias_table(self):
+        weights = np.array([0., 1., 2., 7., 0.5])
+        probabilities, aliases = build_alias_table(weights)
+        counts = np.bincount(draw_alias(probabilities, aliases, 200000, np.random.RandomState(1)), minlength=5)
+        np.testing.assert_allclose(counts / 200000, weights / weights.sum(), atol=0.005)
+        with self.assertRaises(ValueError):
+            build_alias_table([0., 0.])
+
+    def test_windows(self):
+        with VideoDatasets(self.dataset_paths) as datasets:
+            sampler = RandomWindowSampler(datasets, ['audio', 'video'], 0.5, rng=np.random.RandomState(2))
+            self.assertEqual(sampler.window_frames, [50, 5])
+            self.assertEqual(sampler.get_total_length(), 5.)
+            # The windows can start in the first 0.5, 1 and 2 seconds of the datasets
+            dataset_ids, starts = sampler.draw(100000)
+            np.testing.assert_allclose(np.bincount(dataset_ids) / 100000, np.array([0.5, 1., 2.]) / 3.5, atol=0.01)
+            self.assertTrue(np.all(starts <= sampler.start_ranges[dataset_ids]))
+
+            batch = sampler.get_batch(16)
+            self.assertEqual(batch.streams[0].shape, (16, 50))
+            self.assertEqual(batch.streams[1].shape, (16, 5, 8, 8, 3))
+            for dataset_id, (start, end), audio, video in zip(batch.datasets, batch.times, *batch.streams):
+                start_sample = int(start * 100)
+                np.testing.assert_array_equal(audio, np.arange(start_sample, start_sample + 50) + 1000 * dataset_id)
+                frame_numbers = np.round(video.mean(axis=(1, 2, 3)) / 10).astype(int)
+                np.testing.assert_array_equal(frame_numbers, np.arange(int(start * 10), int(start * 10) + 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
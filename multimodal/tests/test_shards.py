@@ -0,0 +1,66 @@
+import os.path
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from multimodal.dataset.shards import Shard, ShardedDataset, export_dataset, export_wrapper, write_index
+from multimodal.dataset.video import SubtitlesComplementAndStreamsWrapper, VideoDataset
+from multimodal.tests.test_batching import SUBRIP, make_subtitled_dataset
+
+
+class TestShards(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        subrip_path = os.path.join(self.directory, 'subtitles.srt')
+        with open(subrip_path, 'w') as fp:
+            fp.write(SUBRIP)
+        self.dataset_paths = [os.path.join(self.directory, 'dataset{}.h5'.format(i)) for i in range(2)]
+        for i, dataset_path in enumerate(self.dataset_paths):
+            make_subtitled_dataset(dataset_path, subrip_path, offset=1000 * i)
+        self.output_directory = os.path.join(self.directory, 'shards')
+        os.makedirs(self.output_directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_export(self):
+        expected_items = []
+        for dataset_path in self.dataset_paths:
+            with VideoDataset(dataset_path) as dataset:
+                wrapper = dataset.get_subtitled_streams(['audio', 'video'])
+                expected_items.extend(wrapper[i] for i in range(len(wrapper)))
+            # The audio and video of an item is 0.4-1.3kB, so the first shard has two items
+            n_items = export_dataset(dataset_path, self.output_directory, ['audio', 'video'], shard_bytes=1200)
+            self.assertEqual(n_items, 3)
+        index = write_index(self.output_directory, self.dataset_paths + ['missing.h5'])
+        self.assertEqual(index['datasets'], self.dataset_paths)
+        self.assertEqual([shard['n_items'] for shard in index['shards']], [2, 1, 2, 1])
+
+        sharded = pickle.loads(pickle.dumps(ShardedDataset(self.output_directory)))
+        self.assertEqual(len(sharded), 6)
+        self.assertEqual([stream['rate'] for stream in sharded.streams], [100., 10.])
+        self.assertIsInstance(sharded.get_shard(0).streams[1].data, np.memmap)
+        for items in (list(sharded), [sharded[i] for i in range(len(sharded))]):
+            for (text, frames), (expected_text, expected_frames) in zip(items, expected_items):
+                self.assertEqual(text, expected_text)
+                for stream_frames, expected_stream_frames in zip(frames, expected_frames):
+                    np.testing.assert_array_equal(stream_frames, expected_stream_frames)
+
+    def test_complement(self):
+        with VideoDataset(self.dataset_paths[0]) as dataset:
+            wrapper = SubtitlesComplementAndStreamsWrapper(subtitles=dataset.get_facet('subtitles'),
+                                                           streams=[dataset.get_facet('audio')], minimum_time=0.1)
+            expected_items = list(wrapper)
+            shard_descriptions = export_wrapper(wrapper, os.path.join(self.output_directory, 'complement'))
+        self.assertEqual(len(expected_items), 2)
+        shard = Shard(os.path.join(self.output_directory, shard_descriptions[0]['path']), shard_descriptions[0])
+        for (text, (audio,)), (expected_audio,) in zip(shard, expected_items):
+            self.assertIsNone(text)
+            np.testing.assert_array_equal(audio, expected_audio)
+
+
+if __name__ == '__main__':
+    unittest.main()
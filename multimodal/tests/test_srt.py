@@ -0,0 +1,112 @@
+import io
+import random
+import unittest
+from datetime import timedelta
+
+import numpy as np
+
+import multimodal.srt as srt
+
+SAMPLES = [
+    "1\n00:00:01,000 --> 00:00:02,500\nHello\n\n2\n00:00:03.000 --> 00:00:04,000 X:1\nSecond\n"
+    "3\n00:00:05,000 --> 00:00:06,000\nthird\n\n\n",
+    "\n\n  1\r\n00:00:01,000 --> 00:00:02,500\r\nHello\r\nworld\r\n\r\n2\r\n00:00:03,000 --> 00:00:04,000\r\n\r\n"
+    "3\r\n00:00:05,000 --> 00:00:06,000\r\nx",
+    "1\n00:00:01,000 --> 00:00:02,500\nblank\n\ninside\n\n2\n00:00:03,000 --> 00:00:04,000\n",
+    "1\n100:00:05,000 --> 100:00:06,123\nB",
+    "",
+]
+
+
+def make_random_sample(rng):
+    parts = []
+    for i in range(rng.randint(0, 8)):
+        eol = rng.choice(["\n", "\r\n"])
+        content = eol.join(rng.choice(["a", "bb c", "", "<b>d</b>", " "]) for _ in range(rng.randint(0, 3)))
+        separator = rng.choice([eol, eol * 2, eol * 3])
+        parts.append("{}{}{:02d}:{:02d}:{:02d},{:03d} --> {:02d}:{:02d}:{:02d}{}{:03d}{}{}{}{}".format(
+            i + 1, eol, rng.randint(0, 99), rng.randint(0, 59), rng.randint(0, 59), rng.randint(0, 999),
+            rng.randint(0, 99), rng.randint(0, 59), rng.randint(0, 59), rng.choice(",."), rng.randint(0, 999),
+            rng.choice(["", " X1:2"]), eol, content, separator))
+    return rng.choice(["", "\n", " "]) + "".join(parts)
+
+
+def parse_reference(text):
+    try:
+        subtitles = list(srt.parse(text))
+    except srt.SRTParseError:
+        return srt.SRTParseError
+    return ([subtitle.index for subtitle in subtitles],
+            [(subtitle.start.total_seconds(), subtitle.end.total_seconds()) for subtitle in subtitles],
+            [subtitle.content for subtitle in subtitles],
+            [subtitle.proprietary for subtitle in subtitles])
+
+
+def parse_arrays_to_lists(parse_function, *args, **kwargs):
+    try:
+        arrays = parse_function(*args, **kwargs)
+    except srt.SRTParseError:
+        return srt.SRTParseError
+    return (arrays.index.tolist(), [tuple(times) for times in arrays.times.tolist()], arrays.get_contents(),
+            arrays.proprietary)
+
+
+def stream_parse(text, chunk_size):
+    return srt.concatenate_arrays(srt.iter_parse_arrays(io.StringIO(text), chunk_size=chunk_size))
+
+
+class TestParseArrays(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(1729)
+        self.samples = SAMPLES + [make_random_sample(rng) for i in range(200)]
+
+    def test_same_as_parse(self):
+        for text in self.samples:
+            self.assertEqual(parse_arrays_to_lists(srt.parse_arrays, text), parse_reference(text), repr(text))
+
+    def test_streaming(self):
+        for text in self.samples:
+            expected = parse_reference(text)
+            for chunk_size in (1, 7, 50, 1000):
+                parsed = parse_arrays_to_lists(stream_parse, text, chunk_size)
+                self.assertEqual(parsed, expected, repr(text))
+
+    def test_errors(self):
+        for text in ("garbage\n\n1\n00:00:01,000 --> 00:00:02,000\nx\n", "  \n "):
+            with self.assertRaises(srt.SRTParseError):
+                srt.parse_arrays(text)
+            with self.assertRaises(srt.SRTParseError):
+                stream_parse(text, 3)
+
+    def test_skip_invalid(self):
+        text = ("1\n00:00:01,000 --> 00:00:02,000\nkept\n\n2\n00:00:03,000 --> 00:00:03,000\nsame time\n\n"
+                "3\n00:00:04,000 --> 00:00:05,000\n\n\n")
+        arrays = srt.parse_arrays(text, skip_invalid=True)
+        self.assertEqual(arrays.index.tolist(), [1])
+        self.assertEqual(arrays.get_contents(), ['kept'])
+
+
+class TestComposeArrays(unittest.TestCase):
+    def test_same_as_compose(self):
+        rng = np.random.RandomState(1729)
+        for i in range(50):
+            n = rng.randint(0, 30)
+            times = np.round(rng.uniform(-1, 400000 if i % 2 else 100, size=(n, 2)), rng.choice([3, 6]))
+            if i % 3 == 0:
+                times = times.astype(np.float32)
+            times[:n // 3, 1] = times[:n // 3, 0]
+            contents = [str(rng.choice(['a', '', '  ', '\nx\n\ny\n', 'b\nc', '<i>q</i>'])) for j in range(n)]
+            subtitles = [srt.Subtitle(j + 1, timedelta(seconds=float(start)), timedelta(seconds=float(end)), content)
+                         for j, ((start, end), content) in enumerate(zip(times, contents))]
+            for eol in (None, '\r\n'):
+                for strict in (True, False):
+                    expected = srt.compose(subtitles, strict=strict, eol=eol)
+                    self.assertEqual(srt.compose_arrays(times, contents, strict=strict, eol=eol, block_size=7),
+                                     expected)
+                    fp = io.StringIO()
+                    srt.compose_arrays(times, contents, fp=fp, strict=strict, eol=eol)
+                    self.assertEqual(fp.getvalue(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
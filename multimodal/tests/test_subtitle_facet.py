@@ -0,0 +1,101 @@
+import os.path
+import random
+import shutil
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+
+from multimodal.dataset.facet.subtitle_facet import SubtitleFacet, PackedStrings, SubtitleParser, parse_subtitle_markup
+from multimodal.dataset.multimodal import MultiModalDataset
+
+SUBRIP = """1
+00:00:01,000 --> 00:00:02,500
+<font color="#ffff00">Hello</font> <i>wörld</i>
+
+2
+00:00:03,000 --> 00:00:04,000
+Second &amp; last
+"""
+
+MARKUP_PIECES = ['<b>', '</b>', '<i>', '</I>', '<U>', '</u>', '<font color="#ff00aa">', '</font>',
+                 "<font color='#00FF00'>", 'text', 'x y', '\n', '&amp;', '&', 'a & b', '&lt;3', '<', '<br>', '<b', '&am',
+                 '<!-- c -->', '<script>', '</script>', '>', 'é']
+
+
+def parse_markup_reference(contents):
+    parser = SubtitleParser()
+    strings, colors, styles, string_index = [], [], [], []
+    for content in contents:
+        parser.wipe()
+        parser.feed(content)
+        string_index.append((len(strings), len(strings) + len(parser.strings)))
+        strings.extend(parser.strings)
+        colors.extend(parser.colors)
+        styles.extend((style['b'], style['i'], style['u']) for style in parser.attributes)
+    return strings, colors, styles, string_index
+
+
+class TestSubtitleMarkup(unittest.TestCase):
+    def test_same_as_html_parser(self):
+        rng = random.Random(1729)
+        for i in range(1000):
+            contents = [''.join(rng.choice(MARKUP_PIECES) for j in range(rng.randint(0, 6)))
+                        for k in range(rng.randint(0, 6))]
+            offsets = np.cumsum([0] + [len(content) for content in contents])
+            strings, colors, styles, string_index = parse_subtitle_markup(''.join(contents), offsets)
+            self.assertEqual((strings, [tuple(color) for color in colors.tolist()],
+                              [tuple(style) for style in styles.tolist()],
+                              [tuple(index) for index in string_index.tolist()]),
+                             parse_markup_reference(contents), repr(contents))
+
+
+class TestSubtitleFacet(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.subrip_path = os.path.join(self.directory, 'subtitles.srt')
+        with open(self.subrip_path, 'w') as fp:
+            fp.write(SUBRIP)
+        self.store = h5py.File(os.path.join(self.directory, 'dataset.h5'), 'w')
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_packed_and_vlen_strings(self):
+        modality = self.store.require_group('subtitles')
+        packed = SubtitleFacet.create_facet('packed', modality, self.subrip_path)
+        vlen = SubtitleFacet.create_facet('vlen', modality, self.subrip_path, packed_strings=False)
+        self.assertIsInstance(packed.strings, PackedStrings)
+        self.assertEqual(list(packed.strings), list(vlen.strings))
+        self.assertEqual(list(packed.strings), ['Hello', ' ', 'wörld', 'Second & last'])
+        for facet in (packed, vlen):
+            time, text = facet[0]
+            np.testing.assert_allclose(time, [1., 2.5])
+            self.assertEqual(text, 'Hello\n \nwörld')
+            self.assertEqual([text for time, text in facet[1:]], ['Second & last'])
+
+    def test_subrip_texts(self):
+        facet = SubtitleFacet.create_facet('packed', self.store.require_group('subtitles'), self.subrip_path)
+        self.assertEqual(facet.get_subrip_texts(),
+                         '1\n00:00:01,000 --> 00:00:02,500\n<font color="#ffff00">Hello</font>\n \n<i>wörld</i>\n\n'
+                         '2\n00:00:03,000 --> 00:00:04,000\nSecond & last\n\n')
+
+    def test_lazy_attributes(self):
+        SubtitleFacet.create_facet('packed', self.store.require_group('subtitles'), self.subrip_path)
+        self.store.close()
+        lazy_attributes = ['times', 'strings', 'string_index', 'string_styles', 'string_colors']
+        with MultiModalDataset(os.path.join(self.directory, 'dataset.h5')) as dataset:
+            facet = dataset.get_facet('subtitles')
+            # Opening the dataset and the facet reads no subtitle arrays
+            self.assertEqual([name for name in lazy_attributes if name in vars(facet)], [])
+            np.testing.assert_allclose(facet.times, [[1., 2.5], [3., 4.]])
+            self.assertEqual([name for name in lazy_attributes if name in vars(facet)], ['times'])
+            self.assertEqual(facet[1][1], 'Second & last')
+            self.assertEqual([name for name in lazy_attributes if name in vars(facet)],
+                             ['times', 'strings', 'string_index'])
+
+
+if __name__ == '__main__':
+    unittest.main()
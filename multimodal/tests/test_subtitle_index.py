@@ -0,0 +1,68 @@
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import h5py
+
+from multimodal.dataset.facet.subtitle_facet import SubtitleFacet
+from multimodal.dataset.subtitle_index import SubtitleIndex
+
+SUBRIP = """1
+00:00:01,000 --> 00:00:02,500
+The <i>quick</i> brown fox
+
+2
+00:00:03,000 --> 00:00:04,000
+Jumps over the lazy dog's tail
+"""
+
+
+class TestSubtitleIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dataset_paths = [self.make_dataset('a', SUBRIP), self.make_dataset('b', SUBRIP.replace('fox', 'cat'))]
+        self.index_path = os.path.join(self.directory, 'index.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_dataset(self, name, subrip):
+        subrip_path = os.path.join(self.directory, name + '.srt')
+        with open(subrip_path, 'w') as fp:
+            fp.write(subrip)
+        dataset_path = os.path.join(self.directory, name + '.h5')
+        with h5py.File(dataset_path, 'w') as store:
+            SubtitleFacet.create_facet('subs', store.require_group('subtitles'), subrip_path)
+        return os.path.abspath(dataset_path)
+
+    def test_query_and_update(self):
+        with SubtitleIndex(self.index_path) as index:
+            report = index.update(self.dataset_paths)
+            self.assertEqual(report.n_succeeded, 2)
+            segments = index.query('Quick')
+            self.assertEqual([(s.dataset_path, s.facet, s.cue) for s in segments],
+                             [(self.dataset_paths[0], 'subs', 0), (self.dataset_paths[1], 'subs', 0)])
+            self.assertEqual(segments[0].times.tolist(), [1., 2.5])
+            self.assertEqual(len(index.query_all(['brown', 'fox'])), 1)
+            self.assertEqual(len(index.query_all(['fox', 'dog\'s'])), 0)
+            self.assertEqual(index.query('unknown'), [])
+
+        # Only the modified dataset is reindexed, and removed datasets are dropped
+        self.make_dataset('b', SUBRIP.replace('fox', 'wolf'))
+        os.utime(self.dataset_paths[1], ns=(0, 0))
+        with SubtitleIndex(self.index_path) as index:
+            report = index.update(self.dataset_paths)
+            self.assertEqual(report.n_jobs, 1)
+            self.assertEqual(len(index.query('wolf')), 1)
+            self.assertEqual(index.query('cat'), [])
+            index.update(self.dataset_paths[:1])
+            self.assertEqual([s.dataset_path for s in index.query('quick')], self.dataset_paths[:1])
+            times = index.query_times(['lazy'])
+            self.assertEqual(list(times.keys()), [(self.dataset_paths[0], 'subs')])
+            self.assertEqual(times[(self.dataset_paths[0], 'subs')].tolist(), [[3., 4.]])
+
+
+if __name__ == '__main__':
+    unittest.main()
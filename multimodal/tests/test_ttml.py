@@ -0,0 +1,66 @@
+import io
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+
+import multimodal.ttml as ttml
+from multimodal.dataset.facet.subtitle_facet import SubtitleFacet
+
+TTML = """<?xml version="1.0" encoding="utf-8"?>
+<tt xmlns="http://www.w3.org/ns/ttml" xmlns:tts="http://www.w3.org/ns/ttml#styling"
+    xmlns:ttp="http://www.w3.org/ns/ttml#parameter" ttp:frameRate="25">
+  <head>
+    <styling>
+      <style xml:id="base" tts:color="white"/>
+      <style xml:id="emphasis" style="base" tts:fontStyle="italic"/>
+    </styling>
+  </head>
+  <body style="base">
+    <div>
+      <p begin="00:00:01.000" end="00:00:02.500">Hello
+        <span tts:color="#ffff00" tts:fontWeight="bold">wörld</span><br/>second   line</p>
+      <p begin="00:00:03:05" dur="1s"><span style="emphasis" tts:textDecoration="underline">Tom &amp; Jerry</span></p>
+    </div>
+    <div begin="10s">
+      <p begin="500ms" end="2s">Offset</p>
+    </div>
+  </body>
+</tt>
+"""
+
+
+class TestTTML(unittest.TestCase):
+    def test_parse(self):
+        paragraphs = list(ttml.iter_parse(io.BytesIO(TTML.encode('utf-8'))))
+        np.testing.assert_allclose([(p.begin, p.end) for p in paragraphs], [(1, 2.5), (3.2, 4.2), (10.5, 12)])
+        white, yellow = (255, 255, 255), (255, 255, 0)
+        self.assertEqual(paragraphs[0].fragments, [('Hello ', white, (False, False, False)),
+                                                   ('wörld', yellow, (True, False, False)),
+                                                   ('second line', white, (False, False, False))])
+        self.assertEqual(paragraphs[1].fragments, [('Tom & Jerry', white, (False, True, True))])
+        self.assertEqual(paragraphs[2].fragments, [('Offset', white, (False, False, False))])
+
+    def test_create_facet(self):
+        directory = tempfile.mkdtemp()
+        try:
+            ttml_path = os.path.join(directory, 'subtitles.ttml')
+            with open(ttml_path, 'w', encoding='utf-8') as fp:
+                fp.write(TTML)
+            with h5py.File(os.path.join(directory, 'dataset.h5'), 'w') as store:
+                facet = SubtitleFacet.create_facet('ttml', store.require_group('subtitles'), ttml_path)
+                self.assertEqual(len(facet), 3)
+                time, text = facet[0]
+                np.testing.assert_allclose(time, [1, 2.5])
+                self.assertEqual(text, 'Hello \nwörld\nsecond line')
+                self.assertEqual(facet.string_colors.tolist()[1], [255, 255, 0])
+                self.assertEqual(facet.string_styles.tolist()[3], [False, True, True])
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
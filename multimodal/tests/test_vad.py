@@ -0,0 +1,78 @@
+import unittest
+
+import numpy as np
+
+from multimodal.dataset.add_vad_signal import vad_slice_audio_signal
+from multimodal.dataset.vad import EnergyVadBackend, make_vad_backend
+
+RATE = 16000
+
+
+def make_tone_burst(rng, noise_db=None, seconds=(1., 1., 1.), frequency=300., amplitude=0.3):
+    """
+    Silence (or white noise at noise_db dBFS), a tone, and silence again, as 16 bit PCM
+    :return: The audio and the (start, end) sample of the tone
+    """
+    before, tone, after = (int(RATE * s) for s in seconds)
+    audio = np.zeros(before + tone + after)
+    audio[before:before + tone] = amplitude * np.sin(2 * np.pi * frequency * np.arange(tone) / RATE)
+    if noise_db is not None:
+        audio += rng.randn(len(audio)) * 10 ** (noise_db / 20)
+    return (np.clip(audio, -1, 1) * (2**15 - 1)).astype(np.int16), (before, before + tone)
+
+
+class TestEnergyVad(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(1729)
+
+    def assertToneFrames(self, is_speech, tone, frame_length):
+        frame_starts = np.arange(len(is_speech)) * frame_length
+        inside = (frame_starts >= tone[0]) & (frame_starts + frame_length <= tone[1])
+        outside = (frame_starts + frame_length <= tone[0]) | (frame_starts >= tone[1])
+        self.assertTrue(np.all(is_speech[inside]))
+        self.assertFalse(np.any(is_speech[outside]))
+
+    def test_classify_frames(self):
+        audio, tone = make_tone_burst(self.rng)
+        vad = EnergyVadBackend()
+        is_speech = vad.classify_frames(audio, RATE)
+        frame_length = vad.get_frame_length(RATE)
+        self.assertEqual(frame_length, 480)
+        self.assertEqual(len(is_speech), len(audio) // frame_length)
+        self.assertToneFrames(is_speech, tone, frame_length)
+        self.assertEqual(len(vad.classify_frames(audio[:100], RATE)), 0)
+
+    def test_noise_floor(self):
+        # The noise is far above the fixed threshold, only the threshold relative to the noise floor rejects it
+        audio, tone = make_tone_burst(self.rng, noise_db=-30)
+        vad = EnergyVadBackend(max_zero_crossing_rate=1.)
+        self.assertToneFrames(vad.classify_frames(audio, RATE), tone, vad.get_frame_length(RATE))
+        no_margin = EnergyVadBackend(max_zero_crossing_rate=1., noise_margin_db=-100)
+        self.assertGreater(np.mean(no_margin.classify_frames(audio, RATE)), 0.9)
+        # White noise crosses zero too often to be speech
+        noise = (self.rng.randn(RATE) * 0.1 * 2**15).astype(np.int16)
+        self.assertFalse(np.any(EnergyVadBackend(noise_margin_db=-100).classify_frames(noise, RATE)))
+
+    def test_slice_audio_signal(self):
+        audio, tone = make_tone_burst(self.rng, noise_db=-50)
+        segments = list(vad_slice_audio_signal(audio, RATE, EnergyVadBackend(frame_duration_ms=20)))
+        self.assertEqual(len(segments), 1)
+        start, end, samples = segments[0]
+        self.assertLessEqual(abs(start - tone[0]), 0.1 * RATE)
+        self.assertLessEqual(abs(end - tone[1]), 0.1 * RATE)
+        np.testing.assert_array_equal(samples, audio[start:end])
+
+    def test_attrs_and_backends(self):
+        vad = make_vad_backend('energy', frame_duration_ms=20, noise_margin_db=6.)
+        self.assertIsInstance(vad, EnergyVadBackend)
+        attrs = vad.get_attrs()
+        self.assertEqual(set(attrs), {'VadBackend', 'vad_frame_duration_ms', 'vad_energy_threshold_db',
+                                      'vad_noise_margin_db', 'vad_noise_percentile', 'vad_max_zero_crossing_rate'})
+        self.assertEqual((attrs['VadBackend'], attrs['vad_frame_duration_ms'], attrs['vad_noise_margin_db']),
+                         ('energy', 20, 6.))
+        with self.assertRaises(NotImplementedError):
+            make_vad_backend('unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
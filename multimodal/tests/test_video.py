@@ -1,6 +1,15 @@
+import multiprocessing
+import os.path
+import pickle
+import shutil
+import tempfile
 import unittest
 import numpy as np
-from multimodal.dataset.video import VideoDataset
+from multimodal.dataset.video import (VideoDataset, VideoDatasets, fit_time_segments, get_aligned_frame_ranges,
+                                      set_cross_dataset_segments)
+from multimodal.dataset import handles
+from multimodal.dataset.prefetch import prefetch
+from multimodal.tests.test_batching import SUBRIP, make_subtitled_dataset
 
 class TestVideoDataset(unittest.TestCase):
     def test_stream_wrappers(self):
@@ -15,3 +24,221 @@ class TestVideoDataset(unittest.TestCase):
             subtitle_streams = dataset.get_subtitled_streams_randomized(['video', 'audio'], subtitle_id='audiodescription', rng=rng)
             for segment in subtitle_streams:
                 print(segment)
+
+
+def loop_make_random_time_segments(times, transposed_times, stream_lengths):
+    """
+    The per-segment loop SubtitlesAndRandomStreamsWrapper used to adjust the shuffled segments with
+    """
+    transposed_times = np.array(transposed_times, dtype=np.float64)
+    for i in range(len(times)):
+        original_time = times[i]
+        transposed_time = transposed_times[i]
+        diff_s = (original_time[1] - original_time[0]) - (transposed_time[1] - transposed_time[0])
+        diff_s_half = diff_s / 2
+        start, end = transposed_time
+        start -= diff_s_half
+        end += diff_s - diff_s_half
+        if diff_s >= 0:
+            if start < 0:
+                end -= start
+                start = 0
+            elif end > stream_lengths:
+                start -= end - stream_lengths
+                end = stream_lengths
+        transposed_times[i] = start, end
+    return transposed_times
+
+
+class TestRandomStreams(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        subrip_path = os.path.join(self.directory, 'subtitles.srt')
+        with open(subrip_path, 'w') as fp:
+            fp.write(SUBRIP)
+        self.dataset_paths = [os.path.join(self.directory, 'dataset{}.h5'.format(i)) for i in range(3)]
+        for i, dataset_path in enumerate(self.dataset_paths):
+            make_subtitled_dataset(dataset_path, subrip_path, offset=1000 * i)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_fit_time_segments(self):
+        rng = np.random.RandomState(1729)
+        starts = rng.uniform(0, 100, size=(1000, 2))
+        times = np.sort(starts, axis=1)
+        transposed_times = times[rng.permutation(len(times))]
+        segments = fit_time_segments(times, transposed_times, 90.)
+        np.testing.assert_array_equal(segments, loop_make_random_time_segments(times, transposed_times, 90.))
+        np.testing.assert_allclose(segments[:, 1] - segments[:, 0], times[:, 1] - times[:, 0])
+
+    def assertCrossDatasetSegments(self, collection):
+        for i in range(len(collection)):
+            wrapper_id, wrapper_item = collection.locate(i)
+            wrapper = collection.wrappers[wrapper_id]
+            text, (audio,) = collection[i]
+            source = wrapper.stream_sources[0][wrapper_item]
+            self.assertNotEqual(source, wrapper_id)
+            # The audio of each dataset is numbered from a different offset
+            self.assertTrue(np.all(audio // 1000 == source))
+            segment = wrapper.stream_times[0][wrapper_item]
+            original = wrapper.times[wrapper_item]
+            self.assertAlmostEqual(segment[1] - segment[0], original[1] - original[0])
+            self.assertTrue(0 <= segment[0] and segment[1] <= 2)
+
+    def test_cross_dataset_segments(self):
+        with VideoDatasets(self.dataset_paths) as datasets:
+            collection = datasets.get_subtitled_streams_randomized(['audio'], rng=np.random.RandomState(1),
+                                                                   cross_dataset=True)
+            self.assertEqual(len(collection), 9)
+            self.assertCrossDatasetSegments(collection)
+            # Resampling for a new epoch keeps taking the segments from the other datasets
+            with self.assertRaises(ValueError):
+                collection.wrappers[0].resample_stream_times()
+            first_sources = [wrapper.stream_sources[0].copy() for wrapper in collection.wrappers]
+            datasets.resample_stream_times(collection)
+            self.assertCrossDatasetSegments(collection)
+            self.assertFalse(all(np.array_equal(sources, wrapper.stream_sources[0])
+                                 for sources, wrapper in zip(first_sources, collection.wrappers)))
+
+            same_dataset = datasets.get_subtitled_streams_randomized(['audio'], rng=np.random.RandomState(1))
+            datasets.resample_stream_times(same_dataset)
+            self.assertTrue(all(wrapper.stream_sources is None for wrapper in same_dataset.wrappers))
+
+        with VideoDataset(self.dataset_paths[0]) as dataset:
+            with self.assertRaises(ValueError):
+                set_cross_dataset_segments([dataset.get_subtitled_streams_randomized('audio')])
+
+
+def read_wrapper_item(wrapper_item):
+    wrapper, item = wrapper_item
+    return wrapper[item]
+
+
+class TestProcesses(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        subrip_path = os.path.join(self.directory, 'subtitles.srt')
+        with open(subrip_path, 'w') as fp:
+            fp.write(SUBRIP)
+        self.dataset_paths = [os.path.join(self.directory, 'dataset{}.h5'.format(i)) for i in range(2)]
+        for i, dataset_path in enumerate(self.dataset_paths):
+            make_subtitled_dataset(dataset_path, subrip_path, offset=1000 * i)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertItemsEqual(self, items, expected_items):
+        self.assertEqual(len(items), len(expected_items))
+        for (text, frames), (expected_text, expected_frames) in zip(items, expected_items):
+            self.assertEqual(text, expected_text)
+            for stream_frames, expected_stream_frames in zip(frames, expected_frames):
+                np.testing.assert_array_equal(stream_frames, expected_stream_frames)
+
+    def test_pickle_and_processes(self):
+        with VideoDatasets(self.dataset_paths) as datasets:
+            collection = datasets.get_subtitled_streams(['audio', 'video'])
+            expected_items = [collection[i] for i in range(len(collection))]
+            self.assertItemsEqual([item for item in pickle.loads(pickle.dumps(collection))], expected_items)
+            unpickled_datasets = pickle.loads(pickle.dumps(datasets))
+            self.assertEqual(unpickled_datasets.datasets[1].get_facet('audio').get_n_frames(), 200)
+
+            # Forked workers inherit the wrapper and have to open the files again
+            self.assertItemsEqual(list(prefetch(collection, n_workers=2, processes=True)), expected_items)
+            with multiprocessing.get_context('spawn').Pool(2) as pool:
+                items = pool.map(read_wrapper_item, [(collection, i) for i in range(len(collection))])
+            self.assertItemsEqual(items, expected_items)
+
+    def test_handle_pool(self):
+        expected_items = []
+        for dataset_path in self.dataset_paths:
+            with VideoDataset(dataset_path) as dataset:
+                wrapper = dataset.get_subtitled_streams(['audio', 'video'])
+                expected_items.extend(wrapper[i] for i in range(len(wrapper)))
+        previous_max_open = handles.set_max_open(1)
+        try:
+            with VideoDatasets(self.dataset_paths) as datasets:
+                self.assertEqual(len(handles.pool), 0)
+                self.assertEqual(handles.pool.max_open, 1)
+                collection = datasets.get_subtitled_streams(['audio', 'video'])
+                stats = handles.get_stats()
+                n_opens, n_evictions = stats.n_opens, stats.n_evictions
+                # Alternating between the datasets closes and reopens the files, the facets follow transparently
+                order = np.argsort(np.arange(len(collection)) % 2, kind='stable')[::-1]
+                items = [collection[i] for i in np.concatenate([order, order])]
+                self.assertItemsEqual(items, [expected_items[i] for i in np.concatenate([order, order])])
+                self.assertLessEqual(len(handles.pool), 1)
+                self.assertGreater(stats.n_evictions, n_evictions)
+                self.assertGreater(stats.n_reopens, 0)
+                self.assertEqual(stats.n_opens - n_opens, stats.n_evictions - n_evictions)
+            self.assertEqual(len(handles.pool), 0)
+        finally:
+            handles.set_max_open(previous_max_open)
+
+
+class TestTimeWindows(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        subrip_path = os.path.join(self.directory, 'subtitles.srt')
+        with open(subrip_path, 'w') as fp:
+            fp.write(SUBRIP)
+        self.dataset_path = os.path.join(self.directory, 'dataset.h5')
+        make_subtitled_dataset(self.dataset_path, subrip_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_aligned_frame_ranges(self):
+        times = np.array([[1.2, 1.4], [0.3, 0.5], [0.7, 0.9]])
+        # Truncating the ends separately gives 119-140, 30-50 and 70-89 at 100 Hz
+        np.testing.assert_array_equal(get_aligned_frame_ranges(times, 100), [[120, 140], [30, 50], [70, 90]])
+        np.testing.assert_array_equal(get_aligned_frame_ranges(times, 10), [[12, 14], [3, 5], [7, 9]])
+
+    def test_read_time_windows(self):
+        times = [[0.12, 0.52], [1.2, 1.4], [1.9, 2.3]]
+        with VideoDataset(self.dataset_path) as dataset:
+            windows = dataset.read_time_windows(times, ['audio', 'video', ('subtitles', 'subs')])
+        audio_ranges, video_ranges, subtitle_ranges = windows.frame_ranges
+        np.testing.assert_array_equal(audio_ranges, [[12, 52], [120, 140], [190, 230]])
+        np.testing.assert_array_equal(video_ranges, [[1, 5], [12, 14], [19, 23]])
+        self.assertIsNone(subtitle_ranges)
+
+        audio, video, subtitles = windows.streams
+        np.testing.assert_array_equal(audio.lengths, [40, 20, 10])
+        self.assertEqual(audio.data.shape, (3, 40))
+        for i, (start, end) in enumerate(audio_ranges):
+            np.testing.assert_array_equal(audio.get_sequence(i), np.arange(start + 1, min(end, 200) + 1))
+        np.testing.assert_array_equal(video.lengths, [4, 2, 1])
+        frame_numbers = np.round(video.get_sequence(1).mean(axis=(1, 2, 3)) / 10).astype(int)
+        np.testing.assert_array_equal(frame_numbers, [12, 13])
+        self.assertEqual(subtitles[:2], [['First'], ['Third']])
+
+    def test_read_time_windows_shares_rates(self):
+        with VideoDataset(self.dataset_path) as dataset:
+            windows = dataset.read_time_windows([[0.12, 0.52], [1.2, 1.4]], ['audio', 'video', 'audio'])
+        # Facets of the same rate get the frame ranges computed once for the call
+        self.assertIs(windows.frame_ranges[0], windows.frame_ranges[2])
+        self.assertIsNot(windows.frame_ranges[0], windows.frame_ranges[1])
+
+    def test_sliding_windows(self):
+        with VideoDataset(self.dataset_path) as dataset:
+            for window, hop in [(0.4, 0.2), (0.5, 0.3), (0.3, 0.5)]:
+                windows = dataset.get_sliding_windows(['audio', 'video'], window, hop, chunk_seconds=0.25)
+                n_windows = 0
+                for (start, end), (audio, video) in windows:
+                    n_windows += 1
+                    (audio_start, audio_end), = get_aligned_frame_ranges([[start, end]], 100)
+                    (video_start, video_end), = get_aligned_frame_ranges([[start, end]], 10)
+                    np.testing.assert_array_equal(audio, np.arange(audio_start + 1, audio_end + 1))
+                    frame_numbers = np.round(video.mean(axis=(1, 2, 3)) / 10).astype(int)
+                    np.testing.assert_array_equal(frame_numbers, np.arange(video_start, video_end))
+                self.assertEqual(n_windows, len(windows))
+                self.assertLessEqual(end, 2. + 1e-9)
+                self.assertGreater(end + hop, 2.)
+                # Every frame within a window is read once, frames between windows are skipped
+                for frame_ranges, n_read in zip(windows.frame_ranges, windows.get_n_read()):
+                    covered = np.unique(np.concatenate([np.arange(start, end) for start, end in frame_ranges]))
+                    self.assertEqual(n_read, len(covered))
+            # The frames of a window are views which the next window overwrites, unless they are copied
+            copies = list(dataset.get_sliding_windows('audio', 0.4, 0.2, chunk_seconds=0.25, copy=True))
+            np.testing.assert_array_equal(copies[0][1][0], np.arange(1, 41))
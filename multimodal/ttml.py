@@ -0,0 +1,322 @@
+"""
+Streaming parser for Timed Text Markup Language (TTML, also known as DFXP) subtitles.
+
+The document is read with ElementTree.iterparse and every <p> element is removed from the tree as soon as it has been
+converted, so memory use doesn't grow with the size of the file. Each paragraph becomes one subtitle, split into text
+fragments with the font color and the bold, italic and underline styles given by tts:color, tts:fontWeight,
+tts:fontStyle and tts:textDecoration, either directly on the elements or through referenced <style> elements. Timing
+of <span> elements inside a paragraph is ignored, the paragraph is shown for its whole interval.
+"""
+import collections
+import logging
+import re
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+NULL_COLOR = (-1, -1, -1)
+XML_NAMESPACE = '{http://www.w3.org/XML/1998/namespace}'
+STYLE_PROPERTIES = ('color', 'fontWeight', 'fontStyle', 'textDecoration')
+NAMED_COLORS = {
+    'black': (0, 0, 0), 'silver': (192, 192, 192), 'gray': (128, 128, 128), 'white': (255, 255, 255),
+    'maroon': (128, 0, 0), 'red': (255, 0, 0), 'purple': (128, 0, 128), 'fuchsia': (255, 0, 255),
+    'magenta': (255, 0, 255), 'green': (0, 128, 0), 'lime': (0, 255, 0), 'olive': (128, 128, 0),
+    'yellow': (255, 255, 0), 'navy': (0, 0, 128), 'blue': (0, 0, 255), 'teal': (0, 128, 128),
+    'aqua': (0, 255, 255), 'cyan': (0, 255, 255),
+}
+CLOCK_TIME_REGEX = re.compile(r'^(\d+):(\d\d):(\d\d)(?:(\.\d+)|:(\d+(?:\.\d+)?))?$')
+OFFSET_TIME_REGEX = re.compile(r'^(\d+(?:\.\d+)?)(h|m|s|ms|f|t)$')
+WHITESPACE_REGEX = re.compile(r'\s+')
+
+
+class TTMLParseError(Exception):
+    pass
+
+
+class TimingParameters(object):
+    """
+    The ttp: parameters of a document which are needed to interpret time expressions
+    """
+    def __init__(self, attrib=None):
+        attrib = split_namespaces(attrib if attrib is not None else {})
+        frame_rate = float(attrib.get('frameRate', 30))
+        multiplier = attrib.get('frameRateMultiplier')
+        if multiplier is not None:
+            numerator, denominator = multiplier.split()
+            frame_rate *= float(numerator) / float(denominator)
+        self.frame_rate = frame_rate
+        self.sub_frame_rate = float(attrib.get('subFrameRate', 1))
+        if 'tickRate' in attrib:
+            self.tick_rate = float(attrib['tickRate'])
+        elif 'frameRate' in attrib:
+            self.tick_rate = frame_rate * self.sub_frame_rate
+        else:
+            self.tick_rate = 1.
+
+    def parse_time(self, expression):
+        """
+        Convert a TTML time expression to seconds
+        """
+        expression = expression.strip()
+        m = CLOCK_TIME_REGEX.match(expression)
+        if m is not None:
+            hours, minutes, seconds, fraction, frames = m.groups()
+            time = int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+            if fraction is not None:
+                time += float(fraction)
+            elif frames is not None:
+                time += float(frames) / self.frame_rate
+            return float(time)
+        m = OFFSET_TIME_REGEX.match(expression)
+        if m is not None:
+            value, metric = float(m.group(1)), m.group(2)
+            if metric == 'h':
+                return value * 3600
+            elif metric == 'm':
+                return value * 60
+            elif metric == 's':
+                return value
+            elif metric == 'ms':
+                return value / 1000
+            elif metric == 'f':
+                return value / self.frame_rate
+            else:
+                return value / self.tick_rate
+        raise TTMLParseError("Unsupported time expression: {}".format(expression))
+
+
+def split_namespaces(attrib):
+    """
+    Return the attributes keyed by their local names. Attributes in the XML namespace keep their prefix (e.g. xml:id)
+    """
+    attributes = dict()
+    for key, value in attrib.items():
+        if key.startswith(XML_NAMESPACE):
+            attributes['xml:' + key[len(XML_NAMESPACE):]] = value
+        else:
+            attributes[key.rsplit('}', 1)[-1]] = value
+    return attributes
+
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def parse_color(value):
+    """
+    Convert a tts:color value to an (r, g, b) tuple, the alpha channel is ignored
+    """
+    value = value.strip().lower()
+    if value.startswith('#') and len(value) in (7, 9):
+        return int(value[1:3], 16), int(value[3:5], 16), int(value[5:7], 16)
+    if value.startswith('rgb'):
+        components = value[value.index('(') + 1:value.rindex(')')].split(',')
+        return tuple(int(component) for component in components[:3])
+    if value in NAMED_COLORS:
+        return NAMED_COLORS[value]
+    if value != 'transparent':
+        log.warning("Unsupported color %r", value)
+    return NULL_COLOR
+
+
+def get_styles(properties):
+    """
+    Convert the style properties of an element to a tuple (color, (bold, italic, underline)). Properties which aren't
+    given are None, so they can be inherited.
+    """
+    color = properties.get('color')
+    if color is not None:
+        color = parse_color(color)
+    bold = properties.get('fontWeight')
+    if bold is not None:
+        bold = bold.strip() == 'bold'
+    italic = properties.get('fontStyle')
+    if italic is not None:
+        italic = italic.strip() in ('italic', 'oblique')
+    underline = properties.get('textDecoration')
+    if underline is not None:
+        underline = 'underline' in underline.split()
+    return color, (bold, italic, underline)
+
+
+def inherit_styles(styles, parent_styles):
+    color, flags = styles
+    parent_color, parent_flags = parent_styles
+    if color is None:
+        color = parent_color
+    return color, tuple(parent if flag is None else flag for flag, parent in zip(flags, parent_flags))
+
+
+DEFAULT_STYLES = (NULL_COLOR, (False, False, False))
+
+
+class StyleSheet(object):
+    """
+    The <style> elements of a document, with chained style references resolved
+    """
+    def __init__(self):
+        self.properties = dict()
+        self.references = dict()
+
+    def add_style(self, attributes):
+        style_id = attributes.get('xml:id')
+        if style_id is None:
+            return
+        self.properties[style_id] = {key: value for key, value in attributes.items() if key in STYLE_PROPERTIES}
+        self.references[style_id] = attributes.get('style', '').split()
+
+    def get_properties(self, style_ids, seen=None):
+        if seen is None:
+            seen = set()
+        properties = dict()
+        for style_id in style_ids:
+            if style_id in seen or style_id not in self.properties:
+                continue
+            seen.add(style_id)
+            properties.update(self.get_properties(self.references[style_id], seen))
+            properties.update(self.properties[style_id])
+        return properties
+
+    def get_element_styles(self, attributes, parent_styles):
+        """
+        The styles of an element, from its referenced styles and its own style attributes, inheriting from the parent
+        """
+        properties = self.get_properties(attributes.get('style', '').split())
+        properties.update((key, value) for key, value in attributes.items() if key in STYLE_PROPERTIES)
+        return inherit_styles(get_styles(properties), parent_styles)
+
+
+class Paragraph(collections.namedtuple('Paragraph', ['begin', 'end', 'fragments'])):
+    """
+    A subtitle from a TTML document.
+
+    :ivar begin: Start time in seconds
+    :ivar end: End time in seconds
+    :ivar fragments: List of (text, color, (bold, italic, underline)) tuples
+    """
+
+
+def get_paragraph_fragments(paragraph, style_sheet, paragraph_styles):
+    """
+    Split the text of a <p> element into fragments with the same styles. Whitespace is collapsed, and a line break
+    always ends a fragment.
+    """
+    lines = [[]]
+
+    def add_text(text, styles):
+        if text:
+            line = lines[-1]
+            if line and line[-1][1] == styles:
+                line[-1][0] += text
+            else:
+                line.append([text, styles])
+
+    def visit(element, styles):
+        add_text(element.text, styles)
+        for child in element:
+            name = local_name(child.tag)
+            if name == 'br':
+                lines.append([])
+            elif name == 'span':
+                visit(child, style_sheet.get_element_styles(split_namespaces(child.attrib), styles))
+            else:
+                visit(child, styles)
+            add_text(child.tail, styles)
+
+    visit(paragraph, paragraph_styles)
+    fragments = []
+    for line in lines:
+        line_fragments = [[WHITESPACE_REGEX.sub(' ', text), styles] for text, styles in line]
+        if line_fragments:
+            line_fragments[0][0] = line_fragments[0][0].lstrip()
+            line_fragments[-1][0] = line_fragments[-1][0].rstrip()
+        fragments.extend((text, color, flags) for text, (color, flags) in line_fragments if text)
+    return fragments
+
+
+def iter_parse(source):
+    """
+    Parse a TTML document incrementally.
+    :param source: A file name or a file object opened in binary mode
+    :return: A generator of Paragraph tuples in document order
+    """
+    timing = TimingParameters()
+    style_sheet = StyleSheet()
+    # Time offset, end time and styles of the enclosing time containers (body and div elements)
+    containers = [(0., None, DEFAULT_STYLES)]
+    elements = []
+    for event, element in ElementTree.iterparse(source, events=('start', 'end')):
+        name = local_name(element.tag)
+        if event == 'start':
+            elements.append(element)
+            if name == 'tt':
+                timing = TimingParameters(element.attrib)
+            elif name in ('body', 'div'):
+                attributes = split_namespaces(element.attrib)
+                offset, end, styles = containers[-1]
+                begin = offset
+                if 'begin' in attributes:
+                    begin += timing.parse_time(attributes['begin'])
+                if 'end' in attributes:
+                    end = offset + timing.parse_time(attributes['end'])
+                elif 'dur' in attributes:
+                    end = begin + timing.parse_time(attributes['dur'])
+                containers.append((begin, end, style_sheet.get_element_styles(attributes, styles)))
+            continue
+
+        elements.pop()
+        if name == 'style':
+            style_sheet.add_style(split_namespaces(element.attrib))
+        elif name in ('body', 'div'):
+            containers.pop()
+        elif name == 'p':
+            attributes = split_namespaces(element.attrib)
+            offset, end, styles = containers[-1]
+            begin = offset
+            if 'begin' in attributes:
+                begin += timing.parse_time(attributes['begin'])
+            if 'end' in attributes:
+                end = offset + timing.parse_time(attributes['end'])
+            elif 'dur' in attributes:
+                end = begin + timing.parse_time(attributes['dur'])
+            fragments = get_paragraph_fragments(element, style_sheet,
+                                                style_sheet.get_element_styles(attributes, styles))
+            if end is None:
+                log.warning("Skipped paragraph without end time at %.3f seconds", begin)
+            else:
+                yield Paragraph(begin, end, fragments)
+            # The paragraph has been converted, drop it so that the tree doesn't grow
+            element.clear()
+            if elements:
+                elements[-1].remove(element)
+
+
+def parse_styled(source):
+    """
+    Parse a TTML document into the arrays stored in subtitle facets.
+    :param source: A file name or a file object opened in binary mode
+    :return: A tuple (times, strings, colors, styles, string_index), where times is a float64 array of shape (n, 2)
+             with start and end times, strings is a list of text fragments, colors an int16 array of shape
+             (len(strings), 3), styles a bool array of shape (len(strings), 3) with the bold, italic and underline
+             flags and string_index an uint32 array of shape (n, 2) with the start and end indices of the strings of
+             each subtitle
+    """
+    times = []
+    strings = []
+    colors = []
+    styles = []
+    string_index = []
+    for paragraph in iter_parse(source):
+        times.append((paragraph.begin, paragraph.end))
+        string_index.append((len(strings), len(strings) + len(paragraph.fragments)))
+        for text, color, flags in paragraph.fragments:
+            strings.append(text)
+            colors.append(color)
+            styles.append(flags)
+    return (np.array(times, dtype=np.float64).reshape(-1, 2),
+            strings,
+            np.array(colors, dtype=np.int16).reshape(-1, 3),
+            np.array(styles, dtype=bool).reshape(-1, 3),
+            np.array(string_index, dtype=np.uint32).reshape(-1, 2))